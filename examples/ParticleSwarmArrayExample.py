@@ -0,0 +1,65 @@
+"""
+The particle swarm optimization of ParticleSwarmOptimizationExample.py,
+with the particles held by a ParticleSwarm instead of one agent each.
+
+Positions, velocities and best positions are arrays updated with a few
+batch operations per epoch, so the swarm can have 100000 particles.
+
+Requires Matplotlib and Numpy to be installed.
+"""
+import matplotlib.pyplot as plt
+import numpy as np
+
+from panaxea.core.Model import Model
+from panaxea.core.Steppables import Helper
+from panaxea.core.Swarm import ParticleSwarm
+
+
+class FitnessTrackerHelper(Helper):
+
+    def __init__(self):
+        super(FitnessTrackerHelper, self).__init__()
+
+    def step_epilogue(self, model):
+        model.output["best_fitness_in_epochs"].append(
+            model.properties["swarm"].global_best_fitness)
+
+
+epochs = 50
+
+model = Model(epochs)
+
+xsize = ysize = 500
+target_position = np.array([12., 12.])
+
+
+def fitness(positions):
+    # The fitness is inversely proportional to the euclidean distance between
+    # the target and each position.
+    distance = np.sqrt(((positions - target_position) ** 2).sum(axis=1))
+    return 1. / np.maximum(distance, 1e-9)
+
+
+num_agents = 100000
+
+swarm = ParticleSwarm(
+    np.random.uniform(0, [xsize, ysize], (num_agents, 2)), fitness,
+    max_speed=25., lower=[0., 0.], upper=[xsize - 1., ysize - 1.])
+
+model.properties = {"swarm": swarm}
+model.output = {"best_fitness_in_epochs": []}
+
+model.schedule.helpers.append(swarm)
+model.schedule.helpers.append(FitnessTrackerHelper())
+
+model.run()
+plt.figure()
+plt.scatter(range(model.current_epoch + 1), model.output[
+    "best_fitness_in_epochs"])
+plt.xlabel("Epoch")
+plt.ylabel("Best Fitness")
+plt.title("Best Fitness across Epochs")
+plt.show()
+
+print("Best fitness obtained: {0}".format(swarm.global_best_fitness))
+print("Best position found: {0}".format(swarm.global_best_position))
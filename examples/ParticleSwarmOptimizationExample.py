@@ -12,7 +12,7 @@ from numpy.random import randint
 
 from panaxea.core.Environment import ObjectGrid2D
 from panaxea.core.Model import Model
-from panaxea.core.Steppables import Agent, Helper
+from panaxea.core.Steppables import Agent, EnvironmentHandle, Helper
 
 
 class PSOAgent(Agent):
@@ -23,27 +23,26 @@ class PSOAgent(Agent):
     ----------
     position : tuple
         A tuple specifying an x and y coordinate.
+    grid : EnvironmentHandle
+        The handle through which the agent moves in the agents'
+        environment.
     """
 
-    def __init__(self, position):
+    def __init__(self, position, grid):
         super(PSOAgent, self).__init__()
         self.position = position
+        self.grid = grid
         self.bestFit = 0
 
     def step_prologue(self, model):
         # We get the fitness as proportional to the euclidean distance between
         # the target and current position.
 
-        # If the exit flag is true then it means another agent found the
-        # target position, no need to do anything.
-        if model.exit:
-            return
-
-        # If we found the target position no ned to do anything else.
+        # If we found the target position the simulation is over, aborting
+        # skips all remaining agents straight away.
         if self.position == model.properties["target_position"]:
             model.properties["best_position"] = self.position
-            model.exit = True
-            return
+            model.abort("Target position found")
 
         fitness = 1. / math.sqrt(
             (model.properties["target_position"][0] - self.position[0]) ** 2 +
@@ -60,11 +59,7 @@ class PSOAgent(Agent):
             model.properties["best_position"] = self.position
 
     def step_main(self, model):
-
-        if model.exit:
-            return
-
-        agent_env = model.environments["agent_env"]
+        agent_env = self.grid.environment
 
         # We add some noise to prevent all agents from just flocking to the
         # one that, by chance, initially was closest to the target
@@ -112,9 +107,10 @@ class PSOAgent(Agent):
         if selfy > maxy:
             selfy = maxy
 
-        # Positions must be whole numbers, so we round
-        self.position = (round(selfx), round(selfy))
-        self.move_agent("agent_env", self.position, model)
+        # Positions must be whole numbers, so we round. The position is
+        # within the grid, so the move does not need to be checked
+        self.position = (int(round(selfx)), int(round(selfy)))
+        self.grid.move_unchecked(self, self.position)
 
 
 class FitnessTrackerHelper(Helper):
@@ -133,6 +129,10 @@ model = Model(epochs)
 
 xsize = ysize = 500
 ObjectGrid2D("agent_env", xsize, ysize, model)
+
+# Agents move through a handle, which resolves the environment once and is
+# kept by each agent
+grid = EnvironmentHandle(model, "agent_env")
 target_position = (12, 12)
 
 model.properties = {
@@ -149,7 +149,7 @@ num_agents = 20
 
 for _ in range(num_agents):
     agent_position = (randint(0, xsize), randint(0, ysize))
-    agent = PSOAgent(agent_position)
+    agent = PSOAgent(agent_position, grid)
 
     model.schedule.agents.add(agent)
     agent.add_agent_to_grid("agent_env", agent_position, model)
@@ -158,13 +158,12 @@ model.schedule.helpers.append(FitnessTrackerHelper())
 
 model.run()
 plt.figure()
-plt.scatter(range(model.current_epoch + 1), model.output[
-    "best_fitness_in_epochs"])
+plt.scatter(range(len(model.output["best_fitness_in_epochs"])),
+            model.output["best_fitness_in_epochs"])
 plt.xlabel("Epoch")
 plt.ylabel("Best Fitness")
 plt.title("Best Fitness across Epochs")
 plt.show()
 
-print("Best fitness obtained: {0}".format(
-    model.output["best_fitness_in_epochs"][-1]))
+print("Best fitness obtained: {0}".format(model.properties["best_fitness"]))
 print("Best position found: {0}".format(model.properties["best_position"]))
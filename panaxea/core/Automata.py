@@ -0,0 +1,267 @@
+"""
+Update rules for cellular automata running on lattice grids.
+
+Each rule is a callable which can be registered on a LatticeGrid with
+add_rule. Rules count neighbours for the whole grid at once with shifted
+sums (see Numerics.neighbourhood_sum) and map the counts to new states with
+lookup tables, so a generation costs a handful of array operations
+regardless of the size of the grid.
+
+By default a rule counts the neighbours in the lattice it updates. Rules
+can instead be given the name of another lattice as their *source*, so
+that several lattices of the same shape can act as the state layers of a
+single automaton (eg: cells which grow where a nutrient layer is high).
+
+Requires NumPy.
+"""
+import re
+
+from panaxea.core import Numerics
+from panaxea.core.Numerics import np
+from panaxea.core.Stencils import Stencil
+
+
+class Rule(object):
+    """
+    Base class for cellular automaton rules, holding the neighbourhood and
+    source lattice shared by all rules and the neighbour_sum helper.
+    Subclasses implement __call__(lattice, model), returning the new states
+    of the lattice.
+
+    Any callable taking the lattice and the model can be added to a lattice
+    with add_rule, extending Rule is only needed to reuse these helpers.
+
+    This class would **not** be itself instantiated, but would be extended
+    by LifeRule, TotalisticRule, KernelRule or user-defined rules.
+
+    Attributes
+    ----------
+    stencil : Stencil, optional
+        The neighbourhood of each cell. Defaults to the moore neighbourhood.
+    source : string, optional
+        The name of the lattice whose states are counted. Defaults to the
+        lattice being updated.
+    """
+
+    def __init__(self, stencil=None, source=None):
+        Numerics.require_numpy(self.__class__.__name__)
+        self.stencil = stencil
+        self.source = source
+
+    def _source(self, lattice, model):
+        if self.source is None:
+            return lattice
+
+        return model.environments[self.source]
+
+    def neighbour_sum(self, lattice, model, states=None, weights=None):
+        """
+        Sums the states of the neighbours of every cell.
+
+        Parameters
+        ----------
+        lattice : LatticeGrid
+            The lattice being updated.
+        model : Model
+            The instance of the model.
+        states : numpy.ndarray, optional
+            The states to sum. Defaults to the current states of the
+            source lattice.
+        weights : numpy.ndarray, optional
+            One weight per offset of the stencil. Defaults to all ones.
+
+        Returns
+        -------
+        numpy.ndarray
+            The sum over the neighbourhood of each cell.
+        """
+        source = self._source(lattice, model)
+
+        if states is None:
+            states = source.current
+
+        stencil = self.stencil or Stencil.moore(states.ndim)
+        return Numerics.neighbourhood_sum(states, stencil.as_array(),
+                                          source.boundary, weights)
+
+    def __call__(self, lattice, model):
+        """
+        Placeholder to enforce that all rules implement __call__ with the
+        correct signature. Child classes must override it.
+
+        Parameters
+        ----------
+        lattice : LatticeGrid
+            The lattice being updated.
+        model : Model
+            The instance of the model.
+
+        Returns
+        -------
+        numpy.ndarray
+            The new states of the lattice.
+        """
+        raise NotImplementedError("%s does not implement __call__" %
+                                  self.__class__.__name__)
+
+
+class LifeRule(Rule):
+    """
+    A Life-like rule: cells are either dead (0) or alive (1), a dead cell is
+    born if its number of live neighbours is in the birth set and a live
+    cell survives if it is in the survival set.
+
+    Rules can be given in the usual B/S notation, eg: "B3/S23" for
+    Conway's Game of Life or "B36/S23" for HighLife, or as a pair of
+    collections of counts, which allows counts above 8 for larger
+    neighbourhoods.
+
+    Attributes
+    ----------
+    rule : string or tuple, optional
+        The rule in B/S notation, or a (birth, survival) pair. Defaults to
+        "B3/S23".
+    stencil : Stencil, optional
+        The neighbourhood of each cell. Defaults to the moore neighbourhood.
+    source : string, optional
+        The name of the lattice whose live cells are counted. Defaults to
+        the lattice being updated.
+    """
+
+    def __init__(self, rule="B3/S23", stencil=None, source=None):
+        super(LifeRule, self).__init__(stencil, source)
+
+        if isinstance(rule, str):
+            self.birth, self.survival = self.parse(rule)
+        else:
+            self.birth = frozenset(int(c) for c in rule[0])
+            self.survival = frozenset(int(c) for c in rule[1])
+
+        self._tables = dict()
+
+    @staticmethod
+    def parse(notation):
+        """
+        Parses a rule in B/S notation.
+
+        Parameters
+        ----------
+        notation : string
+            The rule, eg: "B3/S23". The order of the two parts and the case
+            of the letters do not matter.
+
+        Returns
+        -------
+        tuple
+            The birth and survival counts, as two frozensets.
+        """
+        match = re.match(r"^\s*B(\d*)\s*/\s*S(\d*)\s*$", notation, re.I) or \
+            re.match(r"^\s*S(?P<s>\d*)\s*/\s*B(?P<b>\d*)\s*$", notation,
+                     re.I)
+
+        if match is None:
+            raise ValueError("Invalid rule %s, expected B/S notation such "
+                             "as B3/S23" % notation)
+
+        if "b" in match.groupdict():
+            birth, survival = match.group("b"), match.group("s")
+        else:
+            birth, survival = match.group(1), match.group(2)
+
+        return frozenset(int(c) for c in birth), \
+            frozenset(int(c) for c in survival)
+
+    def _lookup(self, neighbours):
+        """
+        Returns (and caches) the birth and survival tables for a
+        neighbourhood of the given size.
+        """
+        if neighbours not in self._tables:
+            birth = np.zeros(neighbours + 1, dtype=bool)
+            survival = np.zeros(neighbours + 1, dtype=bool)
+            birth[[c for c in self.birth if c <= neighbours]] = True
+            survival[[c for c in self.survival if c <= neighbours]] = True
+            self._tables[neighbours] = birth, survival
+
+        return self._tables[neighbours]
+
+    def __call__(self, lattice, model):
+        alive = self._source(lattice, model).current != 0
+        stencil = self.stencil or Stencil.moore(alive.ndim)
+        birth, survival = self._lookup(len(stencil))
+        counts = self.neighbour_sum(lattice, model, alive)
+
+        if self.source is not None:
+            alive = lattice.current != 0
+
+        return np.where(alive, survival[counts], birth[counts])
+
+
+class TotalisticRule(Rule):
+    """
+    An outer totalistic rule: the new state of a cell is looked up from
+    its own state and the sum of the states of its neighbours.
+
+    Attributes
+    ----------
+    table : array-like
+        A table with one row per state and one column per possible
+        neighbourhood sum, holding the new states. It must cover every sum
+        that can occur.
+    stencil : Stencil, optional
+        The neighbourhood of each cell. Defaults to the moore neighbourhood.
+    source : string, optional
+        The name of the lattice whose states are summed. Defaults to the
+        lattice being updated.
+    """
+
+    def __init__(self, table, stencil=None, source=None):
+        super(TotalisticRule, self).__init__(stencil, source)
+        self.table = np.asarray(table)
+
+        if self.table.ndim != 2:
+            raise ValueError("A totalistic rule table needs one row per "
+                             "state and one column per neighbourhood sum")
+
+    def __call__(self, lattice, model):
+        sums = self.neighbour_sum(lattice, model)
+        return self.table[lattice.current, sums]
+
+
+class KernelRule(Rule):
+    """
+    A rule defined by a convolution kernel and a transition function. The
+    kernel weighs the states of the neighbours of each cell, and the
+    transition function computes the new states from the current states
+    and the weighted sums.
+
+    Attributes
+    ----------
+    kernel : array-like
+        The weights of the neighbourhood, with an odd size along every axis
+        and the cell itself at the centre. Positions with a weight of zero
+        are not part of the neighbourhood.
+    transition : callable
+        A function taking the current states and the weighted sums (two
+        arrays with the shape of the grid) and returning the new states.
+    source : string, optional
+        The name of the lattice whose states are weighed. Defaults to the
+        lattice being updated.
+    """
+
+    def __init__(self, kernel, transition, source=None):
+        kernel = np.asarray(kernel)
+
+        if any(n % 2 == 0 for n in kernel.shape):
+            raise ValueError("A kernel needs an odd size along every axis")
+
+        nonzero = np.argwhere(kernel != 0)
+        centre = np.array(kernel.shape) // 2
+
+        super(KernelRule, self).__init__(Stencil(nonzero - centre), source)
+        self.weights = kernel[tuple(nonzero.T)]
+        self.transition = transition
+
+    def __call__(self, lattice, model):
+        sums = self.neighbour_sum(lattice, model, weights=self.weights)
+        return self.transition(lattice.current, sums)
@@ -1,6 +1,27 @@
-from collections import defaultdict
+import gc
+import math
+from array import array
+from itertools import product
 from random import shuffle
 
+from panaxea.core import Numerics
+from panaxea.core.Numerics import CLIP, REFLECT, WRAP, np
+from panaxea.core.Stencils import MOORE_OFFSETS_2D, MOORE_OFFSETS_3D, \
+    Stencil
+from panaxea.core.Steppables import environment_slot
+from panaxea.core.Storage import ChunkedCellStore, MappedCellStore, \
+    SharedCellStore, SparseCellStore
+
+BOUNDARY_MODES = (CLIP, WRAP, REFLECT)
+
+RANDOM = "random"
+PRIORITY = "priority"
+MOVE_POLICIES = (RANDOM, PRIORITY)
+
+# Object grids with more positions than this do not keep their occupancy
+# counts in a dense array unless asked to (16 MiB of counts)
+DENSE_OCCUPANCY_LIMIT = 1 << 22
+
 
 class Environment(object):
     """
@@ -19,14 +40,333 @@ class Environment(object):
     model : model
         The instance of the model class to which the environment will be
         attached.
+
+    The environment also holds the slot under which compact agents store
+    their position in it (see environment_slot), resolved once when it is
+    created or unpickled.
     """
 
     def __init__(self, name, model):
         self.name = name
+        self.slot = environment_slot(name)
         model.environments[name] = self
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+        # Slots are specific to a process
+        self.slot = environment_slot(self.name)
+
+    def normalize_position(self, position):
+        """
+        Maps a position to the canonical position it refers to in this
+        environment. Environments without boundary handling return the
+        position unchanged.
+
+        Parameters
+        ----------
+        position : tuple
+            The position to map.
+
+        Returns
+        -------
+        tuple
+            The canonical position.
+        """
+        return position
+
+
+class Grid(Environment, object):
+    """
+    Initializes a generic lattice environment. Holds the behaviour shared by
+    2D and 3D grids with regards to boundaries.
+
+    A grid may treat its boundaries in one of three ways:
+
+    * **clip** - positions outside the grid are invalid. Neighbourhoods at
+      the edges are truncated and agents can not be moved outside the grid.
+    * **wrap** - the grid is a torus. Positions outside the grid wrap
+      around to the opposite edge, so neighbourhoods at the edges include
+      positions on the opposite side of the grid.
+    * **reflect** - positions outside the grid are mirrored back into the
+      grid, so an agent moving past an edge bounces back in.
+
+    Boundary handling is applied by the neighbourhood and movement APIs
+    themselves. Neighbourhoods of positions away from the edges are built
+    directly from a precomputed table of offsets without any bounds checks,
+    and only positions at the edges pay for boundary handling.
+
+    This class would **not** be instantiated itself. It would be extended by
+    Grid2D and Grid3D.
+
+    Attributes
+    ----------
+    name : string
+        The name of the environment, this will be used when referring to it
+        throughout the code. (Eg: AgentEnv,
+        OxygenEnv, etc.)
+    size : tuple
+        The number of positions along each axis.
+    model : model
+        The instance of the model class to which the environment will be
+        attached.
+    boundary : string, optional
+        One of "clip", "wrap" or "reflect". Defaults to "clip".
+    """
+
+    # Grids pickled before boundary modes were available clip
+    boundary = CLIP
+
+    def __init__(self, name, size, model, boundary=CLIP):
+        super(Grid, self).__init__(name, model)
+
+        if boundary not in BOUNDARY_MODES:
+            raise ValueError("Unknown boundary mode %s, expected one of %s" %
+                             (str(boundary), ", ".join(BOUNDARY_MODES)))
+
+        self.boundary = boundary
+        self._size = tuple(size)
+        self._flat_offset_cache = dict()
+
+    def __setstate__(self, state):
+        super(Grid, self).__setstate__(state)
+
+        # Grids pickled before boundary modes were available only recorded
+        # their size along each axis by name
+        if "_size" not in state:
+            self._size = tuple([state[axis] for axis in
+                                ("xsize", "ysize", "zsize") if axis in state])
+            self._flat_offset_cache = dict()
+
+    def normalize_position(self, position):
+        """
+        Maps a position to the position it refers to within the grid
+        according to the grid's boundary mode.
+
+        For wrapping grids out of bound coordinates wrap around to the
+        opposite edge, for reflecting grids they are mirrored back into the
+        grid. Grids which clip their boundaries return the position
+        unchanged, leaving it to valid_position to reject it.
+
+        Parameters
+        ----------
+        position : tuple
+            The position to map.
+
+        Returns
+        -------
+        tuple
+            The position within the grid.
+        """
+        if self.boundary == CLIP:
+            return position
+
+        if self.boundary == WRAP:
+            return tuple([c % n for c, n in zip(position, self._size)])
+
+        normalized = []
+
+        for c, n in zip(position, self._size):
+            if not n > c >= 0:
+                c %= 2 * n
+                if c >= n:
+                    c = 2 * n - 1 - c
+            normalized.append(c)
+
+        return tuple(normalized)
+
+    def normalize_positions(self, positions):
+        """
+        Maps many positions into the grid according to its boundary mode in
+        one call. See normalize_position.
+
+        Requires NumPy.
+
+        Parameters
+        ----------
+        positions : iterable or numpy.ndarray
+            The positions, as a sequence of tuples or as an integer array of
+            shape (n, 2) or (n, 3).
+
+        Returns
+        -------
+        numpy.ndarray
+            The mapped positions, as an array of shape (n, 2) or (n, 3). On
+            grids which clip their boundaries, positions are unchanged.
+        """
+        Numerics.require_numpy("Grid.normalize_positions")
+        coordinates = Numerics.as_positions(positions, len(self._size))
+
+        if self.boundary == CLIP:
+            return coordinates
+
+        return Numerics.map_coordinates(coordinates, self._size,
+                                        self.boundary)[0]
+
+    def valid_positions(self, positions):
+        """
+        Checks many positions against the size of the grid in one call. See
+        valid_position.
+
+        Requires NumPy.
+
+        Parameters
+        ----------
+        positions : iterable or numpy.ndarray
+            The positions, as a sequence of tuples or as an integer array of
+            shape (n, 2) or (n, 3).
+
+        Returns
+        -------
+        numpy.ndarray
+            A boolean array, true for each valid position.
+        """
+        Numerics.require_numpy("Grid.valid_positions")
+        coordinates = Numerics.as_positions(positions, len(self._size))
+        return np.all((coordinates >= 0) & (coordinates < self._size),
+                      axis=1)
+
+    def to_indices(self, positions):
+        """
+        Converts many positions to flat indices in one call. See to_index.
+
+        Requires NumPy.
+
+        Parameters
+        ----------
+        positions : iterable or numpy.ndarray
+            Valid positions in the grid, as a sequence of tuples or as an
+            integer array of shape (n, 2) or (n, 3).
+
+        Returns
+        -------
+        numpy.ndarray
+            The flat indices of the positions.
+        """
+        Numerics.require_numpy("Grid.to_indices")
+        coordinates = Numerics.as_positions(positions, len(self._size))
+        return np.ravel_multi_index(tuple(coordinates.T), self._size)
+
+    def from_indices(self, indices):
+        """
+        Converts many flat indices back to positions in one call. See
+        from_index.
+
+        Requires NumPy.
+
+        Parameters
+        ----------
+        indices : iterable or numpy.ndarray
+            Flat indices.
+
+        Returns
+        -------
+        numpy.ndarray
+            The positions, as an integer array of shape (n, 2) or (n, 3).
+        """
+        Numerics.require_numpy("Grid.from_indices")
+        coordinates = np.unravel_index(np.asarray(indices, dtype=np.intp),
+                                       self._size)
+        return np.stack(coordinates, axis=-1).reshape(-1, len(self._size))
+
+    def _edge_neighbourhood(self, position, offsets):
+        """
+        Builds the neighbourhood of a position close to the edges of the
+        grid, applying the grid's boundary mode. Duplicated positions, which
+        may arise when wrapping or reflecting small grids, are removed, as
+        is the position itself unless the offsets include the origin.
+        """
+        centre = tuple(position[:len(self._size)])
+        neigh = [tuple([c + o for c, o in zip(centre, offset)])
+                 for offset in offsets]
+
+        if self.boundary == CLIP:
+            return [n for n in neigh if self.valid_position(n)]
+
+        centre = self.normalize_position(centre)
+        seen = set()
+        unique = []
+
+        for offset, n in zip(offsets, neigh):
+            n = self.normalize_position(n)
+            if n in seen or (n == centre and any(offset)):
+                continue
+            seen.add(n)
+            unique.append(n)
+
+        return unique
+
+    def _is_interior(self, position, reach):
+        for c, n in zip(position, self._size):
+            if not reach <= c < n - reach:
+                return False
+        return True
+
+    def get_neighbourhood(self, position, stencil=None, shuffle_neigh=True,
+                          flat=False):
+        """
+        Returns the neighbourhood of a position described by a stencil.
+
+        Positions far enough from the edges for the whole stencil to fit in
+        the grid are generated directly from the stencil's offsets, without
+        any per-neighbour bounds check. At the edges, the neighbourhood
+        depends on the grid's boundary mode.
+
+        Parameters
+        ----------
+        position : tuple
+            The position whose neighbourhood we wish to generate.
+        stencil : Stencil, optional
+            The shape of the neighbourhood, eg: Stencil.von_neumann(2) or
+            Stencil.moore(3, radius=2). Defaults to the radius 1 Moore
+            neighbourhood.
+        shuffle_neigh : bool, optional
+            If set to true the list of neighbours will be shuffled and
+            returned in a random order. Defaults to true.
+        flat : bool, optional
+            If set to true, neighbours are returned as flat indices (see
+            to_index) rather than tuples. Defaults to false.
+
+        Returns
+        -------
+        list
+            A list of neighbouring positions or indices.
+        """
+        if stencil is None:
+            stencil = Stencil.moore(len(self._size))
+
+        if not self._is_interior(position, stencil.reach):
+            neigh = self._edge_neighbourhood(position, stencil.offsets)
+            if flat:
+                to_index = self.to_index
+                neigh = [to_index(n) for n in neigh]
+        elif flat:
+            base = self.to_index(position)
+            neigh = [base + d for d in self._flat_offsets(stencil)]
+        else:
+            neigh = self._shift(position, stencil.offsets)
+
+        if shuffle_neigh:
+            shuffle(neigh)
+
+        return neigh
+
+    def _flat_offsets(self, stencil):
+        """
+        Returns the offsets of a stencil as differences of flat indices.
+        These only apply to positions whose whole neighbourhood lies within
+        the grid, and are cached per stencil.
+        """
+        flat = self._flat_offset_cache.get(stencil)
+
+        if flat is None:
+            flat = [self.to_index(o) for o in stencil.offsets]
+            self._flat_offset_cache[stencil] = flat
+
+        return flat
 
-class Grid3D(Environment, object):
+
+class Grid3D(Grid, object):
     """
     Initializes a 3D Grid object. Assigns the name, size and binds it to a
     model instance.
@@ -55,10 +395,14 @@ class Grid3D(Environment, object):
     model : model
         The instance of the model class to which the environment will be
         attached.
+    boundary : string, optional
+        How the grid treats its boundaries, one of "clip", "wrap" or
+        "reflect". See Grid. Defaults to "clip".
     """
 
-    def __init__(self, name, xsize, ysize, zsize, model):
-        super(Grid3D, self).__init__(name, model)
+    def __init__(self, name, xsize, ysize, zsize, model, boundary=CLIP):
+        super(Grid3D, self).__init__(name, (xsize, ysize, zsize), model,
+                                     boundary)
         self.xsize = xsize
         self.ysize = ysize
         self.zsize = zsize
@@ -84,12 +428,55 @@ class Grid3D(Environment, object):
         return self.xsize > position[0] >= 0 and self.ysize > position[
             1] >= 0 and self.zsize > position[2] >= 0
 
+    def to_index(self, position):
+        """
+        Converts a position to a flat index. Positions are laid out in
+        row-major order, so the index of (x, y, z) is
+        (x * ysize + y) * zsize + z, matching a NumPy array of shape
+        (xsize, ysize, zsize).
+
+        Parameters
+        ----------
+        position : tuple
+            A valid position in the grid.
+
+        Returns
+        -------
+        int
+            The flat index of the position.
+        """
+        return (position[0] * self.ysize + position[1]) * self.zsize + \
+            position[2]
+
+    def from_index(self, index):
+        """
+        Converts a flat index back to a position. See to_index.
+
+        Parameters
+        ----------
+        index : int
+            A flat index.
+
+        Returns
+        -------
+        tuple
+            The position corresponding to the index.
+        """
+        xy, z = divmod(index, self.zsize)
+        x, y = divmod(xy, self.ysize)
+        return x, y, z
+
+    def _shift(self, position, offsets):
+        x, y, z = position[0], position[1], position[2]
+        return [(x + dx, y + dy, z + dz) for dx, dy, dz in offsets]
+
     def get_moore_neighbourhood(self, position, shuffle_neigh=True):
         """
         Returns a list of moore neighbours for a given position.
 
         A moore neighbourhood is intended as all positions immediately
-        adjacent to a target one.
+        adjacent to a target one. At the edges of the grid, the
+        neighbourhood depends on the grid's boundary mode.
 
         Parameters
         ----------
@@ -105,36 +492,14 @@ class Grid3D(Environment, object):
         list
             A list of moore neighbours
         """
-        neigh = [
-            (position[0] + 1, position[1] + 1, position[2] + 1),
-            (position[0] + 1, position[1] + 1, position[2] - 1),
-            (position[0] + 1, position[1] + 1, position[2]),
-            (position[0] + 1, position[1] - 1, position[2] + 1),
-            (position[0] + 1, position[1] - 1, position[2] - 1),
-            (position[0] + 1, position[1] - 1, position[2]),
-            (position[0] + 1, position[1], position[2] + 1),
-            (position[0] + 1, position[1], position[2] - 1),
-            (position[0] + 1, position[1], position[2]),
-            (position[0], position[1] + 1, position[2] + 1),
-            (position[0], position[1] + 1, position[2] - 1),
-            (position[0], position[1] + 1, position[2]),
-            (position[0], position[1] - 1, position[2] + 1),
-            (position[0], position[1] - 1, position[2] - 1),
-            (position[0], position[1] - 1, position[2]),
-            (position[0], position[1], position[2] + 1),
-            (position[0], position[1], position[2] - 1),
-            (position[0] - 1, position[1] + 1, position[2] + 1),
-            (position[0] - 1, position[1] + 1, position[2] - 1),
-            (position[0] - 1, position[1] + 1, position[2]),
-            (position[0] - 1, position[1] - 1, position[2] + 1),
-            (position[0] - 1, position[1] - 1, position[2] - 1),
-            (position[0] - 1, position[1] - 1, position[2]),
-            (position[0] - 1, position[1], position[2] + 1),
-            (position[0] - 1, position[1], position[2] - 1),
-            (position[0] - 1, position[1], position[2]),
-        ]
-
-        neigh = [n for n in neigh if self.valid_position(n)]
+        x, y, z = position[0], position[1], position[2]
+
+        if 0 < x < self.xsize - 1 and 0 < y < self.ysize - 1 and \
+                0 < z < self.zsize - 1:
+            neigh = [(x + dx, y + dy, z + dz)
+                     for dx, dy, dz in MOORE_OFFSETS_3D]
+        else:
+            neigh = self._edge_neighbourhood(position, MOORE_OFFSETS_3D)
 
         if shuffle_neigh:
             shuffle(neigh)
@@ -142,7 +507,7 @@ class Grid3D(Environment, object):
         return neigh
 
 
-class Grid2D(Environment, object):
+class Grid2D(Grid, object):
     """
     Initializes a 2D Grid object. Assigns the name, size and binds it to a
     model instance.
@@ -168,10 +533,13 @@ class Grid2D(Environment, object):
     model : model
         The instance of the model class to which the environment will be
         attached.
+    boundary : string, optional
+        How the grid treats its boundaries, one of "clip", "wrap" or
+        "reflect". See Grid. Defaults to "clip".
     """
 
-    def __init__(self, name, xsize, ysize, model):
-        super(Grid2D, self).__init__(name, model)
+    def __init__(self, name, xsize, ysize, model, boundary=CLIP):
+        super(Grid2D, self).__init__(name, (xsize, ysize), model, boundary)
         self.xsize = xsize
         self.ysize = ysize
 
@@ -195,12 +563,51 @@ class Grid2D(Environment, object):
         """
         return self.xsize > position[0] >= 0 and self.ysize > position[1] >= 0
 
+    def to_index(self, position):
+        """
+        Converts a position to a flat index. Positions are laid out in
+        row-major order, so the index of (x, y) is x * ysize + y, matching a
+        NumPy array of shape (xsize, ysize).
+
+        Parameters
+        ----------
+        position : tuple
+            A valid position in the grid.
+
+        Returns
+        -------
+        int
+            The flat index of the position.
+        """
+        return position[0] * self.ysize + position[1]
+
+    def from_index(self, index):
+        """
+        Converts a flat index back to a position. See to_index.
+
+        Parameters
+        ----------
+        index : int
+            A flat index.
+
+        Returns
+        -------
+        tuple
+            The position corresponding to the index.
+        """
+        return divmod(index, self.ysize)
+
+    def _shift(self, position, offsets):
+        x, y = position[0], position[1]
+        return [(x + dx, y + dy) for dx, dy in offsets]
+
     def get_moore_neighbourhood(self, position, shuffle_neigh=True):
         """
         Returns a list of moore neighbours for a given position.
 
         A moore neighbourhood is intended as all positions immediately
-        adjacent to a target one.
+        adjacent to a target one. At the edges of the grid, the
+        neighbourhood depends on the grid's boundary mode.
 
         Parameters
         ----------
@@ -216,18 +623,12 @@ class Grid2D(Environment, object):
         list
             A list of moore neighbours
         """
-        neigh = [
-            (position[0] + 1, position[1] - 1),
-            (position[0] + 1, position[1]),
-            (position[0] + 1, position[1] + 1),
-            (position[0], position[1] - 1),
-            (position[0], position[1] + 1),
-            (position[0] - 1, position[1] - 1),
-            (position[0] - 1, position[1]),
-            (position[0] - 1, position[1] + 1),
-        ]
+        x, y = position[0], position[1]
 
-        neigh = [n for n in neigh if self.valid_position(n)]
+        if 0 < x < self.xsize - 1 and 0 < y < self.ysize - 1:
+            neigh = [(x + dx, y + dy) for dx, dy in MOORE_OFFSETS_2D]
+        else:
+            neigh = self._edge_neighbourhood(position, MOORE_OFFSETS_2D)
 
         if shuffle_neigh:
             shuffle(neigh)
@@ -245,12 +646,270 @@ class ObjectGrid(object):
     the grid. It also exposes methods to get
     agent densities at various positions.
 
+    Only occupied positions are stored in the grid. Reading an empty
+    position returns an empty (immutable) set without storing it, and
+    positions are dropped from the grid as soon as their last agent leaves.
+
+    Unless disabled, the grid also maintains the number of agents at each
+    position (see occupancy). This is kept up to date as agents are added,
+    moved and removed, so that density queries are answered by reading the
+    counts rather than by inspecting the sets of agents. By default, grids
+    of up to DENSE_OCCUPANCY_LIMIT (about four million) positions hold the
+    counts in a dense array, which costs four bytes per position of the
+    grid whether it is occupied or not. Larger grids hold them in chunks
+    allocated on demand (see chunk_size and ChunkedCellStore), so that
+    memory grows with the region the agents occupy, or do not track them
+    at all if NumPy is not installed.
+
     This class would **not** be itself instantiated, but would be extended
     by another class that would implement it.
+
+    A grid may also be given a capacity, the maximum number of agents each
+    position can hold. Adding or moving an agent to a full position then
+    fails (and the corresponding methods return False).
+
+    By default, moving an agent updates the grid immediately, so the outcome
+    of a phase may depend on the order in which agents are stepped. With
+    synchronous moves enabled, Agent.move_agent instead records a move
+    intent, and all intents are resolved together by the schedule at the
+    end of the phase (see resolve_moves). On grids with a capacity,
+    conflicting intents are settled by the grid's move policy.
+
+    Attributes
+    ----------
+    track_occupancy : bool or string, optional
+        If set to true, the occupancy counts are maintained, in a dense
+        array or in chunks depending on the size of the grid. If set to
+        "dense", they are held in a dense array whatever the size of the
+        grid. If set to false, they are not maintained. Defaults to true.
+    capacity : int, optional
+        The maximum number of agents per position. Defaults to None,
+        meaning positions can hold any number of agents.
+    synchronous_moves : bool, optional
+        If set to true, agent moves are collected as intents and applied at
+        the end of each phase. Defaults to false.
+    move_policy : string, optional
+        How conflicting move intents are settled, either "random" (winners
+        are drawn at random) or "priority" (intents with a higher priority
+        win, ties are drawn at random). Defaults to "random".
+    chunk_size : int, optional
+        If set, occupancy counts are held in chunks of chunk_size positions
+        along each axis, allocated on demand, rather than in a dense array.
+        Requires NumPy. Defaults to None, meaning chunks of 16 positions
+        along each axis for grids too large for a dense array.
     """
 
-    def __init__(self):
-        self.grid = defaultdict(set)
+    # Grids pickled before occupancy counts, capacities, synchronous moves
+    # or chunked occupancy were available have none of them. Such grids
+    # never record move intents, so an empty tuple stands for their list.
+    _chunked = False
+    occupancy = None
+    capacity = None
+    synchronous_moves = False
+    move_policy = RANDOM
+    move_intents = ()
+
+    def __init__(self, track_occupancy=True, capacity=None,
+                 synchronous_moves=False, move_policy=RANDOM,
+                 chunk_size=None):
+        if capacity is not None and capacity < 1:
+            raise ValueError("capacity must be at least 1, got %s" %
+                             str(capacity))
+
+        if move_policy not in MOVE_POLICIES:
+            raise ValueError("Unknown move policy %s, expected one of %s" %
+                             (str(move_policy), ", ".join(MOVE_POLICIES)))
+
+        self.capacity = capacity
+        self.synchronous_moves = synchronous_moves
+        self.move_policy = move_policy
+        self.move_intents = []
+        self.grid = SparseCellStore(frozenset)
+
+        cells = 1
+        for n in self._size:
+            cells *= n
+
+        if track_occupancy is True and chunk_size is None and \
+                cells > DENSE_OCCUPANCY_LIMIT:
+            if np is None:
+                track_occupancy = False
+            else:
+                chunk_size = 16
+
+        self._chunked = bool(track_occupancy) and \
+            track_occupancy != "dense" and chunk_size is not None
+
+        if self._chunked:
+            self.occupancy = ChunkedCellStore(self._size, chunk_size,
+                                              dtype="i")
+        elif track_occupancy:
+            self.occupancy = array("i", [0]) * cells
+        else:
+            self.occupancy = None
+
+    def _add_to_cell(self, agent, position):
+        cell = self.grid.get(position)
+
+        if cell is None:
+            self.grid[position] = set([agent])
+        else:
+            cell.add(agent)
+
+        if self._chunked:
+            self.occupancy.increment(position, 1)
+        elif self.occupancy is not None:
+            self.occupancy[self.to_index(position)] += 1
+
+    def _remove_from_cell(self, agent, position):
+        cell = self.grid.get(position)
+
+        if cell is None:
+            raise KeyError(agent)
+
+        cell.remove(agent)
+
+        if not cell:
+            del self.grid[position]
+
+        if self._chunked:
+            self.occupancy.increment(position, -1)
+        elif self.occupancy is not None:
+            self.occupancy[self.to_index(position)] -= 1
+
+    def _neighbourhood_populations(self, position, stencil):
+        if self.occupancy is None:
+            neigh = self.get_neighbourhood(position, stencil)
+            grid = self.grid
+            return neigh, [len(grid.get(n, ())) for n in neigh]
+
+        neigh = self.get_neighbourhood(position, stencil, flat=True)
+        occupancy = self.occupancy
+        return neigh, [occupancy[i] for i in neigh]
+
+    def _neighbour_position(self, neighbour):
+        if self.occupancy is None:
+            return neighbour
+        return tuple(self.from_index(neighbour))
+
+    def has_room(self, position):
+        """
+        Checks whether a position can accept one more agent. This is always
+        the case on grids without a capacity.
+
+        Parameters
+        ----------
+        position : tuple
+            A valid position in the grid.
+
+        Returns
+        -------
+        bool
+            True if an agent can be added to the position, false otherwise.
+        """
+        return self.capacity is None or \
+            self.get_population(position) < self.capacity
+
+    def get_population(self, position):
+        """
+        Returns the number of agents at a position.
+
+        Parameters
+        ----------
+        position : tuple
+            A valid position in the grid.
+
+        Returns
+        -------
+        int
+            The number of agents at the position.
+        """
+        if self.occupancy is None:
+            return len(self.grid.get(position, ()))
+        if self._chunked:
+            return self.occupancy[position]
+        return self.occupancy[self.to_index(position)]
+
+    def get_empty_neighbours(self, position, stencil=None):
+        """
+        Returns all positions in the neighbourhood of a position which hold
+        no agents, in a random order.
+
+        Parameters
+        ----------
+        position : tuple
+            The position whose neighbourhood we wish to search.
+        stencil : Stencil, optional
+            If given, the neighbourhood described by the stencil is searched
+            instead of the moore neighbourhood.
+
+        Returns
+        -------
+        list
+            The empty neighbouring positions.
+        """
+        neigh, populations = self._neighbourhood_populations(position,
+                                                             stencil)
+        return [self._neighbour_position(n)
+                for n, pop in zip(neigh, populations) if pop == 0]
+
+    def get_empty_neighbour(self, position, stencil=None):
+        """
+        Returns a random position in the neighbourhood of a position which
+        holds no agents.
+
+        Parameters
+        ----------
+        position : tuple
+            The position whose neighbourhood we wish to search.
+        stencil : Stencil, optional
+            If given, the neighbourhood described by the stencil is searched
+            instead of the moore neighbourhood.
+
+        Returns
+        -------
+        tuple
+            An empty neighbouring position, or None if all neighbours hold
+            at least one agent.
+        """
+        neigh, populations = self._neighbourhood_populations(position,
+                                                             stencil)
+
+        for n, pop in zip(neigh, populations):
+            if pop == 0:
+                return self._neighbour_position(n)
+
+        return None
+
+    def get_occupancy_map(self):
+        """
+        Returns the number of agents at every position of the grid as a
+        NumPy array of shape (xsize, ysize) or (xsize, ysize, zsize),
+        without iterating over agents. The array is a read-only view of the
+        occupancy array, so it reflects later changes to the grid, or a
+        read-only copy on grids with chunked occupancy.
+
+        Requires NumPy and occupancy tracking.
+
+        Returns
+        -------
+        numpy.ndarray
+            The number of agents at each position.
+        """
+        Numerics.require_numpy("ObjectGrid.get_occupancy_map")
+
+        if self.occupancy is None:
+            raise ValueError("Occupancy is not tracked by grid %s" %
+                             self.name)
+
+        if self._chunked:
+            view = self.occupancy.to_array()
+        else:
+            view = np.frombuffer(self.occupancy, dtype=np.intc)
+            view = view.reshape(self._size)
+
+        view.flags.writeable = False
+        return view
 
     def move_agent(self, agent, position_old, position_new):
         """
@@ -262,12 +921,52 @@ class ObjectGrid(object):
 
         It is up to the developer to check that the old position did indeed
         contain the agent. If an invalid position
-        is provided as a new position, the agent will not be moved.
+        is provided as a new position, the agent will not be moved. On
+        grids which wrap or reflect their boundaries, the new position is
+        first mapped back into the grid.
 
         Positions should be given as tuples of two or three values,
         depending if this object grid is associated
         to a 2D or 3D environment.
 
+        If the grid has a capacity and the new position is full, the agent
+        is not moved either.
+
+        Parameters
+        ----------
+        agent : Agent
+            The instance of the agent we wish to update.
+        position_old : tuple
+            The old position of the agent.
+        position_new : tuple
+            The new position of the agent.
+
+        Returns
+        -------
+        bool
+            True if the agent was moved, false otherwise.
+        """
+        position_new = self.normalize_position(position_new)
+
+        if not self.valid_position(position_new):
+            return False
+
+        if position_new != position_old and not self.has_room(position_new):
+            return False
+
+        self._remove_from_cell(agent, position_old)
+        self._add_to_cell(agent, position_new)
+        return True
+
+    def move_agent_unchecked(self, agent, position_old, position_new):
+        """
+        Moves an agent from a grid position to another without checking the
+        new position. The new position must be valid (and already mapped
+        back into the grid on grids which wrap or reflect their boundaries)
+        and, on grids with a capacity, have room for the agent.
+
+        This class does *not* update the internal state of the agent.
+
         Parameters
         ----------
         agent : Agent
@@ -277,9 +976,8 @@ class ObjectGrid(object):
         position_new : tuple
             The new position of the agent.
         """
-        if self.valid_position(position_new):
-            self.grid[position_old].remove(agent)
-            self.grid[position_new].add(agent)
+        self._remove_from_cell(agent, position_old)
+        self._add_to_cell(agent, position_new)
 
     def remove_agent(self, agent, position):
         """
@@ -300,9 +998,9 @@ class ObjectGrid(object):
         position: tuple
             The position from which we wish to remove the agent.
         """
-        self.grid[position].remove(agent)
+        self._remove_from_cell(agent, position)
 
-    def get_most_populated_moore_neigh(self, position):
+    def get_most_populated_moore_neigh(self, position, stencil=None):
         """
         Gets the coordinates of the moore neighbour with the most agents. If
         multiple neighbours meet the criteria,
@@ -320,6 +1018,9 @@ class ObjectGrid(object):
         ----------
         position: tuple
             The position whose neighbourhood we wish to search.
+        stencil : Stencil, optional
+            If given, the neighbourhood described by the stencil is searched
+            instead of the moore neighbourhood.
 
         Returns
         -------
@@ -327,25 +1028,16 @@ class ObjectGrid(object):
             The moore position with the highest number of agents.
         """
 
-        neigh = self.get_moore_neighbourhood(position)
+        neigh, populations = self._neighbourhood_populations(position,
+                                                             stencil)
 
         if len(neigh) == 0:
             return None
 
-        shuffle(neigh)
-        max_pop = 0
-        most_populated = neigh[0]
-
-        for n in neigh:
-            pop = self.grid[n].__len__()
-
-            if pop > max_pop:
-                max_pop = pop
-                most_populated = n
+        most_populated = max(range(len(neigh)), key=populations.__getitem__)
+        return self._neighbour_position(neigh[most_populated])
 
-        return most_populated
-
-    def get_least_populated_moore_neigh(self, position):
+    def get_least_populated_moore_neigh(self, position, stencil=None):
         """
         Gets the coordinates of the moore neighbour with the fewest agents.
         If multiple neighbours meet the criteria,
@@ -363,31 +1055,23 @@ class ObjectGrid(object):
         ----------
         position: tuple
             The position whose neighbourhood we wish to search.
+        stencil : Stencil, optional
+            If given, the neighbourhood described by the stencil is searched
+            instead of the moore neighbourhood.
 
         Returns
         -------
         tuple
             The moore position with the fewest number of agents.
         """
-        neigh = self.get_moore_neighbourhood(position)
+        neigh, populations = self._neighbourhood_populations(position,
+                                                             stencil)
 
         if len(neigh) == 0:
             return None
 
-        n = neigh[0]
-
-        shuffle(neigh)
-        min_pop = (self.grid[n]).__len__()
-        min_populated = n
-
-        for n in neigh:
-            pop = (self.grid[n]).__len__()
-
-            if int(pop) < min_pop:
-                min_pop = pop
-                min_populated = n
-
-        return min_populated
+        min_populated = min(range(len(neigh)), key=populations.__getitem__)
+        return self._neighbour_position(neigh[min_populated])
 
     def add_agent(self, agent, position):
         """
@@ -401,6 +1085,10 @@ class ObjectGrid(object):
         of its position in the grid, this should be updated separately.
 
         If an invalid position is provided, then the agent will not be added.
+        On grids which wrap or reflect their boundaries, the position is
+        first mapped back into the grid. If the grid has a capacity and the
+        position is full, the agent is not added either, so this can be
+        used as an atomic place-or-fail operation.
 
         Parameters
         ----------
@@ -408,9 +1096,364 @@ class ObjectGrid(object):
             The instance of the agent we wish to update.
         position: tuple
             The position to which we wish to add the agent.
+
+        Returns
+        -------
+        bool
+            True if the agent was added, false otherwise.
         """
-        if self.valid_position(position):
-            self.grid[position].add(agent)
+        position = self.normalize_position(position)
+
+        if not self.valid_position(position) or not self.has_room(position):
+            return False
+
+        self._add_to_cell(agent, position)
+        return True
+
+    def add_agent_unchecked(self, agent, position):
+        """
+        Adds an agent to a position without checking it. The position must
+        be valid (and already mapped back into the grid on grids which wrap
+        or reflect their boundaries) and, on grids with a capacity, have
+        room for the agent.
+
+        This class does *not* update the internal state of the agent.
+
+        Parameters
+        ----------
+        agent : Agent
+            The instance of the agent we wish to update.
+        position: tuple
+            The position to which we wish to add the agent.
+        """
+        self._add_to_cell(agent, position)
+
+    def submit_move(self, agent, position_new, priority=0):
+        """
+        Records the intent of an agent to move to a new position. The move
+        is applied when resolve_moves is next called, which the schedule
+        does at the end of every phase. If an agent submits several intents
+        before they are resolved, only the last one is considered.
+
+        Parameters
+        ----------
+        agent : Agent
+            The agent wishing to move.
+        position_new : tuple
+            The position the agent wishes to move to.
+        priority : number, optional
+            The priority of the intent, used by the "priority" move policy.
+            Defaults to 0.
+
+        Returns
+        -------
+        bool
+            True if the intent was recorded, false if the position was
+            invalid.
+        """
+        position_new = self.normalize_position(position_new)
+
+        if not self.valid_position(position_new):
+            return False
+
+        self.move_intents.append((agent, position_new, priority))
+        return True
+
+    def _pending_moves(self, policy):
+        """
+        Turns the recorded intents into (agent, old, new) moves, keeping
+        the last intent of each agent and ordering them according to the
+        move policy. Order only matters on grids with a capacity.
+        """
+        latest = dict()
+        name = self.name
+
+        for intent in self.move_intents:
+            latest[intent[0]] = intent
+
+        intents = list(latest.values())
+
+        if self.capacity is not None:
+            shuffle(intents)
+            if policy == PRIORITY:
+                intents.sort(key=lambda intent: intent[2], reverse=True)
+
+        pending = []
+
+        for agent, position_new, _ in intents:
+            position_old = agent.environment_positions.get(name)
+            if position_old is not None and position_old != position_new:
+                pending.append((agent, position_old, position_new))
+
+        return pending
+
+    def _accept_moves(self, pending):
+        """
+        Decides which moves can be applied without exceeding the capacity
+        of any position. Moves are considered in order; moves rejected for
+        lack of room are retried as long as other accepted moves keep
+        freeing positions.
+        """
+        if self.capacity is None:
+            return pending
+
+        delta = dict()
+        accepted = []
+
+        while pending:
+            rejected = []
+
+            for move in pending:
+                population = self.get_population(move[2]) + \
+                    delta.get(move[2], 0)
+                if population < self.capacity:
+                    delta[move[2]] = delta.get(move[2], 0) + 1
+                    delta[move[1]] = delta.get(move[1], 0) - 1
+                    accepted.append(move)
+                else:
+                    rejected.append(move)
+
+            if len(rejected) == len(pending):
+                break
+
+            pending = rejected
+
+        return accepted
+
+    def resolve_moves(self, policy=None):
+        """
+        Applies all recorded move intents in one batch and clears them.
+
+        On grids with a capacity, intents are granted in the order given by
+        the move policy for as long as their destination has room, taking
+        into account agents which leave a position in the same batch. Agents
+        whose intent is not granted stay where they are.
+
+        Unlike move_agent, this also updates each moved agent's own record
+        of its position, as intents are normally submitted via
+        Agent.move_agent.
+
+        Parameters
+        ----------
+        policy : string, optional
+            Overrides the grid's move policy for this call.
+
+        Returns
+        -------
+        list
+            The agents which were moved.
+        """
+        if not self.move_intents:
+            return []
+
+        accepted = self._accept_moves(
+            self._pending_moves(policy or self.move_policy))
+        self.move_intents = []
+        grid = self.grid
+        name = self.name
+
+        for agent, position_old, position_new in accepted:
+            cell = grid[position_old]
+            cell.remove(agent)
+            if not cell:
+                del grid[position_old]
+
+            cell = grid.get(position_new)
+            if cell is None:
+                grid[position_new] = set([agent])
+            else:
+                cell.add(agent)
+
+            agent.environment_positions[name] = position_new
+
+        if self.occupancy is not None:
+            to_index = self.to_index
+            self._count_agents([to_index(m[2]) for m in accepted])
+            self._count_agents([to_index(m[1]) for m in accepted], -1)
+
+        return [m[0] for m in accepted]
+
+    def _canonical_positions(self, positions):
+        """
+        Maps many positions into the grid according to its boundary mode in
+        one pass, returning a list holding a tuple per valid position and
+        None per invalid one, and the flat indices of the valid positions.
+        """
+        if np is not None:
+            mapped = self.normalize_positions(positions)
+            valid = self.valid_positions(mapped)
+            canonical = list(map(tuple, mapped.tolist()))
+
+            for i in np.flatnonzero(~valid).tolist():
+                canonical[i] = None
+
+            return canonical, self.to_indices(mapped[valid])
+
+        canonical = []
+        indices = []
+
+        for p in positions:
+            p = tuple(self.normalize_position(p))
+            if self.valid_position(p):
+                canonical.append(p)
+                indices.append(self.to_index(p))
+            else:
+                canonical.append(None)
+
+        return canonical, indices
+
+    def add_agents(self, agents, positions):
+        """
+        Adds many agents to the grid in one call, eg: when populating the
+        initial conditions of a model.
+
+        Positions are mapped and validated in bulk (vectorized when NumPy
+        is available) and the occupancy counts are updated in a single
+        pass, rather than paying for validation and bookkeeping once per
+        agent. Agents at invalid positions are not added. On grids with a
+        capacity, agents are added in order until each position is full.
+
+        This class does *not* update the internal state of the agents. See
+        add_agents_to_grid in the Steppables module for a function which
+        does both.
+
+        Parameters
+        ----------
+        agents : iterable
+            The agents we wish to add.
+        positions : iterable or numpy.ndarray
+            One position per agent, as a sequence of tuples or as an integer
+            array of shape (n, 2) or (n, 3).
+
+        Returns
+        -------
+        list
+            For each agent, the position it was added to, or None if it was
+            not added.
+        """
+        # Bulk insertion allocates one container per position, which would
+        # otherwise trigger many pointless garbage collection passes.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+
+        try:
+            return self._add_agents(list(agents), positions)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _add_agents(self, agents, positions):
+        canonical, indices = self._canonical_positions(positions)
+
+        if len(canonical) != len(agents):
+            raise ValueError("Expected one position per agent, got %s "
+                             "positions for %s agents" %
+                             (len(canonical), len(agents)))
+
+        if self.capacity is not None:
+            return [p if p is not None and self.add_agent(a, p) else None
+                    for a, p in zip(agents, canonical)]
+
+        grid = self.grid
+
+        for agent, position in zip(agents, canonical):
+            if position is None:
+                continue
+
+            cell = grid.get(position)
+
+            if cell is None:
+                grid[position] = set([agent])
+            else:
+                cell.add(agent)
+
+        self._count_agents(indices)
+        return canonical
+
+    def _count_agents(self, indices, delta=1):
+        occupancy = self.occupancy
+
+        if occupancy is None:
+            return
+
+        if self._chunked:
+            occupancy.add_at(self.from_indices(indices), delta)
+        elif np is not None:
+            np.add.at(np.frombuffer(occupancy, dtype=np.intc),
+                      np.asarray(indices, dtype=np.intp), delta)
+        else:
+            for i in indices:
+                occupancy[i] += delta
+
+    def get_free_neighbour(self, position, radius=1, stencil=None):
+        """
+        Returns a random position in the neighbourhood of a position with
+        room for one more agent. On grids without a capacity, this is a
+        random empty neighbour.
+
+        The neighbourhood is visited once in a random order, reading the
+        occupancy of each neighbour, so no retries are needed.
+
+        Parameters
+        ----------
+        position : tuple
+            The position whose neighbourhood we wish to search.
+        radius : int, optional
+            The radius of the moore neighbourhood to search. Defaults to 1.
+        stencil : Stencil, optional
+            If given, the neighbourhood described by the stencil is searched
+            instead, and radius is ignored.
+
+        Returns
+        -------
+        tuple
+            A free neighbouring position, or None if there is none.
+        """
+        if stencil is None and radius != 1:
+            stencil = Stencil.moore(len(self._size), radius)
+
+        limit = 1 if self.capacity is None else self.capacity
+        neigh, populations = self._neighbourhood_populations(position,
+                                                             stencil)
+
+        for n, pop in zip(neigh, populations):
+            if pop < limit:
+                return self._neighbour_position(n)
+
+        return None
+
+    def place_agent_near(self, agent, position, radius=1, stencil=None):
+        """
+        Adds an agent to a random free position in the neighbourhood of a
+        position (see get_free_neighbour), or fails if there is none. This
+        is typically used to place the offspring of a dividing agent.
+
+        This class does *not* update the internal state of the agent.
+
+        Parameters
+        ----------
+        agent : Agent
+            The instance of the agent we wish to add.
+        position : tuple
+            The position whose neighbourhood we wish to search.
+        radius : int, optional
+            The radius of the moore neighbourhood to search. Defaults to 1.
+        stencil : Stencil, optional
+            If given, the neighbourhood described by the stencil is searched
+            instead, and radius is ignored.
+
+        Returns
+        -------
+        tuple
+            The position the agent was added to, or None if no free
+            position was found.
+        """
+        free = self.get_free_neighbour(position, radius, stencil)
+
+        if free is not None:
+            self._add_to_cell(agent, free)
+
+        return free
 
 
 class ObjectGrid3D(Grid3D, ObjectGrid, object):
@@ -437,11 +1480,34 @@ class ObjectGrid3D(Grid3D, ObjectGrid, object):
     model : model
         The instance of the model class to which the environment will be
         attached.
+    boundary : string, optional
+        How the grid treats its boundaries, one of "clip", "wrap" or
+        "reflect". See Grid. Defaults to "clip".
+    track_occupancy : bool or string, optional
+        If set to true, the number of agents at each position is kept, in a
+        dense array for grids of up to DENSE_OCCUPANCY_LIMIT positions. See
+        ObjectGrid. Defaults to true.
+    capacity : int, optional
+        The maximum number of agents per position. Defaults to None,
+        meaning positions can hold any number of agents.
+    synchronous_moves : bool, optional
+        If set to true, agent moves are applied in a batch at the end of
+        each phase. See ObjectGrid. Defaults to false.
+    move_policy : string, optional
+        How conflicting synchronous moves are settled, "random" or
+        "priority". See ObjectGrid. Defaults to "random".
+    chunk_size : int, optional
+        If set, occupancy counts are held in chunks allocated on demand. See
+        ObjectGrid. Defaults to None.
     """
 
-    def __init__(self, name, xsize, ysize, zsize, model):
-        Grid3D.__init__(self, name, xsize, ysize, zsize, model)
-        ObjectGrid.__init__(self)
+    def __init__(self, name, xsize, ysize, zsize, model, boundary=CLIP,
+                 track_occupancy=True, capacity=None,
+                 synchronous_moves=False, move_policy=RANDOM,
+                 chunk_size=None):
+        Grid3D.__init__(self, name, xsize, ysize, zsize, model, boundary)
+        ObjectGrid.__init__(self, track_occupancy, capacity,
+                            synchronous_moves, move_policy, chunk_size)
 
 
 class ObjectGrid2D(Grid2D, ObjectGrid, object):
@@ -465,11 +1531,30 @@ class ObjectGrid2D(Grid2D, ObjectGrid, object):
     model : model
         The instance of the model class to which the environment will be
         attached.
+    boundary : string, optional
+        How the grid treats its boundaries, one of "clip", "wrap" or
+        "reflect". See Grid. Defaults to "clip".
+    track_occupancy : bool or string, optional
+        If set to true, the number of agents at each position is kept, in a
+        dense array for grids of up to DENSE_OCCUPANCY_LIMIT positions. See
+        ObjectGrid. Defaults to true.
+    capacity : int, optional
+        The maximum number of agents per position. Defaults to None,
+        meaning positions can hold any number of agents.
+    synchronous_moves : bool, optional
+        If set to true, agent moves are applied in a batch at the end of
+        each phase. See ObjectGrid. Defaults to false.
+    move_policy : string, optional
+        How conflicting synchronous moves are settled, "random" or
+        "priority". See ObjectGrid. Defaults to "random".
     """
 
-    def __init__(self, name, xsize, ysize, model):
-        Grid2D.__init__(self, name, xsize, ysize, model)
-        ObjectGrid.__init__(self)
+    def __init__(self, name, xsize, ysize, model, boundary=CLIP,
+                 track_occupancy=True, capacity=None,
+                 synchronous_moves=False, move_policy=RANDOM):
+        Grid2D.__init__(self, name, xsize, ysize, model, boundary)
+        ObjectGrid.__init__(self, track_occupancy, capacity,
+                            synchronous_moves, move_policy)
 
 
 class NumericalGrid(object):
@@ -479,14 +1564,58 @@ class NumericalGrid(object):
 
     This class exposes methods to explore a position's neighbourhood.
 
+    Positions which have never been written to hold a value of zero. Reading
+    them does not store them in the grid, so the grid only grows with the
+    positions that have actually been assigned a value.
+
     This class would **not** be itself instantiated, but would be extended
     by another class that would implement it.
     """
 
-    def __init__(self):
-        self.grid = defaultdict(int)
+    def __init__(self, chunk_size=None, storage_path=None,
+                 storage_mode="w+", shared_handle=None):
+        if shared_handle is not None:
+            self.grid = SharedCellStore.attach(shared_handle)
+            self._check_shape(self.grid.shape, "shared memory")
+        elif storage_path is not None:
+            self.grid = MappedCellStore(storage_path, self._size,
+                                        mode=storage_mode)
+            self._check_shape(self.grid.shape, storage_path)
+        elif chunk_size is not None:
+            self.grid = ChunkedCellStore(self._size, chunk_size)
+        else:
+            self.grid = SparseCellStore(int)
+
+    def _check_shape(self, shape, source):
+        if shape != self._size:
+            raise ValueError("The grid in %s has shape %s, expected %s"
+                             % (source, str(shape), str(self._size)))
+
+    def share(self):
+        """
+        Moves the values of the grid to shared memory (see
+        SharedCellStore), so that other processes on the same host can
+        attach to them rather than each holding a copy. The returned handle
+        is passed to the other processes, which build their grid with it
+        (see the shared_handle argument of NumericalGrid2D and
+        NumericalGrid3D).
+
+        The shared values are read-only: a process writing to its grid
+        first gets a private copy, leaving the other processes unaffected.
+        Once every process is done, the process which shared the grid
+        frees the shared memory with environment.grid.release().
+
+        Requires NumPy and Python 3.8 or later.
+
+        Returns
+        -------
+        tuple
+            The handle of the shared values.
+        """
+        self.grid = SharedCellStore(self.to_array())
+        return self.grid.handle
 
-    def get_max_in_neigh(self, position):
+    def get_max_in_neigh(self, position, stencil=None):
         """
         Gets the coordinates of the moore neighbour with the largest value.
         If multiple neighbours meet the criteria,
@@ -504,13 +1633,16 @@ class NumericalGrid(object):
         ----------
         position: tuple
             The position whose neighbourhood we wish to search.
+        stencil : Stencil, optional
+            If given, the neighbourhood described by the stencil is searched
+            instead of the moore neighbourhood.
 
         Returns
         -------
         tuple
             The moore position with the largest value.
         """
-        neigh = self.get_moore_neighbourhood(position)
+        neigh = self.get_neighbourhood(position, stencil)
 
         max_pos = neigh[0]
         max_value = 0
@@ -523,7 +1655,7 @@ class NumericalGrid(object):
 
         return max_pos
 
-    def get_least_in_neigh(self, position):
+    def get_least_in_neigh(self, position, stencil=None):
         """
         Gets the coordinates of the moore neighbour with the smallest value.
         If multiple neighbours meet the criteria,
@@ -541,13 +1673,16 @@ class NumericalGrid(object):
         ----------
         position: tuple
             The position whose neighbourhood we wish to search.
+        stencil : Stencil, optional
+            If given, the neighbourhood described by the stencil is searched
+            instead of the moore neighbourhood.
 
         Returns
         -------
         tuple
             The moore position with the smallest value.
         """
-        neigh = self.get_moore_neighbourhood(position)
+        neigh = self.get_neighbourhood(position, stencil)
 
         min_pos = neigh[0]
         min_value = self.grid[neigh[0]]
@@ -560,6 +1695,209 @@ class NumericalGrid(object):
 
         return min_pos
 
+    def to_array(self, dtype=float):
+        """
+        Returns the contents of the grid as a dense NumPy array of shape
+        (xsize, ysize) or (xsize, ysize, zsize). Positions which have not
+        been written to hold zero.
+
+        Requires NumPy.
+
+        Parameters
+        ----------
+        dtype : numpy.dtype, optional
+            The type of the array. Defaults to float.
+
+        Returns
+        -------
+        numpy.ndarray
+            A dense copy of the grid.
+        """
+        Numerics.require_numpy("NumericalGrid.to_array")
+
+        if isinstance(self.grid, (ChunkedCellStore, MappedCellStore,
+                                  SharedCellStore)):
+            return self.grid.to_array(dtype)
+
+        values = np.zeros(self._size, dtype=dtype)
+
+        if len(self.grid) > 0:
+            positions = np.array(list(self.grid.keys()))
+            data = np.array(list(self.grid.values()), dtype=dtype)
+            inside = self.valid_positions(positions)
+            values.flat[self.to_indices(positions[inside])] = data[inside]
+
+        return values
+
+    def _batch_arguments(self, positions, stencil, values, feature):
+        Numerics.require_numpy(feature)
+
+        if stencil is None:
+            stencil = Stencil.moore(len(self._size))
+
+        if values is None and isinstance(self.grid, SharedCellStore):
+            values = self.grid.array
+        elif values is None:
+            values = self.to_array()
+
+        positions = Numerics.as_positions(positions, len(self._size))
+        return positions, stencil.as_array(), values
+
+    def reduce_neigh_batch(self, positions, reduction="max", stencil=None,
+                           values=None):
+        """
+        Reduces the neighbourhood of each of many positions (eg: one per
+        agent) to a single value in one vectorized call.
+
+        Requires NumPy.
+
+        Parameters
+        ----------
+        positions : iterable or numpy.ndarray
+            The positions whose neighbourhoods we wish to reduce, as a list
+            of tuples or an integer array of shape (n, dimensions).
+        reduction : string, optional
+            One of "max", "min", "sum" or "mean". Defaults to "max".
+        stencil : Stencil, optional
+            The neighbourhood to reduce. Defaults to the moore
+            neighbourhood.
+        values : numpy.ndarray, optional
+            A dense array of the grid's contents, as returned by to_array.
+            Passing it allows to reuse the same array across calls within
+            an epoch. Defaults to building it from the grid.
+
+        Returns
+        -------
+        numpy.ndarray
+            One reduced value per position. Neighbourhoods without any
+            position in the grid reduce to NaN (or zero for sums).
+        """
+        positions, offsets, values = self._batch_arguments(
+            positions, stencil, values, "NumericalGrid.reduce_neigh_batch")
+        return Numerics.reduce_neighbourhoods(values, positions, offsets,
+                                              self.boundary, reduction)
+
+    def get_max_in_neigh_batch(self, positions, stencil=None, values=None,
+                               shuffle_neigh=True):
+        """
+        Vectorized version of get_max_in_neigh, finding for each of many
+        positions the neighbour with the largest value.
+
+        Requires NumPy.
+
+        Parameters
+        ----------
+        positions : iterable or numpy.ndarray
+            The positions whose neighbourhoods we wish to search.
+        stencil : Stencil, optional
+            The neighbourhood to search. Defaults to the moore
+            neighbourhood.
+        values : numpy.ndarray, optional
+            A dense array of the grid's contents, as returned by to_array.
+            Defaults to building it from the grid.
+        shuffle_neigh : bool, optional
+            If set to true, ties are broken in a random order rather than
+            always in favour of the same neighbour. Defaults to true.
+
+        Returns
+        -------
+        numpy.ndarray
+            An integer array of shape (n, dimensions) holding the selected
+            neighbour of each position, or -1 for positions without any
+            neighbour in the grid.
+        """
+        positions, offsets, values = self._batch_arguments(
+            positions, stencil, values,
+            "NumericalGrid.get_max_in_neigh_batch")
+
+        if shuffle_neigh:
+            offsets = np.random.permutation(offsets)
+
+        return Numerics.arg_neighbourhoods(values, positions, offsets,
+                                           self.boundary, "max")
+
+    def get_least_in_neigh_batch(self, positions, stencil=None, values=None,
+                                 shuffle_neigh=True):
+        """
+        Vectorized version of get_least_in_neigh, finding for each of many
+        positions the neighbour with the smallest value.
+
+        Requires NumPy.
+
+        Parameters
+        ----------
+        positions : iterable or numpy.ndarray
+            The positions whose neighbourhoods we wish to search.
+        stencil : Stencil, optional
+            The neighbourhood to search. Defaults to the moore
+            neighbourhood.
+        values : numpy.ndarray, optional
+            A dense array of the grid's contents, as returned by to_array.
+            Defaults to building it from the grid.
+        shuffle_neigh : bool, optional
+            If set to true, ties are broken in a random order rather than
+            always in favour of the same neighbour. Defaults to true.
+
+        Returns
+        -------
+        numpy.ndarray
+            An integer array of shape (n, dimensions) holding the selected
+            neighbour of each position, or -1 for positions without any
+            neighbour in the grid.
+        """
+        positions, offsets, values = self._batch_arguments(
+            positions, stencil, values,
+            "NumericalGrid.get_least_in_neigh_batch")
+
+        if shuffle_neigh:
+            offsets = np.random.permutation(offsets)
+
+        return Numerics.arg_neighbourhoods(values, positions, offsets,
+                                           self.boundary, "min")
+
+    def get_neigh_map(self, reduction="max", stencil=None, values=None):
+        """
+        Reduces the neighbourhood of every position of the grid at once.
+        The resulting map can be computed once per epoch (eg: by a helper)
+        and read by all agents, so that "what is the highest value around
+        me" becomes a single array lookup.
+
+        Requires NumPy.
+
+        Parameters
+        ----------
+        reduction : string, optional
+            One of "max", "min", "sum" or "mean". Defaults to "max".
+        stencil : Stencil, optional
+            The neighbourhood to reduce. Defaults to the moore
+            neighbourhood.
+        values : numpy.ndarray, optional
+            A dense array of the grid's contents, as returned by to_array.
+            Defaults to building it from the grid.
+
+        Returns
+        -------
+        numpy.ndarray
+            An array with the shape of the grid where each position holds
+            the reduction of its neighbourhood.
+        """
+        _, offsets, values = self._batch_arguments(
+            [], stencil, values, "NumericalGrid.get_neigh_map")
+        return Numerics.neighbourhood_map(values, offsets, self.boundary,
+                                          reduction)
+
+    def get_neigh_max_map(self, stencil=None, values=None):
+        """
+        Shorthand for get_neigh_map("max", ...).
+        """
+        return self.get_neigh_map("max", stencil, values)
+
+    def get_neigh_min_map(self, stencil=None, values=None):
+        """
+        Shorthand for get_neigh_map("min", ...).
+        """
+        return self.get_neigh_map("min", stencil, values)
+
 
 class NumericalGrid2D(Grid2D, NumericalGrid, object):
     """
@@ -583,11 +1921,25 @@ class NumericalGrid2D(Grid2D, NumericalGrid, object):
     model : model
         The instance of the model class to which the environment will be
         attached.
+    boundary : string, optional
+        How the grid treats its boundaries, one of "clip", "wrap" or
+        "reflect". See Grid. Defaults to "clip".
+    storage_path : string, optional
+        If set, values are held in a memory-mapped file at this path. See
+        NumericalGrid3D. Defaults to None.
+    storage_mode : string, optional
+        How the file is opened. See NumericalGrid3D. Defaults to "w+".
+    shared_handle : tuple, optional
+        If set, the grid reads values shared by another process. See
+        NumericalGrid3D. Defaults to None.
     """
 
-    def __init__(self, name, xsize, ysize, model):
-        Grid2D.__init__(self, name, xsize, ysize, model)
-        NumericalGrid.__init__(self)
+    def __init__(self, name, xsize, ysize, model, boundary=CLIP,
+                 storage_path=None, storage_mode="w+", shared_handle=None):
+        Grid2D.__init__(self, name, xsize, ysize, model, boundary)
+        NumericalGrid.__init__(self, storage_path=storage_path,
+                               storage_mode=storage_mode,
+                               shared_handle=shared_handle)
 
 
 class NumericalGrid3D(Grid3D, NumericalGrid, object):
@@ -612,8 +1964,1111 @@ class NumericalGrid3D(Grid3D, NumericalGrid, object):
     model : model
         The instance of the model class to which the environment will be
         attached.
+    boundary : string, optional
+        How the grid treats its boundaries, one of "clip", "wrap" or
+        "reflect". See Grid. Defaults to "clip".
+    chunk_size : int, optional
+        If set, values are held in chunks of chunk_size positions along each
+        axis, allocated on demand (see ChunkedCellStore), so that memory
+        scales with the region in use rather than with the whole grid.
+        Requires NumPy. Defaults to None.
+    storage_path : string, optional
+        If set, values are held in a memory-mapped file at this path (see
+        MappedCellStore), for grids larger than memory. Requires NumPy.
+        Defaults to None.
+    storage_mode : string, optional
+        How the file is opened: "w+" creates it, "r+" opens an existing
+        file, "r" opens it read-only and "c" copy-on-write. Defaults to
+        "w+".
+    shared_handle : tuple, optional
+        If set, the grid reads the values of a grid shared by another
+        process, as returned by its share method, rather than holding its
+        own copy. The first write to the grid gives it a private copy.
+        Requires NumPy and Python 3.8 or later. Defaults to None.
+    """
+
+    def __init__(self, name, xsize, ysize, zsize, model, boundary=CLIP,
+                 chunk_size=None, storage_path=None, storage_mode="w+",
+                 shared_handle=None):
+        Grid3D.__init__(self, name, xsize, ysize, zsize, model, boundary)
+        NumericalGrid.__init__(self, chunk_size, storage_path, storage_mode,
+                               shared_handle)
+
+
+class LatticeGrid(object):
+    """
+    Initializes a LatticeGrid object. A LatticeGrid holds a dense array of
+    cell states, as used by cellular automata, and updates all of them
+    synchronously.
+
+    The states are double-buffered: *current* holds the states of the
+    current epoch and is what every reader sees, while new states are
+    written to *next*. Once the main phase of an epoch is over, the
+    schedule applies the lattice's update rules and swaps the two buffers,
+    so all cells move to their new state at once, regardless of the order
+    in which they (or the agents writing to them) were processed.
+
+    Update rules are vectorized kernels over the whole grid: callables
+    taking the lattice and the model, which read *current* and either write
+    the new states into *next* or return an array of new states. Before
+    the rules run, *next* holds a copy of the current states updated with
+    any values written via set_value during the epoch.
+
+    Requires NumPy.
+
+    This class would **not** be itself instantiated, but would be extended
+    by another class that would implement it.
+
+    Attributes
+    ----------
+    dtype : data-type, optional
+        The type of the cell states. Defaults to int.
+    fill : number, optional
+        The initial state of every cell. Defaults to 0.
     """
 
-    def __init__(self, name, xsize, ysize, zsize, model):
-        Grid3D.__init__(self, name, xsize, ysize, zsize, model)
-        NumericalGrid.__init__(self)
+    def __init__(self, dtype=int, fill=0):
+        Numerics.require_numpy("LatticeGrid")
+
+        self.current = np.full(self._size, fill, dtype=dtype)
+        self.next = self.current.copy()
+        self.rules = []
+
+    def add_rule(self, rule):
+        """
+        Adds an update rule, applied once per epoch after the main phase.
+        Rules are applied in the order in which they were added.
+
+        Parameters
+        ----------
+        rule : callable
+            A function taking the lattice and the model. It should read
+            the states from lattice.current and either write the new states
+            into lattice.next or return them as an array.
+        """
+        self.rules.append(rule)
+
+    def get_value(self, position):
+        """
+        Returns the state of a position in the current epoch.
+
+        Parameters
+        ----------
+        position : tuple
+            The position to read. On grids which wrap or reflect their
+            boundaries, the position is first mapped back into the grid,
+            while positions outside grids which clip their boundaries
+            raise a ValueError.
+
+        Returns
+        -------
+        number
+            The current state of the position.
+        """
+        position = self.normalize_position(position)
+
+        if not self.valid_position(position):
+            raise ValueError("Position %s is outside the grid %s" %
+                             (str(position), self.name))
+
+        return self.current[position]
+
+    def set_value(self, position, value):
+        """
+        Sets the state a position will have in the next epoch. The current
+        state, as seen by other cells and agents, is unaffected until the
+        buffers are swapped.
+
+        If an invalid position is provided, then nothing is written. On
+        grids which wrap or reflect their boundaries, the position is first
+        mapped back into the grid.
+
+        Parameters
+        ----------
+        position : tuple
+            The position to write.
+        value : number
+            The new state of the position.
+
+        Returns
+        -------
+        bool
+            True if the state was set, false otherwise.
+        """
+        position = self.normalize_position(position)
+
+        if not self.valid_position(position):
+            return False
+
+        self.next[position] = value
+        return True
+
+    def get_neigh_map(self, reduction="sum", stencil=None):
+        """
+        Reduces the neighbourhood of every cell of the current states at
+        once. This is the usual building block of update rules, eg: the sum
+        over the moore neighbourhood counts the live neighbours of each cell
+        in the Game of Life.
+
+        Parameters
+        ----------
+        reduction : string, optional
+            One of "max", "min", "sum" or "mean". Defaults to "sum".
+        stencil : Stencil, optional
+            The neighbourhood to reduce. Defaults to the moore
+            neighbourhood.
+
+        Returns
+        -------
+        numpy.ndarray
+            A float array with the shape of the grid where each position
+            holds the reduction of its neighbourhood.
+        """
+        stencil = stencil or Stencil.moore(len(self._size))
+        return Numerics.neighbourhood_map(self.current, stencil.as_array(),
+                                          self.boundary, reduction)
+
+    def swap(self):
+        """
+        Makes the next states current. The new *next* buffer starts as a
+        copy of the new current states.
+        """
+        self.current, self.next = self.next, self.current
+        self.next[...] = self.current
+
+    def discard(self):
+        """
+        Discards the next states written since the last swap, so that the
+        next buffer is again a copy of the current states.
+        """
+        self.next[...] = self.current
+
+    def advance(self, model):
+        """
+        Applies the update rules and swaps the buffers. This is called by
+        the schedule at the end of the main phase of every epoch.
+
+        Parameters
+        ----------
+        model : Model
+            The instance of the model to which the lattice is attached.
+        """
+        for rule in self.rules:
+            result = rule(self, model)
+            if result is not None:
+                self.next[...] = result
+
+        self.swap()
+
+
+class LatticeGrid2D(Grid2D, LatticeGrid, object):
+    """
+    Instantiates a 2D Lattice Grid. This extends Grid2D and LatticeGrid,
+    holding double-buffered cell states in a two-dimensional grid.
+
+    Requires NumPy.
+
+    Attributes
+    ----------
+    name : string
+        The name of the environment, this will be used when referring to it
+        throughout the code.
+    xsize : int
+        The number of positions along the x-axis.
+    ysize : int
+        The number of positions along the y-axis.
+    model : model
+        The instance of the model class to which the environment will be
+        attached.
+    boundary : string, optional
+        How the grid treats its boundaries, one of "clip", "wrap" or
+        "reflect". See Grid. Defaults to "clip".
+    dtype : data-type, optional
+        The type of the cell states. Defaults to int.
+    fill : number, optional
+        The initial state of every cell. Defaults to 0.
+    """
+
+    def __init__(self, name, xsize, ysize, model, boundary=CLIP, dtype=int,
+                 fill=0):
+        Grid2D.__init__(self, name, xsize, ysize, model, boundary)
+        LatticeGrid.__init__(self, dtype, fill)
+
+
+class LatticeGrid3D(Grid3D, LatticeGrid, object):
+    """
+    Instantiates a 3D Lattice Grid. This extends Grid3D and LatticeGrid,
+    holding double-buffered cell states in a three-dimensional grid.
+
+    Requires NumPy.
+
+    Attributes
+    ----------
+    name : string
+        The name of the environment, this will be used when referring to it
+        throughout the code.
+    xsize : int
+        The number of positions along the x-axis.
+    ysize : int
+        The number of positions along the y-axis.
+    zsize : int
+        The number of positions along the z-axis.
+    model : model
+        The instance of the model class to which the environment will be
+        attached.
+    boundary : string, optional
+        How the grid treats its boundaries, one of "clip", "wrap" or
+        "reflect". See Grid. Defaults to "clip".
+    dtype : data-type, optional
+        The type of the cell states. Defaults to int.
+    fill : number, optional
+        The initial state of every cell. Defaults to 0.
+    """
+
+    def __init__(self, name, xsize, ysize, zsize, model, boundary=CLIP,
+                 dtype=int, fill=0):
+        Grid3D.__init__(self, name, xsize, ysize, zsize, model, boundary)
+        LatticeGrid.__init__(self, dtype, fill)
+
+
+class CoarseNumericalGrid(object):
+    """
+    Initializes a CoarseNumericalGrid object. A CoarseNumericalGrid holds a
+    field of numbers at a coarser resolution than the grid the agents move
+    on, for quantities which vary smoothly (eg: diffusing nutrients) and
+    do not need to be updated at the resolution of the agents.
+
+    The grid has the size of the agents' grid, so agents read and write it
+    at their own positions, while its values are held in the coarse
+    *field*, where each position covers a block of *factor* positions along
+    each axis:
+
+    * Reads interpolate the field linearly between the centres of the
+      nearest blocks (see get_value and get_values).
+    * Writes are deposits restricted to the block of the position: an
+      amount added at one position raises the value of its block by the
+      amount divided by the number of positions in the block, so the total
+      over the grid is conserved (see add_value and add_values).
+
+    Like LatticeGrid, the field is updated once per epoch, after the main
+    phase: the deposits of the epoch are applied first, then the update
+    rules, so all agents read the same field during an epoch. Update rules
+    act on the coarse field only, which has factor ** dimensions times
+    fewer positions than the agents' grid.
+
+    Requires NumPy.
+
+    This class would **not** be itself instantiated, but would be extended
+    by another class that would implement it.
+
+    Attributes
+    ----------
+    factor : int or tuple
+        The number of positions of the grid covered by a position of the
+        field, along every axis or along each axis. On grids which wrap or
+        reflect their boundaries, the size of the grid must be a multiple
+        of the factor along each axis, so that the field has the same
+        period as the grid.
+    fill : number, optional
+        The initial value of the field. Defaults to 0.
+    """
+
+    def __init__(self, factor, fill=0.):
+        Numerics.require_numpy("CoarseNumericalGrid")
+
+        if isinstance(factor, int):
+            factor = (factor,) * len(self._size)
+
+        if len(factor) != len(self._size) or min(factor) < 1:
+            raise ValueError("factor must be at least 1 along each of the "
+                             "%d axes, got %s" % (len(self._size),
+                                                  str(factor)))
+
+        self.factor = tuple([int(f) for f in factor])
+
+        if self.boundary != CLIP and \
+                any(n % f for n, f in zip(self._size, self.factor)):
+            raise ValueError("The size %s of a grid with %s boundaries must "
+                             "be a multiple of the factor %s" % (
+                                 str(self._size), self.boundary,
+                                 str(self.factor)))
+
+        shape = [-(-n // f) for n, f in zip(self._size, self.factor)]
+        self.field = np.full(shape, fill, dtype=float)
+        self.deposits = np.zeros(shape)
+        self.block_sizes = Numerics.block_sizes(self._size, self.factor)
+        self.rules = []
+
+        # For each axis, the offsets in the flattened field of the blocks
+        # below and above every coordinate, the weight of the block above
+        # and the offset of the coordinate's own block, so that reading or
+        # writing the field only gathers from these tables
+        self._axes = []
+        stride = 1
+
+        for axis in reversed(range(len(shape))):
+            below, above, fraction = self._axis_interpolation(axis)
+            blocks = np.arange(self._size[axis]) // self.factor[axis]
+            self._axes.insert(0, (below * stride, above * stride, fraction,
+                                  blocks * stride))
+            stride *= shape[axis]
+
+    def add_rule(self, rule):
+        """
+        Adds an update rule, applied to the field once per epoch after the
+        deposits of the epoch. Rules are applied in the order in which they
+        were added.
+
+        Parameters
+        ----------
+        rule : callable
+            A function taking the grid and the model. It should either
+            update grid.field in place or return the new field.
+        """
+        self.rules.append(rule)
+
+    def get_value(self, position):
+        """
+        Returns the value of the field at a position, interpolated between
+        the centres of the nearest blocks.
+
+        Parameters
+        ----------
+        position : tuple
+            The position to read. On grids which clip their boundaries,
+            positions beyond the edges read the value at the edge.
+
+        Returns
+        -------
+        float
+            The value at the position.
+        """
+        position = self.normalize_position(position)
+        corners = [(0, 1.)]
+
+        for c, n, axis in zip(position, self._size, self._axes):
+            below, above, fraction = axis[:3]
+            if self.boundary == CLIP:
+                c = min(max(c, 0), n - 1)
+            t = float(fraction[c])
+            corners = [(i + below[c], w * (1. - t)) for i, w in corners] + \
+                [(i + above[c], w * t) for i, w in corners]
+
+        flat = self.field.reshape(-1)
+        return float(sum([flat[i] * w for i, w in corners if w]))
+
+    def get_values(self, positions):
+        """
+        Vectorized version of get_value, reading the field at many
+        positions (eg: one per agent) in one call.
+
+        Parameters
+        ----------
+        positions : iterable or numpy.ndarray
+            The positions to read, as a sequence of tuples or as an integer
+            array of shape (n, 2) or (n, 3).
+
+        Returns
+        -------
+        numpy.ndarray
+            The value at each position.
+        """
+        positions = self.normalize_positions(positions)
+
+        if self.boundary == CLIP:
+            positions = np.clip(positions, 0, np.array(self._size) - 1)
+
+        corners = [(0, 1.)]
+
+        for axis, (below, above, fraction, _) in enumerate(self._axes):
+            c = positions[:, axis]
+            t = fraction[c]
+            lower, upper = below[c], above[c]
+            corners = [(i + lower, w * (1. - t)) for i, w in corners] + \
+                [(i + upper, w * t) for i, w in corners]
+
+        flat = self.field.reshape(-1)
+        return sum([flat.take(i) * w for i, w in corners])
+
+    def add_value(self, position, amount):
+        """
+        Deposits an amount at a position, applied to the field at the end
+        of the main phase.
+
+        Parameters
+        ----------
+        position : tuple
+            The position to write. Positions outside a grid which clips
+            its boundaries are ignored.
+        amount : number
+            The amount to add. The value of the position's block rises by
+            the amount divided by the number of positions in the block.
+        """
+        position = self.normalize_position(position)
+
+        if self.valid_position(position):
+            self.deposits[tuple([c // f for c, f in
+                                 zip(position, self.factor)])] += amount
+
+    def add_values(self, positions, amounts):
+        """
+        Vectorized version of add_value, depositing amounts at many
+        positions in one call. Amounts deposited at positions of the same
+        block add up.
+
+        Parameters
+        ----------
+        positions : iterable or numpy.ndarray
+            The positions to write, as a sequence of tuples or as an
+            integer array of shape (n, 2) or (n, 3).
+        amounts : number or array-like
+            The amount to add at each position, or one amount for all of
+            them.
+        """
+        positions = self.normalize_positions(positions)
+        amounts = np.broadcast_to(np.asarray(amounts, dtype=float),
+                                  (len(positions),))
+
+        if self.boundary == CLIP:
+            inside = self.valid_positions(positions)
+            if not inside.all():
+                positions, amounts = positions[inside], amounts[inside]
+
+        indices = sum([blocks[positions[:, axis]] for axis, (_, _, _, blocks)
+                       in enumerate(self._axes)])
+        self.deposits += np.bincount(indices, amounts, self.deposits.size) \
+            .reshape(self.deposits.shape)
+
+    def set_from_array(self, values, reduction="mean"):
+        """
+        Sets the field from values given at the resolution of the grid,
+        eg: an initial condition, by aggregating each block.
+
+        Parameters
+        ----------
+        values : array-like
+            One value per position of the grid.
+        reduction : string, optional
+            How the values of a block are aggregated, one of "max", "min",
+            "sum" or "mean". Defaults to "mean".
+        """
+        values = np.asarray(values)
+
+        if values.shape != self._size:
+            raise ValueError("Expected values of shape %s, got %s" %
+                             (str(self._size), str(values.shape)))
+
+        self.field[...] = Numerics.restrict(values, self.factor, reduction)
+
+    def to_array(self):
+        """
+        Returns the field interpolated at every position of the grid, as
+        get_value would read it. The interpolation is separable, so it is
+        carried out one axis at a time.
+
+        Returns
+        -------
+        numpy.ndarray
+            An array of floats with the shape of the grid.
+        """
+        values = self.field
+
+        for axis in range(values.ndim):
+            below, above, fraction = self._axis_interpolation(axis)
+            fraction = fraction.reshape([-1 if a == axis else 1
+                                         for a in range(values.ndim)])
+            values = np.take(values, below, axis) * (1 - fraction) + \
+                np.take(values, above, axis) * fraction
+
+        return values
+
+    def _axis_interpolation(self, axis):
+        """
+        Returns, for every coordinate of the grid along an axis, the
+        positions of the field below and above it and the weight of the
+        position above.
+        """
+        n, f = self._size[axis], self.factor[axis]
+        m = self.field.shape[axis]
+        x = (np.arange(n) + .5) / f - .5
+
+        if self.boundary == CLIP:
+            x = np.clip(x, 0., m - 1.)
+
+        lower = np.floor(x).astype(np.intp)
+        indices = np.stack([lower, lower + 1], axis=-1)
+
+        if self.boundary == CLIP:
+            indices = np.minimum(indices, m - 1)
+        else:
+            indices = Numerics.map_coordinates(indices[..., None], (m,),
+                                               self.boundary)[0][..., 0]
+
+        return indices[:, 0], indices[:, 1], x - lower
+
+    def advance(self, model):
+        """
+        Applies the deposits of the epoch, then the update rules. This is
+        called by the schedule at the end of the main phase of every epoch.
+
+        Parameters
+        ----------
+        model : Model
+            The instance of the model to which the grid is attached.
+        """
+        self.field += self.deposits / self.block_sizes
+        self.deposits[...] = 0
+
+        for rule in self.rules:
+            result = rule(self, model)
+            if result is not None:
+                self.field[...] = result
+
+    def discard(self):
+        """
+        Discards the deposits made since the field was last advanced.
+        """
+        self.deposits[...] = 0
+
+
+class CoarseNumericalGrid2D(Grid2D, CoarseNumericalGrid, object):
+    """
+    Instantiates a 2D Coarse Numerical Grid. This extends Grid2D and
+    CoarseNumericalGrid, holding a field at a coarser resolution than a
+    two-dimensional grid of the same size.
+
+    Requires NumPy.
+
+    Attributes
+    ----------
+    name : string
+        The name of the environment, this will be used when referring to it
+        throughout the code.
+    xsize : int
+        The number of positions along the x-axis, as in the agents' grid.
+    ysize : int
+        The number of positions along the y-axis, as in the agents' grid.
+    model : model
+        The instance of the model class to which the environment will be
+        attached.
+    factor : int or tuple
+        The number of positions covered by a position of the field, along
+        both axes or along each axis. See CoarseNumericalGrid.
+    boundary : string, optional
+        How the grid treats its boundaries, one of "clip", "wrap" or
+        "reflect". See Grid. Defaults to "clip".
+    fill : number, optional
+        The initial value of the field. Defaults to 0.
+    """
+
+    def __init__(self, name, xsize, ysize, model, factor, boundary=CLIP,
+                 fill=0.):
+        Grid2D.__init__(self, name, xsize, ysize, model, boundary)
+        CoarseNumericalGrid.__init__(self, factor, fill)
+
+
+class CoarseNumericalGrid3D(Grid3D, CoarseNumericalGrid, object):
+    """
+    Instantiates a 3D Coarse Numerical Grid. This extends Grid3D and
+    CoarseNumericalGrid, holding a field at a coarser resolution than a
+    three-dimensional grid of the same size.
+
+    Requires NumPy.
+
+    Attributes
+    ----------
+    name : string
+        The name of the environment, this will be used when referring to it
+        throughout the code.
+    xsize : int
+        The number of positions along the x-axis, as in the agents' grid.
+    ysize : int
+        The number of positions along the y-axis, as in the agents' grid.
+    zsize : int
+        The number of positions along the z-axis, as in the agents' grid.
+    model : model
+        The instance of the model class to which the environment will be
+        attached.
+    factor : int or tuple
+        The number of positions covered by a position of the field, along
+        every axis or along each axis. See CoarseNumericalGrid.
+    boundary : string, optional
+        How the grid treats its boundaries, one of "clip", "wrap" or
+        "reflect". See Grid. Defaults to "clip".
+    fill : number, optional
+        The initial value of the field. Defaults to 0.
+    """
+
+    def __init__(self, name, xsize, ysize, zsize, model, factor,
+                 boundary=CLIP, fill=0.):
+        Grid3D.__init__(self, name, xsize, ysize, zsize, model, boundary)
+        CoarseNumericalGrid.__init__(self, factor, fill)
+
+
+class ContinuousSpace(object):
+    """
+    Initializes a ContinuousSpace. Continuous spaces hold agents at
+    real-valued (off-lattice) positions, such as particles or cells which
+    are not constrained to integer coordinates.
+
+    Agents are indexed in a cell list: the space is partitioned into square
+    (or cubic) buckets of side *cell_size*, and each agent is kept in the
+    bucket containing its position. The index is updated incrementally as
+    agents are added, moved and removed, so radius and nearest-neighbour
+    queries only need to inspect the buckets around the query position
+    rather than every agent in the space.
+
+    As a rule of thumb, *cell_size* should be close to the radius most
+    commonly used in queries.
+
+    This class would **not** be itself instantiated, but would be extended
+    by another class that would implement it.
+
+    Attributes
+    ----------
+    cell_size : float
+        The side of each bucket of the cell list.
+    """
+
+    def __init__(self, cell_size):
+        if cell_size <= 0:
+            raise ValueError("cell_size must be positive, got %s" %
+                             str(cell_size))
+
+        self.cell_size = float(cell_size)
+        self.cells = SparseCellStore(frozenset)
+        self.positions = dict()
+        self._rings = dict()
+
+    def _cell_of(self, position):
+        size = self.cell_size
+        return tuple([int(math.floor(c / size)) for c in position])
+
+    def _ring(self, radius):
+        """
+        Returns the offsets of all buckets at exactly *radius* buckets
+        (Chebyshev distance) from a central one. Rings are cached as they
+        are reused by every query.
+        """
+        ring = self._rings.get(radius)
+
+        if ring is None:
+            ring = [o for o in product(range(-radius, radius + 1),
+                                       repeat=len(self._size))
+                    if max([abs(c) for c in o]) == radius]
+            self._rings[radius] = ring
+
+        return ring
+
+    def _max_ring(self):
+        return int(math.ceil(max(self._size) / self.cell_size)) + 1
+
+    def _agents_in_ring(self, cell, radius):
+        cells = self.cells
+        found = []
+
+        for offset in self._ring(radius):
+            bucket = cells.get(tuple([c + o for c, o in zip(cell, offset)]))
+            if bucket:
+                found.extend(bucket)
+
+        return found
+
+    def _candidates(self, cell, reach):
+        found = list(self.cells.get(cell, ()))
+
+        for r in range(1, reach + 1):
+            found.extend(self._agents_in_ring(cell, r))
+
+        return found
+
+    def add_agent(self, agent, position):
+        """
+        Adds an agent to a position in the space.
+
+        This class does *not* update the internal state of the agent. So,
+        if the agent also keeps its own record of its position in the
+        space, this should be updated separately.
+
+        If an invalid position is provided, then the agent will not be added.
+
+        Parameters
+        ----------
+        agent : Agent
+            The instance of the agent we wish to add.
+        position: tuple
+            The position to which we wish to add the agent, given as a
+            tuple of two or three real values.
+
+        Returns
+        -------
+        bool
+            True if the agent was added, false otherwise.
+        """
+        if not self.valid_position(position):
+            return False
+
+        cell = self._cell_of(position)
+        bucket = self.cells.get(cell)
+
+        if bucket is None:
+            self.cells[cell] = set([agent])
+        else:
+            bucket.add(agent)
+
+        self.positions[agent] = tuple(position)
+        return True
+
+    def move_agent(self, agent, position_old, position_new):
+        """
+        Moves an agent from a position to another. Moves within the same
+        bucket of the index only update the agent's recorded position.
+
+        This class does *not* update the internal state of the agent. If an
+        invalid position is provided as a new position, the agent will not
+        be moved.
+
+        Parameters
+        ----------
+        agent : Agent
+            The instance of the agent we wish to update.
+        position_old : tuple
+            The old position of the agent.
+        position_new : tuple
+            The new position of the agent.
+
+        Returns
+        -------
+        bool
+            True if the agent was moved, false otherwise.
+        """
+        if not self.valid_position(position_new):
+            return False
+
+        cell_old = self._cell_of(position_old)
+        cell_new = self._cell_of(position_new)
+
+        if cell_old != cell_new:
+            self.remove_agent(agent, position_old)
+            self.add_agent(agent, position_new)
+        else:
+            self.positions[agent] = tuple(position_new)
+
+        return True
+
+    def remove_agent(self, agent, position):
+        """
+        Removes an agent from a position.
+
+        This class does *not* update the internal state of the agent.
+
+        Parameters
+        ----------
+        agent : Agent
+            The instance of the agent we wish to remove.
+        position: tuple
+            The position from which we wish to remove the agent.
+        """
+        cell = self._cell_of(position)
+        bucket = self.cells.get(cell)
+
+        if bucket is None:
+            raise KeyError(agent)
+
+        bucket.remove(agent)
+
+        if not bucket:
+            del self.cells[cell]
+
+        del self.positions[agent]
+
+    def rebuild_index(self, cell_size=None):
+        """
+        Rebuilds the cell list from the recorded agent positions, optionally
+        with a new bucket size. This is useful if the typical query radius
+        changes during the simulation.
+
+        Parameters
+        ----------
+        cell_size : float, optional
+            The new side of each bucket. Defaults to the current one.
+        """
+        if cell_size is not None:
+            if cell_size <= 0:
+                raise ValueError("cell_size must be positive, got %s" %
+                                 str(cell_size))
+            self.cell_size = float(cell_size)
+
+        self.cells = SparseCellStore(frozenset)
+        self._rings = dict()
+
+        for agent, position in self.positions.items():
+            cell = self._cell_of(position)
+            bucket = self.cells.get(cell)
+
+            if bucket is None:
+                self.cells[cell] = set([agent])
+            else:
+                bucket.add(agent)
+
+    def get_agents_in_radius(self, position, radius, exclude=None):
+        """
+        Returns all agents whose distance from a position is at most
+        *radius*.
+
+        Parameters
+        ----------
+        position : tuple
+            The centre of the search, given as a tuple of two or three real
+            values.
+        radius : float
+            The search radius.
+        exclude : Agent, optional
+            An agent which should not be included in the result, typically
+            the agent issuing the query.
+
+        Returns
+        -------
+        list
+            The agents within the radius, in no particular order.
+        """
+        return self.get_agents_in_radius_bulk([position], radius,
+                                              exclude=[exclude])[0]
+
+    def get_agents_in_radius_bulk(self, positions, radius, exclude=None):
+        """
+        Answers a radius query for each of many positions in one call.
+
+        Candidate agents are gathered once per bucket of the index, so
+        queries issued from the same region of the space (eg: all agents
+        asking for their neighbours) share the cost of walking the index.
+
+        Parameters
+        ----------
+        positions : iterable
+            The centres of the searches.
+        radius : float
+            The search radius, shared by all queries.
+        exclude : list, optional
+            If given, one agent per position which should be left out of
+            that position's result.
+
+        Returns
+        -------
+        list
+            A list holding, for each position, the list of agents within
+            the radius.
+        """
+        reach = int(math.ceil(radius / self.cell_size))
+        radius_sq = radius * radius
+        agent_positions = self.positions
+        candidates_by_cell = dict()
+        results = []
+
+        for i, position in enumerate(positions):
+            cell = self._cell_of(position)
+            candidates = candidates_by_cell.get(cell)
+
+            if candidates is None:
+                candidates = self._candidates(cell, reach)
+                candidates_by_cell[cell] = candidates
+
+            skip = exclude[i] if exclude is not None else None
+            found = []
+
+            for agent in candidates:
+                other = agent_positions[agent]
+                dist_sq = 0.
+                for a, b in zip(position, other):
+                    dist_sq += (a - b) * (a - b)
+                if dist_sq <= radius_sq and agent is not skip:
+                    found.append(agent)
+
+            results.append(found)
+
+        return results
+
+    def get_nearest_agents(self, position, k=1, exclude=None):
+        """
+        Returns the *k* agents closest to a position, nearest first.
+
+        The search walks rings of buckets outwards from the query position
+        and stops as soon as no agent in a further ring could be closer than
+        the k-th agent found so far.
+
+        Parameters
+        ----------
+        position : tuple
+            The position of the search.
+        k : int, optional
+            The number of agents to return. Defaults to 1. Fewer agents are
+            returned if the space holds fewer than *k* agents.
+        exclude : Agent, optional
+            An agent which should not be included in the result, typically
+            the agent issuing the query.
+
+        Returns
+        -------
+        list
+            A list of (distance, agent) tuples sorted by distance.
+        """
+        cell = self._cell_of(position)
+        agent_positions = self.positions
+        available = len(agent_positions) - (exclude in agent_positions)
+        found = []
+
+        for radius in range(0, self._max_ring() + 1):
+            if radius == 0:
+                ring = self.cells.get(cell, ())
+            else:
+                ring = self._agents_in_ring(cell, radius)
+
+            for agent in ring:
+                if agent is exclude:
+                    continue
+                dist_sq = 0.
+                for a, b in zip(position, agent_positions[agent]):
+                    dist_sq += (a - b) * (a - b)
+                found.append((math.sqrt(dist_sq), agent))
+
+            if len(found) >= available:
+                break
+
+            # Anything in the next ring is at least this far away.
+            if len(found) >= k:
+                found.sort(key=lambda f: f[0])
+                if found[k - 1][0] <= radius * self.cell_size:
+                    break
+
+        found.sort(key=lambda f: f[0])
+        return found[:k]
+
+    def get_nearest_agents_bulk(self, positions, k=1, exclude=None):
+        """
+        Answers a nearest-neighbour query for each of many positions.
+
+        Parameters
+        ----------
+        positions : iterable
+            The positions of the searches.
+        k : int, optional
+            The number of agents to return per position. Defaults to 1.
+        exclude : list, optional
+            If given, one agent per position which should be left out of
+            that position's result.
+
+        Returns
+        -------
+        list
+            A list holding, for each position, the list of (distance, agent)
+            tuples returned by get_nearest_agents.
+        """
+        return [self.get_nearest_agents(
+            p, k, exclude[i] if exclude is not None else None)
+            for i, p in enumerate(positions)]
+
+
+class ContinuousSpace2D(Environment, ContinuousSpace, object):
+    """
+    Instantiates a 2D continuous space. Agents may be placed at any
+    real-valued position (x, y) with 0 <= x < xsize and 0 <= y < ysize.
+
+    Agents are added, moved and removed through the usual Agent methods
+    (add_agent_to_grid, move_agent, remove_agent_from_grid), so the same
+    agent classes can be used with lattice and off-lattice environments.
+
+    Attributes
+    ----------
+    name : string
+        The name of the environment, this will be used when referring to it
+        throughout the code. (Eg: AgentEnv,
+        OxygenEnv, etc.)
+    xsize : float
+        The extent of the space along the x-axis.
+    ysize : float
+        The extent of the space along the y-axis.
+    model : model
+        The instance of the model class to which the environment will be
+        attached.
+    cell_size : float, optional
+        The side of each bucket of the neighbour search index. Defaults
+        to 1.
+    """
+
+    def __init__(self, name, xsize, ysize, model, cell_size=1.):
+        Environment.__init__(self, name, model)
+        ContinuousSpace.__init__(self, cell_size)
+        self.xsize = xsize
+        self.ysize = ysize
+        self._size = (xsize, ysize)
+
+    def valid_position(self, position):
+        """
+        Checks whether a position lies within the space.
+
+        Parameters
+        ----------
+        position : tuple
+            A tuple consisting of exactly two real values.
+
+        Returns
+        -------
+        bool
+            True if the position is a valid one, false otherwise.
+        """
+        return self.xsize > position[0] >= 0 and self.ysize > position[1] >= 0
+
+
+class ContinuousSpace3D(Environment, ContinuousSpace, object):
+    """
+    Instantiates a 3D continuous space. Agents may be placed at any
+    real-valued position (x, y, z) within the extent of the space.
+
+    Agents are added, moved and removed through the usual Agent methods
+    (add_agent_to_grid, move_agent, remove_agent_from_grid), so the same
+    agent classes can be used with lattice and off-lattice environments.
+
+    Attributes
+    ----------
+    name : string
+        The name of the environment, this will be used when referring to it
+        throughout the code. (Eg: AgentEnv,
+        OxygenEnv, etc.)
+    xsize : float
+        The extent of the space along the x-axis.
+    ysize : float
+        The extent of the space along the y-axis.
+    zsize : float
+        The extent of the space along the z-axis.
+    model : model
+        The instance of the model class to which the environment will be
+        attached.
+    cell_size : float, optional
+        The side of each bucket of the neighbour search index. Defaults
+        to 1.
+    """
+
+    def __init__(self, name, xsize, ysize, zsize, model, cell_size=1.):
+        Environment.__init__(self, name, model)
+        ContinuousSpace.__init__(self, cell_size)
+        self.xsize = xsize
+        self.ysize = ysize
+        self.zsize = zsize
+        self._size = (xsize, ysize, zsize)
+
+    def valid_position(self, position):
+        """
+        Checks whether a position lies within the space.
+
+        Parameters
+        ----------
+        position : tuple
+            A tuple consisting of exactly three real values.
+
+        Returns
+        -------
+        bool
+            True if the position is a valid one, false otherwise.
+        """
+        return self.xsize > position[0] >= 0 and self.ysize > position[
+            1] >= 0 and self.zsize > position[2] >= 0
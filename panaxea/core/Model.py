@@ -1,9 +1,18 @@
+import gc
 import os
+import random
 import sys
 import time
 from collections import defaultdict
 
-from panaxea.core.Schedule import Schedule
+from panaxea.core import Storage
+from panaxea.core.Numerics import np
+from panaxea.core.Schedule import Schedule, StopSimulation
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 
 class Model(object):
@@ -28,9 +37,37 @@ class Model(object):
             Specifies a dictionary of property values. This can follow any
             format he developers need and should be
             adapted to the simulation's needs. Defaults to an empty dictionary.
+        checkpoint_path : string, optional
+            If set, the model saves a checkpoint to this file while it runs
+            (see save_checkpoint), from which an interrupted run can be
+            resumed with load_checkpoint. Defaults to None.
+        checkpoint_every : int, optional
+            Every how many epochs a checkpoint is saved. Defaults to 1.
+        pause_gc : bool, optional
+            If set to true, the cyclic garbage collector is paused while
+            epochs run and the young generations are collected at the end of
+            each epoch instead, so that models creating and removing many
+            agents are not interrupted by collections mid-epoch. Defaults to
+            false.
+        full_gc_every : int, optional
+            When pause_gc is set, every how many epochs a full collection
+            runs, freeing long-lived objects which became garbage. Defaults
+            to 10.
     """
 
-    def __init__(self, epochs, verbose=True, properties=dict()):
+    # Models pickled before stop conditions, checkpoints or the garbage
+    # collection options were available run with none of them
+    stop_conditions = ()
+    stop_reason = None
+    checkpoint_path = None
+    checkpoint_every = 1
+    start_epoch = 0
+    pause_gc = False
+    full_gc_every = 10
+
+    def __init__(self, epochs, verbose=True, properties=dict(),
+                 checkpoint_path=None, checkpoint_every=1, pause_gc=False,
+                 full_gc_every=10):
         self.epochs = epochs
         self.schedule = Schedule()
         self.environments = dict()
@@ -38,6 +75,13 @@ class Model(object):
         self.current_epoch = 0
         self.properties = properties
         self.exit = False
+        self.stop_conditions = []
+        self.stop_reason = None
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.start_epoch = 0
+        self.pause_gc = pause_gc
+        self.full_gc_every = full_gc_every
 
         self.output = defaultdict(dict)
 
@@ -46,11 +90,187 @@ class Model(object):
         if not self.verbose and "unittest" not in sys.modules:
             sys.stdout = os.devnull
 
+    def add_stop_condition(self, condition, reason=None):
+        """
+        Adds a stop condition, a function of the model which returns true
+        once the simulation should stop (eg: because it converged).
+
+        Stop conditions are evaluated by the schedule after every phase of
+        every epoch. When one of them holds, the exit flag is set, the
+        remaining phases of the epoch are skipped and the model stops
+        running at the end of the epoch.
+
+        Parameters
+        ----------
+        condition : callable
+            A function taking the model and returning a boolean.
+        reason : string, optional
+            A description of the condition, recorded as the model's
+            stop_reason when it holds.
+        """
+        self.stop_conditions = list(self.stop_conditions) + \
+            [(condition, reason)]
+
+    def should_stop(self):
+        """
+        Evaluates the stop conditions, setting the exit flag (and the stop
+        reason) if one of them holds. Setting the exit flag directly, as
+        older models do, is not a stop condition: the simulation then stops
+        once the current epoch is complete.
+
+        Returns
+        -------
+        bool
+            True if one of the stop conditions holds.
+        """
+        for condition, reason in self.stop_conditions:
+            if condition(self):
+                self.exit = True
+                self.stop_reason = reason
+                return True
+
+        return False
+
+    def abort(self, reason=None):
+        """
+        Stops the simulation immediately. This can be called from any
+        step method: the steppables which have not yet been stepped in the
+        current phase, and the remaining phases of the epoch, are skipped.
+
+        Parameters
+        ----------
+        reason : string, optional
+            Why the simulation was stopped, recorded as the model's
+            stop_reason.
+        """
+        raise StopSimulation(reason)
+
+    def save_checkpoint(self, path=None):
+        """
+        Saves the whole model, together with the state of the random number
+        generators of the random module and of NumPy (if installed), so
+        that the simulation can be resumed exactly where it was left. This
+        can be called from any step method: the simulation resumes at the
+        epoch following the current one, so a checkpoint saved mid-epoch
+        is best saved from an epilogue.
+
+        The checkpoint is first written to a temporary file which then
+        replaces *path*, so a run killed while saving never leaves a
+        truncated checkpoint behind.
+
+        All steppables, environments, properties and stop conditions must
+        be picklable (eg: functions should be defined at module level
+        rather than as lambdas).
+
+        The files of memory-mapped grids are copied next to the checkpoint
+        (see MappedCellStore), and the copies made for an earlier
+        checkpoint to the same path are removed once it is replaced.
+
+        Parameters
+        ----------
+        path : string, optional
+            The file to write. Defaults to the model's checkpoint_path; a
+            ValueError is raised if neither is set.
+        """
+        path = path or self.checkpoint_path
+
+        if path is None:
+            raise ValueError("No checkpoint path was given and the model "
+                             "has no checkpoint_path")
+
+        checkpoint = {
+            "model": self,
+            "random_state": random.getstate(),
+            "numpy_random_state": None if np is None else
+            np.random.get_state(),
+            "resume_epoch": self.current_epoch + 1
+        }
+
+        temporary = "%s.tmp" % path
+        files = Storage.CheckpointFiles(path, self.current_epoch)
+        Storage.checkpoint_files = files
+
+        try:
+            with open(temporary, "wb") as output_file:
+                pickle.dump(checkpoint, output_file, pickle.HIGHEST_PROTOCOL)
+                output_file.flush()
+                os.fsync(output_file.fileno())
+        finally:
+            Storage.checkpoint_files = None
+
+        getattr(os, "replace", os.rename)(temporary, path)
+        files.prune()
+
+    @staticmethod
+    def load_checkpoint(path):
+        """
+        Loads a model saved by save_checkpoint and restores the state of
+        the random number generators. Calling run on the returned model
+        resumes the simulation at the epoch following the checkpoint.
+
+        Parameters
+        ----------
+        path : string
+            The checkpoint file.
+
+        Returns
+        -------
+        Model
+            The model, as it was when the checkpoint was saved.
+        """
+        with open(path, "rb") as input_file:
+            checkpoint = pickle.load(input_file)
+
+        random.setstate(checkpoint["random_state"])
+
+        if np is not None and checkpoint["numpy_random_state"] is not None:
+            np.random.set_state(checkpoint["numpy_random_state"])
+
+        model = checkpoint["model"]
+        model.start_epoch = checkpoint["resume_epoch"]
+        return model
+
+    def _checkpoint_due(self, epoch):
+        return self.checkpoint_path is not None and \
+            (epoch + 1) % self.checkpoint_every == 0
+
+    def _pause_gc(self):
+        """
+        Disables the cyclic garbage collector, if pause_gc is set. Objects
+        created during setup are frozen (on Python 3.7+), so the
+        collections run between epochs only traverse objects created since.
+
+        Returns
+        -------
+        bool
+            Whether the garbage collector was enabled.
+        """
+        enabled = gc.isenabled()
+
+        if self.pause_gc:
+            gc.disable()
+            if hasattr(gc, "freeze"):
+                gc.freeze()
+
+        return enabled
+
+    def _resume_gc(self, enabled):
+        if self.pause_gc:
+            if hasattr(gc, "unfreeze"):
+                gc.unfreeze()
+            if enabled:
+                gc.enable()
+
     def run(self):
         """
         Runs the simulation for the number of epochs configured or until an
         the exit flag is set to true.
 
+        Models loaded from a checkpoint resume at the epoch following the
+        checkpoint. If a checkpoint path is set, checkpoints are saved
+        every checkpoint_every epochs. If pause_gc is set, garbage is
+        collected between epochs rather than during them.
+
         Note that the state of the schedule, environments etc. will result
         altered after the model runs. If you
         wish to run the same model multiple times, you should first copy the
@@ -59,8 +279,21 @@ class Model(object):
         """
 
         epochs_time = []
+        gc_enabled = self._pause_gc()
+
+        try:
+            self._run_epochs(epochs_time)
+        finally:
+            self._resume_gc(gc_enabled)
+
+        self.start_epoch = 0
+        print("Total time %s" % str(sum(epochs_time)))
 
-        for i in range(0, self.epochs):
+        if "unittest" not in sys.modules:
+            sys.stdout = sys.__stdout__
+
+    def _run_epochs(self, epochs_time):
+        for i in range(self.start_epoch, self.epochs):
 
             if self.exit:
                 print("Exit flag set to true, finishing at epoch %s" % str(
@@ -72,11 +305,20 @@ class Model(object):
             print("Epoch %s" % i)
 
             self.schedule.step_schedule(self)
+
+            if self.pause_gc:
+                gc.collect(2 if (i + 1) % self.full_gc_every == 0 else 1)
+
             time_taken = time.time() - start_time
             print("Epoch took %s seconds" % time_taken)
             epochs_time.append(time_taken)
 
-        print("Total time %s" % str(sum(epochs_time)))
+            if self._checkpoint_due(i):
+                self.save_checkpoint()
 
-        if "unittest" not in sys.modules:
-            sys.stdout = sys.__stdout__
+            if self.exit:
+                print("Exit flag set to true, finishing at epoch %s" % str(
+                    self.current_epoch))
+                if self.stop_reason is not None:
+                    print("Reason: %s" % str(self.stop_reason))
+                break
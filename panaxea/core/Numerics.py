@@ -0,0 +1,584 @@
+"""
+Vectorized helpers shared by the environments. These operate on dense NumPy
+arrays holding the contents of a grid and are used to answer many
+neighbourhood queries, or a query for every position of the grid, in a
+single call.
+
+NumPy is an optional dependency of PanaXea: these helpers raise an
+ImportError when called if it is not installed.
+"""
+from itertools import product
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CLIP = "clip"
+WRAP = "wrap"
+REFLECT = "reflect"
+
+REDUCTIONS = ("max", "min", "sum", "mean")
+
+
+def require_numpy(feature):
+    """
+    Raises an informative ImportError if NumPy is not available.
+
+    Parameters
+    ----------
+    feature : string
+        The name of the feature requiring NumPy, used in the error message.
+    """
+    if np is None:
+        raise ImportError("%s requires NumPy to be installed" % feature)
+
+
+def as_positions(positions, dimensions):
+    """
+    Converts a collection of positions to an integer array of shape
+    (n, dimensions).
+
+    Parameters
+    ----------
+    positions : iterable or numpy.ndarray
+        The positions, as a sequence of tuples or as an array.
+    dimensions : int
+        The number of dimensions of each position.
+
+    Returns
+    -------
+    numpy.ndarray
+        The positions as an array.
+    """
+    positions = np.asarray(positions)
+
+    if positions.size == 0:
+        return np.empty((0, dimensions), dtype=np.intp)
+
+    return positions.reshape(-1, dimensions)
+
+
+def map_coordinates(coordinates, size, boundary):
+    """
+    Applies a boundary mode to an array of coordinates, returning the
+    mapped coordinates and a mask of the coordinates which fall within the
+    grid.
+
+    Parameters
+    ----------
+    coordinates : numpy.ndarray
+        An integer array whose last axis holds one coordinate per
+        dimension.
+    size : tuple
+        The number of positions along each axis of the grid.
+    boundary : string
+        One of "clip", "wrap" or "reflect".
+
+    Returns
+    -------
+    tuple
+        The mapped coordinates and a boolean mask of valid coordinates.
+    """
+    size = np.asarray(size)
+
+    if boundary == WRAP:
+        mapped = coordinates % size
+        return mapped, np.ones(coordinates.shape[:-1], dtype=bool)
+
+    if boundary == REFLECT:
+        mapped = coordinates % (2 * size)
+        mapped = np.where(mapped >= size, 2 * size - 1 - mapped, mapped)
+        return mapped, np.ones(coordinates.shape[:-1], dtype=bool)
+
+    valid = np.all((coordinates >= 0) & (coordinates < size), axis=-1)
+    return np.where(valid[..., None], coordinates, 0), valid
+
+
+def gather_neighbourhoods(values, positions, offsets, boundary):
+    """
+    Collects the values of the neighbourhoods of many positions.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The dense contents of the grid.
+    positions : numpy.ndarray
+        An integer array of shape (n, dimensions).
+    offsets : numpy.ndarray
+        An integer array of shape (k, dimensions) describing the
+        neighbourhood.
+    boundary : string
+        One of "clip", "wrap" or "reflect".
+
+    On wrapping and reflecting grids, neighbours which map back onto the
+    position itself or onto a neighbour already collected (as happens at
+    the edges of reflecting grids and on small wrapping grids) are flagged
+    as invalid, so that each neighbour counts once, as in
+    Grid.get_neighbourhood.
+
+    Returns
+    -------
+    tuple
+        An array of shape (n, k) with the neighbours' values, an array of
+        shape (n, k, dimensions) with their (mapped) coordinates and a
+        boolean array of shape (n, k) flagging neighbours within the grid.
+    """
+    candidates = positions[:, None, :] + offsets[None, :, :]
+    mapped, valid = map_coordinates(candidates, values.shape, boundary)
+    gathered = values[tuple(np.moveaxis(mapped, -1, 0))]
+
+    if boundary != CLIP and len(offsets) > 0:
+        valid &= _unique_neighbours(values.shape, positions, offsets, mapped,
+                                    boundary)
+
+    return gathered, mapped, valid
+
+
+def _unique_neighbours(shape, positions, offsets, mapped, boundary):
+    """
+    Flags the neighbours which are neither the position itself (for offsets
+    other than the origin) nor a repeat of a neighbour with an earlier
+    offset.
+    """
+    flat = np.ravel_multi_index(tuple(np.moveaxis(mapped, -1, 0)), shape)
+    centres = map_coordinates(positions, shape, boundary)[0]
+    centres = np.ravel_multi_index(tuple(centres.T), shape)
+
+    unique = (flat != centres[:, None]) | ~np.any(offsets != 0, axis=1)
+
+    # A stable sort keeps repeats in offset order, so the first one stays
+    order = np.argsort(flat, axis=1, kind="stable")
+    ordered = np.take_along_axis(flat, order, axis=1)
+    repeated = np.zeros(flat.shape, dtype=bool)
+    repeated[:, 1:] = ordered[:, 1:] == ordered[:, :-1]
+    np.put_along_axis(unique, order,
+                      np.take_along_axis(unique, order, axis=1) & ~repeated,
+                      axis=1)
+    return unique
+
+
+def reduce_neighbourhoods(values, positions, offsets, boundary, reduction):
+    """
+    Reduces the neighbourhood of each of many positions to a single value.
+
+    Neighbourhoods without any position within the grid reduce to NaN,
+    or zero for sums.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The dense contents of the grid.
+    positions : numpy.ndarray
+        An integer array of shape (n, dimensions).
+    offsets : numpy.ndarray
+        An integer array of shape (k, dimensions).
+    boundary : string
+        One of "clip", "wrap" or "reflect".
+    reduction : string
+        One of "max", "min", "sum" or "mean".
+
+    Returns
+    -------
+    numpy.ndarray
+        An array of shape (n,) with one reduced value per position.
+    """
+    if reduction not in REDUCTIONS:
+        raise ValueError("Unknown reduction %s, expected one of %s" %
+                         (str(reduction), ", ".join(REDUCTIONS)))
+
+    gathered, _, valid = gather_neighbourhoods(values, positions, offsets,
+                                               boundary)
+    gathered = gathered.astype(float)
+    counts = valid.sum(axis=1)
+
+    if reduction == "sum":
+        return np.where(valid, gathered, 0.).sum(axis=1)
+
+    if reduction == "mean":
+        sums = np.where(valid, gathered, 0.).sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, sums / counts, np.nan)
+
+    fill = -np.inf if reduction == "max" else np.inf
+    masked = np.where(valid, gathered, fill)
+    reduced = masked.max(axis=1) if reduction == "max" else masked.min(axis=1)
+    return np.where(counts > 0, reduced, np.nan)
+
+
+def arg_neighbourhoods(values, positions, offsets, boundary, reduction):
+    """
+    Finds, for each of many positions, the neighbour holding the largest
+    (or smallest) value.
+
+    Ties are resolved in favour of the neighbour whose offset comes first.
+    Positions without any neighbour within the grid get -1 as coordinates.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The dense contents of the grid.
+    positions : numpy.ndarray
+        An integer array of shape (n, dimensions).
+    offsets : numpy.ndarray
+        An integer array of shape (k, dimensions).
+    boundary : string
+        One of "clip", "wrap" or "reflect".
+    reduction : string
+        Either "max" or "min".
+
+    Returns
+    -------
+    numpy.ndarray
+        An integer array of shape (n, dimensions) with the coordinates of
+        the selected neighbour of each position.
+    """
+    if reduction not in ("max", "min"):
+        raise ValueError("Unknown reduction %s, expected max or min" %
+                         str(reduction))
+
+    gathered, mapped, valid = gather_neighbourhoods(values, positions,
+                                                    offsets, boundary)
+    gathered = gathered.astype(float)
+
+    if reduction == "max":
+        selected = np.where(valid, gathered, -np.inf).argmax(axis=1)
+    else:
+        selected = np.where(valid, gathered, np.inf).argmin(axis=1)
+
+    rows = np.arange(len(positions))
+    result = mapped[rows, selected]
+    result[~valid.any(axis=1)] = -1
+    return result
+
+
+def _pad(values, reach, boundary, reduction):
+    """
+    Pads a grid by *reach* positions on every side according to a boundary
+    mode. For clipped grids, also returns an array flagging which padded
+    positions belong to the grid, or None otherwise.
+    """
+    if boundary == WRAP:
+        return np.pad(values, reach, mode="wrap"), None
+
+    if boundary == REFLECT:
+        return np.pad(values, reach, mode="symmetric"), None
+
+    fill = {"max": -np.inf, "min": np.inf}.get(reduction, 0.)
+    padded = np.pad(values, reach, mode="constant", constant_values=fill)
+    weights = np.pad(np.ones(values.shape), reach, mode="constant")
+    return padded, weights
+
+
+def neighbourhood_map(values, offsets, boundary, reduction):
+    """
+    Reduces the neighbourhood of every position of a grid at once, by
+    combining shifted views of the (padded) grid.
+
+    The result can be computed once per epoch and then read by every agent,
+    instead of each agent searching its own neighbourhood.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The dense contents of the grid.
+    offsets : numpy.ndarray
+        An integer array of shape (k, dimensions).
+    boundary : string
+        One of "clip", "wrap" or "reflect". Reflecting grids mirror the
+        values at their edges, as NumPy's "symmetric" padding does.
+    reduction : string
+        One of "max", "min", "sum" or "mean".
+
+    Returns
+    -------
+    numpy.ndarray
+        An array with the same shape as *values* where each position holds
+        the reduction over its neighbourhood.
+    """
+    if reduction not in REDUCTIONS:
+        raise ValueError("Unknown reduction %s, expected one of %s" %
+                         (str(reduction), ", ".join(REDUCTIONS)))
+
+    values = np.asarray(values, dtype=float)
+    result = _shifted_map(values, offsets, boundary, reduction)
+
+    # Shifted views count positions reached twice, or the position itself,
+    # at the edges of wrapping and reflecting grids. Positions whose
+    # neighbourhood may do so are reduced again from their unique
+    # neighbours.
+    edges = _edge_positions(values.shape, offsets, boundary)
+
+    if len(edges) > 0:
+        result[tuple(edges.T)] = reduce_neighbourhoods(
+            values, edges, offsets, boundary, reduction)
+
+    return result
+
+
+def _edge_positions(shape, offsets, boundary):
+    """
+    Returns the positions of a wrapping or reflecting grid whose
+    neighbourhood may include repeated positions or the position itself.
+    """
+    reach = int(np.abs(offsets).max()) if len(offsets) > 0 else 0
+
+    if boundary == CLIP or reach == 0:
+        return np.empty((0, len(shape)), dtype=np.intp)
+
+    edges = np.zeros(shape, dtype=bool)
+
+    if boundary == WRAP:
+        # Wrapping only repeats positions along axes spanning the stencil
+        edges[...] = any(n <= 2 * reach for n in shape)
+        return np.argwhere(edges)
+
+    for axis, n in enumerate(shape):
+        window = [slice(None)] * len(shape)
+        window[axis] = slice(0, reach)
+        edges[tuple(window)] = True
+        window[axis] = slice(max(n - reach, 0), n)
+        edges[tuple(window)] = True
+
+    return np.argwhere(edges)
+
+
+def _shifted_map(values, offsets, boundary, reduction):
+    """
+    Reduces the neighbourhood of every position by combining shifted views
+    of the padded grid. See neighbourhood_map.
+    """
+    reach = int(np.abs(offsets).max())
+    shape = values.shape
+    padded, weights = _pad(values, reach, boundary, reduction)
+    result = None
+    counts = 0. if weights is not None else float(len(offsets))
+
+    for offset in offsets:
+        window = tuple(slice(reach + o, reach + o + n)
+                       for o, n in zip(offset, shape))
+        view = padded[window]
+
+        if result is None:
+            result = view.copy()
+        elif reduction == "max":
+            np.maximum(result, view, out=result)
+        elif reduction == "min":
+            np.minimum(result, view, out=result)
+        else:
+            result += view
+
+        if weights is not None:
+            counts = counts + weights[window]
+
+    if reduction == "mean":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result = np.where(counts > 0, result / counts, np.nan)
+    elif reduction in ("max", "min") and weights is not None:
+        result[counts == 0] = np.nan
+
+    return result
+
+
+def _box_sum(padded, reach, shape):
+    """
+    Sums every window of side 2 * reach + 1 of a padded array, one axis at
+    a time.
+    """
+    for axis, n in enumerate(shape):
+        width = 2 * reach + 1
+        window = [slice(None)] * padded.ndim
+        window[axis] = slice(0, n)
+        summed = padded[tuple(window)].copy()
+
+        for o in range(1, width):
+            window[axis] = slice(o, o + n)
+            summed += padded[tuple(window)]
+
+        padded = summed
+
+    return padded
+
+
+def _box_offsets(offsets, reach, dimensions):
+    """
+    Checks whether offsets make up the full square (or cubic) box of side
+    2 * reach + 1, with or without the origin. Returns whether the origin
+    is included, or None if the offsets are not such a box.
+    """
+    if reach == 0:
+        return None
+
+    present = set(map(tuple, offsets.tolist()))
+    box = set(product(range(-reach, reach + 1), repeat=dimensions))
+    origin = (0,) * dimensions
+
+    if present == box:
+        return True
+
+    if present == box - set([origin]):
+        return False
+
+    return None
+
+
+def neighbourhood_sum(values, offsets, boundary, weights=None):
+    """
+    Sums the (optionally weighted) neighbourhood of every position of a
+    grid at once, as a convolution would. Unlike neighbourhood_map, integer
+    and boolean grids are summed as integers, and positions outside a
+    clipped grid count as zero.
+
+    Full square (or cubic) neighbourhoods without weights, such as the
+    moore neighbourhood, are summed one axis at a time, which takes fewer
+    operations than adding one shifted view per offset. As in
+    neighbourhood_map, positions at the edges of wrapping and reflecting
+    grids are summed again from their unique neighbours.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The dense contents of the grid.
+    offsets : numpy.ndarray
+        An integer array of shape (k, dimensions), without duplicates.
+    boundary : string
+        One of "clip", "wrap" or "reflect".
+    weights : numpy.ndarray, optional
+        One weight per offset. Defaults to all ones.
+
+    Returns
+    -------
+    numpy.ndarray
+        An array with the same shape as *values* where each position holds
+        the sum over its neighbourhood.
+    """
+    values = np.asarray(values)
+    offsets = np.asarray(offsets)
+    reach = int(np.abs(offsets).max())
+    shape = values.shape
+
+    if values.dtype == bool:
+        values = values.astype(np.uint8 if len(offsets) < 256 else np.intc)
+
+    if boundary == CLIP:
+        padded = np.pad(values, reach, mode="constant")
+    else:
+        padded, _ = _pad(values, reach, boundary, "sum")
+
+    box = _box_offsets(offsets, reach, len(shape)) if weights is None \
+        else None
+
+    if box is not None:
+        result = _box_sum(padded, reach, shape)
+        if not box:
+            result -= values
+    else:
+        result = _shifted_sum(padded, reach, offsets, weights)
+
+    edges = _edge_positions(shape, offsets, boundary)
+
+    if len(edges) > 0:
+        gathered, _, valid = gather_neighbourhoods(values, edges, offsets,
+                                                   boundary)
+        if weights is not None:
+            gathered = gathered * np.asarray(weights)
+        result[tuple(edges.T)] = np.where(valid, gathered, 0).sum(axis=1)
+
+    return result
+
+
+def _shifted_sum(padded, reach, offsets, weights):
+    """
+    Sums one shifted view of a padded grid per offset.
+    """
+    shape = tuple(n - 2 * reach for n in padded.shape)
+    dtype = padded.dtype if weights is None else \
+        np.result_type(padded, np.asarray(weights))
+    result = np.zeros(shape, dtype=dtype)
+
+    for i, offset in enumerate(offsets):
+        view = padded[tuple(slice(reach + o, reach + o + n)
+                            for o, n in zip(offset, shape))]
+        if weights is None:
+            result += view
+        else:
+            result += weights[i] * view
+
+    return result
+
+
+def block_sizes(shape, factor):
+    """
+    Counts the positions of a grid falling in each block of a coarser grid,
+    where every block covers *factor* positions along each axis. Blocks at
+    the far edges are smaller when the size of the grid is not a multiple
+    of the factor.
+
+    Parameters
+    ----------
+    shape : tuple
+        The number of positions along each axis of the grid.
+    factor : tuple
+        The number of positions covered by a block along each axis.
+
+    Returns
+    -------
+    numpy.ndarray
+        The number of positions in each block.
+    """
+    sizes = np.ones(())
+
+    for n, f in zip(shape, factor):
+        counts = np.minimum(f, n - np.arange(0, n, f))
+        sizes = np.multiply.outer(sizes, counts)
+
+    return sizes
+
+
+def restrict(values, factor, reduction="mean"):
+    """
+    Aggregates a grid into a coarser grid, where every position of the
+    coarse grid reduces a block of *factor* positions along each axis.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The dense contents of the grid.
+    factor : tuple
+        The number of positions covered by a block along each axis.
+    reduction : string, optional
+        One of "max", "min", "sum" or "mean". Defaults to "mean".
+
+    Returns
+    -------
+    numpy.ndarray
+        The coarse grid, with -(-n // f) positions along an axis of n
+        positions.
+    """
+    if reduction not in REDUCTIONS:
+        raise ValueError("Unknown reduction %s, expected one of %s" %
+                         (str(reduction), ", ".join(REDUCTIONS)))
+
+    values = np.asarray(values, dtype=float)
+    coarse = [-(-n // f) for n, f in zip(values.shape, factor)]
+    fill = {"max": -np.inf, "min": np.inf}.get(reduction, 0.)
+    padded = np.pad(values, [(0, c * f - n) for c, f, n in
+                             zip(coarse, factor, values.shape)],
+                    mode="constant", constant_values=fill)
+
+    blocks = padded.reshape([m for c, f in zip(coarse, factor)
+                             for m in (c, f)])
+    axes = tuple(range(1, blocks.ndim, 2))
+
+    if reduction == "max":
+        return blocks.max(axis=axes)
+
+    if reduction == "min":
+        return blocks.min(axis=axes)
+
+    result = blocks.sum(axis=axes)
+
+    if reduction == "mean":
+        result /= block_sizes(values.shape, factor)
+
+    return result
@@ -1,3 +1,103 @@
+class StopSimulation(Exception):
+    """
+    Raised by Model.abort to stop a simulation immediately. The schedule
+    catches it, so the remaining steppables of the current phase and the
+    remaining phases of the epoch are skipped, and the model finishes
+    running.
+
+    Attributes
+    ----------
+    reason : string, optional
+        Why the simulation was stopped.
+    """
+
+    def __init__(self, reason=None):
+        super(StopSimulation, self).__init__(reason)
+        self.reason = reason
+
+
+class AgentPool(object):
+    """
+    Keeps removed agents for reuse, so that models where many agents are
+    born and die every epoch do not allocate (and garbage collect) a new
+    object for every birth.
+
+    Agents are pooled per class. Acquiring an agent of a class takes a
+    pooled instance, if any, and resets it with its recycle method, and
+    otherwise creates a new one. Once a pool is set on the schedule,
+    agents removed from the schedule are released to it automatically, so
+    removed agents must no longer be referenced by the model (eg: by other
+    agents) as they will be reused.
+
+    Attributes
+    ----------
+    max_size : int, optional
+        The maximum number of agents kept per class. Defaults to None,
+        meaning no limit.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.free = dict()
+        self.created = 0
+        self.recycled = 0
+
+    def __len__(self):
+        return sum(len(agents) for agents in self.free.values())
+
+    def acquire(self, cls, *args, **kwargs):
+        """
+        Returns an agent of the given class, recycled from the pool if
+        possible.
+
+        Parameters
+        ----------
+        cls : type
+            The class of the agent.
+        args
+            The positional arguments of the class' constructor.
+        kwargs
+            The keyword arguments of the class' constructor.
+
+        Returns
+        -------
+        Steppable
+            The agent, either new or recycled.
+        """
+        free = self.free.get(cls)
+
+        if free:
+            agent = free.pop()
+            agent.recycle(*args, **kwargs)
+            self.recycled += 1
+            return agent
+
+        self.created += 1
+        return cls(*args, **kwargs)
+
+    def release(self, agents):
+        """
+        Returns agents to the pool. Agents beyond the maximum size of the
+        pool for their class are discarded.
+
+        Parameters
+        ----------
+        agents : iterable
+            The agents to return to the pool.
+        """
+        for agent in agents:
+            free = self.free.setdefault(agent.__class__, [])
+
+            if self.max_size is None or len(free) < self.max_size:
+                free.append(agent)
+
+    def clear(self):
+        """
+        Empties the pool.
+        """
+        self.free = dict()
+
+
 class Schedule(object):
     """
     Holds all simulation steppables and provides methods to progress
@@ -14,13 +114,70 @@ class Schedule(object):
     The list *agents* should not be accessed directly.
 
     The list *helpers* should be set during simulation setup.
+
+    If an AgentPool is set as *pool*, agents removed from the schedule are
+    released to it, and new agents should be created with spawn, which
+    reuses them.
     """
 
-    def __init__(self):
+    # Schedules pickled before agent pools were available have none
+    pool = None
+
+    def __init__(self, pool=None):
         self.agents = set([])
         self.helpers = []
         self.agents_to_schedule = set([])
         self.agents_to_remove = set([])
+        self.pool = pool
+
+    def spawn(self, cls, *args, **kwargs):
+        """
+        Creates an agent, or recycles one from the schedule's pool, and adds
+        it to *agents_to_schedule*.
+
+        Parameters
+        ----------
+        cls : type
+            The class of the agent.
+        args
+            The positional arguments of the class' constructor.
+        kwargs
+            The keyword arguments of the class' constructor.
+
+        Returns
+        -------
+        Steppable
+            The agent, which joins the schedule at the start of the next
+            epoch.
+        """
+        if self.pool is None:
+            agent = cls(*args, **kwargs)
+        else:
+            agent = self.pool.acquire(cls, *args, **kwargs)
+
+        self.agents_to_schedule.add(agent)
+        return agent
+
+    def add_agents(self, agents, immediate=False):
+        """
+        Schedules many agents in one call.
+
+        By default, agents are added to *agents_to_schedule* and will join
+        the schedule at the start of the next epoch. During model setup,
+        *immediate* may be set to add them to the schedule straight away.
+
+        Parameters
+        ----------
+        agents : iterable
+            The agents to schedule.
+        immediate : bool, optional
+            If set to true, the agents are added to the schedule directly.
+            Defaults to false.
+        """
+        if immediate:
+            self.agents.update(agents)
+        else:
+            self.agents_to_schedule.update(agents)
 
     def step_schedule(self, model):
         """
@@ -28,12 +185,23 @@ class Schedule(object):
         executes all step methods of
         agents and helpers as appropriate.
 
+        The model's stop conditions are checked after every phase. Once
+        one of them holds, the remaining phases of the epoch are skipped.
+        A call to Model.abort skips the remaining steppables of the current
+        phase as well, and discards the move intents, lattice states and
+        deposits still pending. Setting the model's exit flag directly does
+        not skip anything: the epoch is completed.
+
         Parameters
         ----------
         model : Model
             The instance of the model to which the schedule is bound.
         """
 
+        if self.pool is not None:
+            self.pool.release((self.agents & self.agents_to_remove) -
+                              self.agents_to_schedule)
+
         self.agents = self.agents - self.agents_to_remove
         self.agents = self.agents | self.agents_to_schedule
 
@@ -42,9 +210,70 @@ class Schedule(object):
 
         print("I am stepping %s agents" % self.agents.__len__())
 
-        self.step_prologues(model)
-        self.step_mains(model)
-        self.step_epilogues(model)
+        try:
+            self.step_prologues(model)
+            if model.should_stop():
+                return
+
+            self.step_mains(model)
+            self.advance_lattices(model)
+            if model.should_stop():
+                return
+
+            self.step_epilogues(model)
+            model.should_stop()
+        except StopSimulation as stop:
+            self.discard_pending(model)
+            model.exit = True
+            model.stop_reason = stop.reason
+
+    def discard_pending(self, model):
+        """
+        Discards the move intents submitted to environments with
+        synchronous moves and the updates pending in lattice and coarse
+        numerical grids, so that no update of an aborted phase leaks into
+        a later epoch or a checkpoint.
+
+        Parameters
+        ----------
+        model : Model
+            The instance of the model to which the schedule is bound.
+        """
+        for env in model.environments.values():
+            if getattr(env, "move_intents", None):
+                env.move_intents = []
+            if hasattr(env, "discard"):
+                env.discard()
+
+    def resolve_moves(self, model):
+        """
+        Resolves the move intents submitted to environments with
+        synchronous moves. This is called at the end of every phase.
+
+        Parameters
+        ----------
+        model : Model
+            The instance of the model to which the schedule is bound.
+        """
+        for env in model.environments.values():
+            if getattr(env, "move_intents", None):
+                env.resolve_moves()
+
+    def advance_lattices(self, model):
+        """
+        Applies the update rules of all lattice environments and swaps
+        their state buffers, and applies the deposits and update rules of
+        coarse numerical grids. This is called between the main and
+        epilogue phases, so epilogues see the new states.
+
+        Parameters
+        ----------
+        model : Model
+            The instance of the model to which the schedule is bound.
+        """
+        for env in model.environments.values():
+            if hasattr(env, "advance"):
+                env.advance(model)
 
     def step_prologues(self, model):
         """
@@ -66,6 +295,8 @@ class Schedule(object):
         for a in self.agents:
             a.step_prologue(model)
 
+        self.resolve_moves(model)
+
     def step_mains(self, model):
         """
         Executes the StepMan method of all helpers first and all agents after.
@@ -85,6 +316,8 @@ class Schedule(object):
         for a in self.agents:
             a.step_main(model)
 
+        self.resolve_moves(model)
+
     def step_epilogues(self, model):
         """
         Executes the StepEpilogue method of all helpers first and all agents
@@ -104,3 +337,5 @@ class Schedule(object):
 
         for a in self.agents:
             a.step_epilogue(model)
+
+        self.resolve_moves(model)
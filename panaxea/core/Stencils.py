@@ -0,0 +1,169 @@
+from itertools import product
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class Stencil(object):
+    """
+    A neighbourhood shape, described as a collection of offsets relative to
+    a central position.
+
+    Stencils are used by grid environments to generate neighbourhoods. The
+    offsets are validated and deduplicated once when the stencil is built,
+    and stencils for the common shapes (Moore and von Neumann
+    neighbourhoods of any radius) are cached, so the same stencil instance
+    can be shared by every query in a simulation.
+
+    Attributes
+    ----------
+    offsets : tuple
+        The offsets, each a tuple of integers with one value per dimension.
+        The central position is only part of the neighbourhood if the
+        offset (0, 0) (or (0, 0, 0)) is included.
+    dimensions : int
+        The number of dimensions of the stencil.
+    reach : int
+        The largest absolute offset along any axis. Positions at least this
+        far from every edge of a grid have their whole neighbourhood within
+        the grid.
+    """
+
+    _cache = dict()
+
+    def __init__(self, offsets):
+        unique = []
+        seen = set()
+
+        for offset in offsets:
+            offset = tuple([int(c) for c in offset])
+            if offset not in seen:
+                seen.add(offset)
+                unique.append(offset)
+
+        if len(unique) == 0:
+            raise ValueError("A stencil needs at least one offset")
+
+        dimensions = len(unique[0])
+
+        if any([len(o) != dimensions for o in unique]):
+            raise ValueError("All offsets of a stencil must have the same "
+                             "number of dimensions")
+
+        self.offsets = tuple(unique)
+        self.dimensions = dimensions
+        self.reach = max([abs(c) for o in unique for c in o])
+        self._hash = hash(self.offsets)
+        self._array = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __eq__(self, other):
+        return isinstance(other, Stencil) and self.offsets == other.offsets
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return "Stencil(%s)" % str(self.offsets)
+
+    def as_array(self):
+        """
+        Returns the offsets as an integer NumPy array of shape
+        (len(stencil), dimensions). The array is built once and cached.
+
+        Requires NumPy.
+
+        Returns
+        -------
+        numpy.ndarray
+            The offsets of the stencil.
+        """
+        if self._array is None:
+            if np is None:
+                raise ImportError("Stencil.as_array requires NumPy")
+            self._array = np.array(self.offsets, dtype=np.intp)
+            self._array.flags.writeable = False
+
+        return self._array
+
+    @classmethod
+    def moore(cls, dimensions, radius=1):
+        """
+        Returns a Moore neighbourhood stencil, including all positions
+        whose offset along every axis is at most *radius*. The central
+        position is excluded.
+
+        Parameters
+        ----------
+        dimensions : int
+            The number of dimensions, 2 or 3.
+        radius : int, optional
+            The radius of the neighbourhood. Defaults to 1.
+
+        Returns
+        -------
+        Stencil
+            The (cached) stencil.
+        """
+        key = ("moore", dimensions, radius)
+
+        if key not in cls._cache:
+            span = range(radius, -radius - 1, -1)
+            cls._cache[key] = cls(
+                o for o in product(span, repeat=dimensions) if any(o))
+
+        return cls._cache[key]
+
+    @classmethod
+    def von_neumann(cls, dimensions, radius=1):
+        """
+        Returns a von Neumann neighbourhood stencil, including all
+        positions within a Manhattan distance of *radius*. The central
+        position is excluded.
+
+        Parameters
+        ----------
+        dimensions : int
+            The number of dimensions, 2 or 3.
+        radius : int, optional
+            The radius of the neighbourhood. Defaults to 1.
+
+        Returns
+        -------
+        Stencil
+            The (cached) stencil.
+        """
+        key = ("von_neumann", dimensions, radius)
+
+        if key not in cls._cache:
+            span = range(radius, -radius - 1, -1)
+            cls._cache[key] = cls(
+                o for o in product(span, repeat=dimensions)
+                if any(o) and sum([abs(c) for c in o]) <= radius)
+
+        return cls._cache[key]
+
+
+MOORE_OFFSETS_2D = (
+    (1, -1), (1, 0), (1, 1),
+    (0, -1), (0, 1),
+    (-1, -1), (-1, 0), (-1, 1),
+)
+
+MOORE_OFFSETS_3D = tuple(
+    (dx, dy, dz) for dx in (1, 0, -1) for dy in (1, -1, 0)
+    for dz in (1, -1, 0) if (dx, dy, dz) != (0, 0, 0))
+
+# The radius 1 Moore stencils keep the historical neighbour ordering.
+Stencil._cache[("moore", 2, 1)] = Stencil(MOORE_OFFSETS_2D)
+Stencil._cache[("moore", 3, 1)] = Stencil(MOORE_OFFSETS_3D)
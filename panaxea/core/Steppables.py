@@ -1,3 +1,9 @@
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+
 class Steppable(object):
     """
     Represents generic steppable object. Steppables represent entities which
@@ -9,9 +15,28 @@ class Steppable(object):
     by all mains followed by all epilogues.
     """
 
+    # Subclasses which do not declare slots get a __dict__ as usual
+    __slots__ = ()
+
     def __init__(self):
         pass
 
+    def recycle(self, *args, **kwargs):
+        """
+        Resets a steppable taken back from an agent pool, so it can be
+        scheduled again as a new steppable. By default, this runs __init__
+        again with the given arguments. Subclasses may override it to reset
+        their state more cheaply, eg: keeping containers and clearing them.
+
+        Parameters
+        ----------
+        args
+            The positional arguments passed to AgentPool.acquire.
+        kwargs
+            The keyword arguments passed to AgentPool.acquire.
+        """
+        self.__init__(*args, **kwargs)
+
     def step_prologue(self, model):
         """
         Placeholder to enforce that all steppables implement a stepPrologue
@@ -55,23 +80,21 @@ class Steppable(object):
         pass
 
 
-class Agent(Steppable):
+class GridAgent(Steppable):
     """
-    An agent represents a self-contained unit in the simulation with a
-    state, a beahaviour and which may interact with,
-    be affected by and affect the environment and other agents. A simulation
-    may have multiple agent classes.
-
-    Examples of agent classes may include people, tissue cells, etc.
+    Holds the methods through which agents add, move and remove themselves
+    from environments, which both update the state of the environment
+    **and** the internal state of the agent. The position of the agent in
+    each environment is read and recorded via _position_in and
+    _record_position, which are given the environment itself so that
+    compact agents can go straight to its slot.
+
+    This class would **not** be itself instantiated, but would be extended
+    by Agent and CompactAgent, which implement get_position, set_position,
+    _position_in and _record_position.
     """
 
-    def __init__(self):
-        # This is a dictionary mapping an environment name to a position.
-        # This is so we don't have to do a search
-        # on the environment grid each time we want to know our position. At
-        # the same time, it's useful to also have
-        # a grid of agents to quickly search neighbourhoods.
-        self.environment_positions = dict()
+    __slots__ = ()
 
     def add_agent_to_grid(self, environment_name, position, model):
         """
@@ -85,7 +108,8 @@ class Agent(Steppable):
 
         This method does check whether a position is valid, and where that
         is not the case the agent is not added
-        and a warning is printed to screen.
+        and a warning is printed to screen. On grids which wrap or reflect
+        their boundaries, the position is first mapped back into the grid.
 
         Parameters
         ----------
@@ -100,18 +124,67 @@ class Agent(Steppable):
             environment.
         model : Model
             The instance of the model on which the simulation is based.
+
+        Returns
+        -------
+        bool
+            True if the agent was added, false if the position was invalid
+            or, on grids with a capacity, full.
         """
         env = model.environments[environment_name]
+        position = env.normalize_position(position)
 
-        if env.valid_position(position):
-            self.environment_positions[environment_name] = position
-
-            env.add_agent(self, position)
-        else:
+        if not env.valid_position(position):
             print("Invalid position %s on grid %s" % (
                 str(position), environment_name))
+            return False
 
-    def move_agent(self, environment_name, position_new, model):
+        if env.add_agent(self, position) is False:
+            return False
+
+        self._record_position(env, position)
+        return True
+
+    def add_agent_to_free_neighbour(self, environment_name, position, model,
+                                    radius=1, stencil=None):
+        """
+        Adds an agent to a random free position in the neighbourhood of a
+        position, for instance next to its parent when a cell divides. A
+        free position is one with room for one more agent, or an empty one
+        on grids without a capacity. This both updates the state of the
+        grid **and** the internal state of the agent.
+
+        Parameters
+        ----------
+        environment_name : string
+            The name of the environment to which the agent should be added.
+            This should match the name property
+            in the environment object.
+        position : tuple
+            The position whose neighbourhood should be searched.
+        model : Model
+            The instance of the model on which the simulation is based.
+        radius : int, optional
+            The radius of the moore neighbourhood to search. Defaults to 1.
+        stencil : Stencil, optional
+            If given, the neighbourhood described by the stencil is searched
+            instead, and radius is ignored.
+
+        Returns
+        -------
+        tuple
+            The position the agent was added to, or None if the
+            neighbourhood holds no free position.
+        """
+        env = model.environments[environment_name]
+        placed = env.place_agent_near(self, position, radius, stencil)
+
+        if placed is not None:
+            self._record_position(env, placed)
+
+        return placed
+
+    def move_agent(self, environment_name, position_new, model, priority=0):
         """
         Moves an agent from a position to another in an environment.
 
@@ -120,8 +193,12 @@ class Agent(Steppable):
         of the agent.
 
         This method does check whether a position is valid, and where that
-        is not the case the agent is not moved
-        and a warning is printed to screen.
+        is not the case the agent is not moved. On grids which wrap or reflect
+        their boundaries, the position is first mapped back into the grid.
+
+        On grids with synchronous moves enabled, the move is not applied
+        immediately but submitted as an intent, which is resolved together
+        with those of other agents at the end of the current phase.
 
         Parameters
         ----------
@@ -136,17 +213,36 @@ class Agent(Steppable):
             environment.
         model : Model
             The instance of the model on which the simulation is based.
+        priority : number, optional
+            On grids with synchronous moves, the priority of the move when
+            settling conflicts. Defaults to 0.
+
+        Returns
+        -------
+        bool
+            True if the agent was moved (or, on grids with synchronous
+            moves, the move was submitted), false if the position was
+            invalid or, on grids with a capacity, full.
         """
         env = model.environments[environment_name]
 
-        if env.valid_position(position_new):
-            position_old = self.environment_positions[environment_name]
+        if getattr(env, "synchronous_moves", False):
+            return env.submit_move(self, position_new, priority)
+
+        position_new = env.normalize_position(position_new)
+
+        if not env.valid_position(position_new):
+            return False
 
-            # Updating the agent's internal representation
-            self.environment_positions[environment_name] = position_new
+        position_old = self._position_in(env)
 
-            # Asking the environment to update its internal representation
-            env.move_agent(self, position_old, position_new)
+        # Asking the environment to update its internal representation
+        if env.move_agent(self, position_old, position_new) is False:
+            return False
+
+        # Updating the agent's internal representation
+        self._record_position(env, position_new)
+        return True
 
     def remove_agent_from_grid(self, environment_name, model):
         """
@@ -170,10 +266,11 @@ class Agent(Steppable):
             The instance of the model on which the simulation is based.
         """
         env = model.environments[environment_name]
-        position = self.environment_positions[environment_name]
+        position = self._position_in(env)
 
-        env.remove_agent(self, position)
-        self.environment_positions[environment_name] = None
+        if position is not None:
+            env.remove_agent(self, position)
+            self._record_position(env, None)
 
     def remove_agent(self, model):
         """
@@ -192,14 +289,483 @@ class Agent(Steppable):
         model : Model
             The instance of the model on which the simulation is based.
         """
-        envs = self.environment_positions.keys()
-
-        for env in envs:
-            self.remove_agent_from_grid(env, model)
+        for environment_name in list(self.environment_positions):
+            self.remove_agent_from_grid(environment_name, model)
 
         model.schedule.agents_to_remove.add(self)
 
 
+class Agent(GridAgent):
+    """
+    An agent represents a self-contained unit in the simulation with a
+    state, a beahaviour and which may interact with,
+    be affected by and affect the environment and other agents. A simulation
+    may have multiple agent classes.
+
+    Examples of agent classes may include people, tissue cells, etc.
+    """
+
+    def __init__(self):
+        # This is a dictionary mapping an environment name to a position.
+        # This is so we don't have to do a search
+        # on the environment grid each time we want to know our position. At
+        # the same time, it's useful to also have
+        # a grid of agents to quickly search neighbourhoods.
+        self.environment_positions = dict()
+
+    def get_position(self, environment_name):
+        """
+        Returns the position of the agent in an environment.
+
+        Parameters
+        ----------
+        environment_name : string
+            The name of the environment.
+
+        Returns
+        -------
+        tuple
+            The position, or None if the agent is not in the environment.
+        """
+        return self.environment_positions.get(environment_name)
+
+    def set_position(self, environment_name, position):
+        """
+        Records the position of the agent in an environment. This does not
+        update the environment itself.
+
+        Parameters
+        ----------
+        environment_name : string
+            The name of the environment.
+        position : tuple
+            The position, or None to record that the agent was removed from
+            the environment.
+        """
+        self.environment_positions[environment_name] = position
+
+    def _position_in(self, environment):
+        return self.environment_positions.get(environment.name)
+
+    def _record_position(self, environment, position):
+        self.environment_positions[environment.name] = position
+
+
+def add_agents_to_grid(agents, environment_name, positions, model):
+    """
+    Adds many agents to an environment in one call. This is the bulk
+    equivalent of calling Agent.add_agent_to_grid for each agent: it updates
+    both the state of the environment (via its add_agents method) **and**
+    the internal state of the agents.
+
+    Agents at invalid (or, on grids with a capacity, full) positions are not
+    added.
+
+    Parameters
+    ----------
+    agents : iterable
+        The agents to add.
+    environment_name : string
+        The name of the environment to which the agents should be added.
+    positions : iterable or numpy.ndarray
+        One position per agent, as a sequence of tuples or as an integer
+        array of shape (n, 2) or (n, 3).
+    model : Model
+        The instance of the model on which the simulation is based.
+
+    Returns
+    -------
+    int
+        The number of agents which were added.
+    """
+    agents = list(agents)
+    env = model.environments[environment_name]
+    placed = env.add_agents(agents, positions)
+    added = 0
+
+    for agent, position in zip(agents, placed):
+        if position is not None:
+            agent._record_position(env, position)
+            added += 1
+
+    return added
+
+
+_environment_slots = dict()
+_environment_names = []
+
+# Marks the slots of environments a compact agent was never added to
+_ABSENT = object()
+
+
+def environment_slot(environment_name):
+    """
+    Returns the slot index of an environment name, under which compact
+    agents store their position in that environment. Names are interned
+    the first time they are seen, so each name maps to the same index for
+    the lifetime of the process.
+
+    Parameters
+    ----------
+    environment_name : string
+        The name of the environment.
+
+    Returns
+    -------
+    int
+        The slot index.
+    """
+    slot = _environment_slots.get(environment_name)
+
+    if slot is None:
+        slot = len(_environment_names)
+        _environment_slots[environment_name] = slot
+        _environment_names.append(environment_name)
+
+    return slot
+
+
+class EnvironmentPositions(MutableMapping):
+    """
+    A dictionary-like view of the positions of a compact agent, keyed by
+    environment name. Reads and writes go straight to the agent's slots.
+    """
+
+    __slots__ = ("_agent",)
+
+    def __init__(self, agent):
+        self._agent = agent
+
+    def __getitem__(self, environment_name):
+        slot = environment_slot(environment_name)
+        positions = self._agent._positions
+
+        if slot >= len(positions) or positions[slot] is _ABSENT:
+            raise KeyError(environment_name)
+
+        return positions[slot]
+
+    def __setitem__(self, environment_name, position):
+        self._agent.set_position(environment_name, position)
+
+    def __delitem__(self, environment_name):
+        self[environment_name]
+        self._agent._positions[environment_slot(environment_name)] = _ABSENT
+
+    def __iter__(self):
+        positions = self._agent._positions
+        return iter([_environment_names[slot]
+                     for slot in range(len(positions))
+                     if positions[slot] is not _ABSENT])
+
+    def __len__(self):
+        return len([p for p in self._agent._positions if p is not _ABSENT])
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def _slot_names(cls):
+    names = []
+
+    for klass in cls.__mro__:
+        slots = getattr(klass, "__slots__", ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        names.extend(n for n in slots if n not in
+                     ("__dict__", "__weakref__", "_positions"))
+
+    return names
+
+
+class CompactAgent(GridAgent):
+    """
+    A memory-efficient agent. Compact agents share the interface of Agent
+    (add_agent_to_grid, move_agent, remove_agent_from_grid, remove_agent...,
+    see GridAgent), but have no instance dictionary: their positions are
+    kept in a list indexed by environment slot (see environment_slot)
+    rather than in a dictionary keyed by environment name.
+
+    Subclasses should declare their own attributes in __slots__, otherwise
+    Python gives their instances a dictionary again. For instance:
+
+        class Cell(CompactAgent):
+            __slots__ = ("energy",)
+
+    The environment_positions attribute is still available as a
+    dictionary-like view, for code written for regular agents.
+    """
+
+    __slots__ = ("_positions",)
+
+    def __init__(self):
+        self._positions = []
+
+    @property
+    def environment_positions(self):
+        return EnvironmentPositions(self)
+
+    def get_position(self, environment_name):
+        """
+        Returns the position of the agent in an environment.
+
+        Parameters
+        ----------
+        environment_name : string
+            The name of the environment.
+
+        Returns
+        -------
+        tuple
+            The position, or None if the agent is not in the environment.
+        """
+        slot = environment_slot(environment_name)
+        positions = self._positions
+
+        if slot >= len(positions) or positions[slot] is _ABSENT:
+            return None
+
+        return positions[slot]
+
+    def set_position(self, environment_name, position):
+        """
+        Records the position of the agent in an environment. This does not
+        update the environment itself.
+
+        Parameters
+        ----------
+        environment_name : string
+            The name of the environment.
+        position : tuple
+            The position, or None to record that the agent was removed from
+            the environment.
+        """
+        self._record_at(environment_slot(environment_name), position)
+
+    def _record_at(self, slot, position):
+        positions = self._positions
+
+        if slot >= len(positions):
+            positions.extend([_ABSENT] * (slot + 1 - len(positions)))
+
+        positions[slot] = position
+
+    # Environments resolve their slot once, so these index the positions
+    # straight away rather than looking the environment's name up
+    def _position_in(self, environment):
+        positions = self._positions
+        slot = environment.slot
+
+        if slot >= len(positions) or positions[slot] is _ABSENT:
+            return None
+
+        return positions[slot]
+
+    def _record_position(self, environment, position):
+        slot = environment.slot
+
+        if slot < len(self._positions):
+            self._positions[slot] = position
+        else:
+            self._record_at(slot, position)
+
+    def __getstate__(self):
+        state = dict(getattr(self, "__dict__", {}))
+
+        for name in _slot_names(type(self)):
+            if hasattr(self, name):
+                state[name] = getattr(self, name)
+
+        # Slot indices are specific to a process, so positions are saved
+        # by environment name
+        state["environment_positions"] = dict(self.environment_positions)
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        self._positions = []
+
+        for name, position in state.pop("environment_positions").items():
+            self.set_position(name, position)
+
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+class EnvironmentHandle(object):
+    """
+    An environment resolved once from the model, through which agents are
+    added, moved and removed without looking the environment up by name
+    on every call. A handle is typically created during model setup and
+    kept by the agents or helpers which use it.
+
+    Its checked methods behave like the corresponding Agent methods. Its
+    unchecked methods skip the normalization of positions, their validation
+    and, on grids with a capacity, the room check, for callers which have
+    already established that positions are valid (eg: by clamping them to
+    the grid, or picking them from get_empty_neighbours). On grids with
+    synchronous moves, unchecked moves are submitted as intents like any
+    other move. Handles follow the synchronous move setting the environment
+    has when they are created.
+
+    A handle is created from the instance of the model and the name of one
+    of its environments. The add and move methods of the environment which
+    the handle calls are also resolved at that point.
+
+    Attributes
+    ----------
+    name : string
+        The name of the environment.
+    environment : Environment
+        The environment, as resolved from the model.
+    """
+
+    __slots__ = ("name", "environment", "_add", "_move")
+
+    def __init__(self, model, environment_name):
+        self.name = environment_name
+        self.environment = model.environments[environment_name]
+
+        env = self.environment
+        self._add = getattr(env, "add_agent_unchecked", env.add_agent)
+
+        if getattr(env, "synchronous_moves", False):
+            self._move = None
+        else:
+            self._move = getattr(env, "move_agent_unchecked", env.move_agent)
+
+    def position(self, agent):
+        """
+        Returns the position of an agent in the environment.
+
+        Parameters
+        ----------
+        agent : Agent
+            The agent.
+
+        Returns
+        -------
+        tuple
+            The position, or None if the agent is not in the environment.
+        """
+        return agent._position_in(self.environment)
+
+    def add(self, agent, position):
+        """
+        Adds an agent to the environment. See Agent.add_agent_to_grid.
+
+        Parameters
+        ----------
+        agent : Agent
+            The agent to add.
+        position : tuple
+            The position to which the agent will be added.
+
+        Returns
+        -------
+        bool
+            True if the agent was added, false if the position was invalid
+            or, on grids with a capacity, full.
+        """
+        env = self.environment
+        position = env.normalize_position(position)
+
+        if not env.valid_position(position) or \
+                env.add_agent(agent, position) is False:
+            return False
+
+        agent._record_position(env, position)
+        return True
+
+    def add_unchecked(self, agent, position):
+        """
+        Adds an agent to a position already known to be valid and, on grids
+        with a capacity, to have room.
+
+        Parameters
+        ----------
+        agent : Agent
+            The agent to add.
+        position : tuple
+            The position to which the agent will be added.
+        """
+        self._add(agent, position)
+        agent._record_position(self.environment, position)
+
+    def move(self, agent, position_new, priority=0):
+        """
+        Moves an agent in the environment. See Agent.move_agent.
+
+        Parameters
+        ----------
+        agent : Agent
+            The agent to move.
+        position_new : tuple
+            The position to which the agent will be moved.
+        priority : number, optional
+            On grids with synchronous moves, the priority of the move when
+            settling conflicts. Defaults to 0.
+
+        Returns
+        -------
+        bool
+            True if the agent was moved (or, on grids with synchronous
+            moves, the move was submitted), false if the position was
+            invalid or, on grids with a capacity, full.
+        """
+        env = self.environment
+
+        if self._move is None:
+            return env.submit_move(agent, position_new, priority)
+
+        position_new = env.normalize_position(position_new)
+
+        if not env.valid_position(position_new) or env.move_agent(
+                agent, agent._position_in(env), position_new) is False:
+            return False
+
+        agent._record_position(env, position_new)
+        return True
+
+    def move_unchecked(self, agent, position_new):
+        """
+        Moves an agent to a position already known to be valid and, on
+        grids with a capacity, to have room.
+
+        Parameters
+        ----------
+        agent : Agent
+            The agent to move.
+        position_new : tuple
+            The position to which the agent will be moved.
+        """
+        if self._move is None:
+            self.environment.submit_move(agent, position_new)
+            return
+
+        env = self.environment
+        self._move(agent, agent._position_in(env), position_new)
+        agent._record_position(env, position_new)
+
+    def remove(self, agent):
+        """
+        Removes an agent from the environment. See
+        Agent.remove_agent_from_grid. If the agent is not in the
+        environment, this is void.
+
+        Parameters
+        ----------
+        agent : Agent
+            The agent to remove.
+        """
+        env = self.environment
+        position = agent._position_in(env)
+
+        if position is not None:
+            env.remove_agent(agent, position)
+            agent._record_position(env, None)
+
+
 class Helper(Steppable):
     """
     A placeholder class to allow for helper steppables to have their own
@@ -0,0 +1,836 @@
+import os
+import re
+import shutil
+import weakref
+from itertools import product
+from operator import floordiv, mod
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    resource_tracker = shared_memory = None
+
+from panaxea.core import Numerics
+from panaxea.core.Numerics import np
+
+
+class SparseCellStore(dict):
+    """
+    Holds the per-position contents of a grid, storing only positions which
+    have actually been written to.
+
+    This behaves like a defaultdict with one important difference: reading
+    a position which has never been written to returns a default value
+    **without** inserting it in the store. As a result, neighbourhood
+    searches and other read-only queries do not grow the store, and memory
+    (and pickle size) stays proportional to the number of occupied
+    positions rather than creeping towards the full size of the grid.
+
+    Attributes
+    ----------
+    default_factory : callable
+        Called without arguments to produce the value returned for
+        positions which are not stored. For object grids this is an
+        immutable empty collection so that an unoccupied position cannot be
+        accidentally written through the returned value.
+    """
+
+    def __init__(self, default_factory, *args, **kwargs):
+        super(SparseCellStore, self).__init__(*args, **kwargs)
+        self.default_factory = default_factory
+
+    def __missing__(self, key):
+        return self.default_factory()
+
+    def __reduce__(self):
+        return self.__class__, (self.default_factory,), None, None, \
+            iter(self.items())
+
+    def __copy__(self):
+        return self.__class__(self.default_factory, self)
+
+    def __repr__(self):
+        return "%s(%r, %s)" % (self.__class__.__name__,
+                               self.default_factory,
+                               dict.__repr__(self))
+
+
+class ChunkedCellStore(MutableMapping):
+    """
+    Holds one number per position of a grid in fixed-size dense blocks
+    (chunks), which are allocated the first time one of their positions is
+    written to a value other than the fill value, and dropped as soon as
+    all of their positions are back to it. Memory therefore scales with the
+    region of the grid which is actually in use, so grids far too large to
+    hold as a single dense array (eg: 2000x2000x2000) remain usable as long
+    as most of them is at the fill value.
+
+    Positions are given as tuples, or as flat indices in row-major order
+    (see Grid.to_index). Reading a position in a missing chunk returns the
+    fill value without allocating anything. As a mapping, the store lists
+    the positions holding a value other than the fill value.
+
+    Whole chunks can be updated with vectorized operations (see add_at and
+    map_chunks) and chunk statistics are available from statistics.
+
+    Requires NumPy.
+
+    Attributes
+    ----------
+    shape : tuple
+        The number of positions along each axis of the grid.
+    chunk_size : int or tuple, optional
+        The number of positions along each axis of a chunk. Defaults to 16,
+        ie: 4096 positions per chunk in 3D.
+    dtype : numpy.dtype, optional
+        The type of the values. Defaults to float.
+    fill : number, optional
+        The value of positions which have not been written to. Defaults to
+        zero.
+    """
+
+    def __init__(self, shape, chunk_size=16, dtype=float, fill=0):
+        Numerics.require_numpy("ChunkedCellStore")
+        self.shape = tuple(shape)
+
+        if isinstance(chunk_size, int):
+            chunk_size = (chunk_size,) * len(self.shape)
+
+        self.chunk_shape = tuple(chunk_size)
+        self.dtype = np.dtype(dtype)
+        self.fill = self.dtype.type(fill).item()
+        self.chunks = dict()
+        self.active = dict()
+
+    def _locate(self, key):
+        if not isinstance(key, tuple):
+            index = key
+            key = []
+            for n in reversed(self.shape):
+                index, c = divmod(index, n)
+                key.append(c)
+            key.reverse()
+
+        return tuple(map(floordiv, key, self.chunk_shape)), \
+            tuple(map(mod, key, self.chunk_shape))
+
+    def __getitem__(self, key):
+        chunk, offset = self._locate(key)
+        values = self.chunks.get(chunk)
+
+        if values is None:
+            return self.fill
+
+        return values[offset].item()
+
+    def __setitem__(self, key, value):
+        chunk, offset = self._locate(key)
+        values = self.chunks.get(chunk)
+
+        if values is None:
+            if value == self.fill:
+                return
+            values = np.full(self.chunk_shape, self.fill, dtype=self.dtype)
+            self.chunks[chunk] = values
+            self.active[chunk] = 0
+
+        was_set = values[offset] != self.fill
+        values[offset] = value
+        is_set = values[offset] != self.fill
+
+        if is_set != was_set:
+            self._count(chunk, 1 if is_set else -1)
+
+    def increment(self, key, delta=1):
+        """
+        Adds a value to a position. This is equivalent to
+        store[key] += delta, locating the position's chunk only once.
+
+        Parameters
+        ----------
+        key : tuple or int
+            The position, or its flat index.
+        delta : number, optional
+            The value to add. Defaults to 1.
+        """
+        chunk, offset = self._locate(key)
+        values = self.chunks.get(chunk)
+
+        if values is None:
+            self[key] = self.fill + delta
+            return
+
+        was_set = values[offset] != self.fill
+        values[offset] += delta
+        is_set = values[offset] != self.fill
+
+        if is_set != was_set:
+            self._count(chunk, 1 if is_set else -1)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+
+        self[key] = self.fill
+
+    def __contains__(self, key):
+        return self[key] != self.fill
+
+    def __iter__(self):
+        for chunk, values in list(self.chunks.items()):
+            origin = np.multiply(chunk, self.chunk_shape)
+            for offset in np.argwhere(values != self.fill):
+                yield tuple((origin + offset).tolist())
+
+    def __len__(self):
+        return sum(self.active.values())
+
+    def get(self, key, default=None):
+        value = self[key]
+        return default if value == self.fill else value
+
+    def _count(self, chunk, delta):
+        self.active[chunk] += delta
+
+        if self.active[chunk] == 0:
+            del self.chunks[chunk]
+            del self.active[chunk]
+
+    def _recount(self, chunk):
+        self.active[chunk] = int(np.count_nonzero(
+            self.chunks[chunk] != self.fill))
+        self._count(chunk, 0)
+
+    def add_at(self, positions, values):
+        """
+        Adds values to many positions in one call, grouping the positions
+        by chunk so that each chunk is updated with a single vectorized
+        operation. Repeated positions accumulate.
+
+        Parameters
+        ----------
+        positions : numpy.ndarray
+            An integer array of positions, of shape (n, dimensions).
+        values : number or numpy.ndarray
+            The value to add to every position, or one value per position.
+        """
+        positions = np.asarray(positions, dtype=np.intp) \
+            .reshape(-1, len(self.shape))
+        values = np.broadcast_to(np.asarray(values, dtype=self.dtype),
+                                 (len(positions),))
+
+        if len(positions) == 0:
+            return
+
+        keys, inverse = np.unique(positions // self.chunk_shape, axis=0,
+                                  return_inverse=True)
+        inverse = inverse.reshape(-1)
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.cumsum(np.bincount(inverse, minlength=len(keys)))[:-1]
+        offsets = positions % self.chunk_shape
+
+        for key, rows in zip(keys.tolist(), np.split(order, bounds)):
+            chunk = tuple(key)
+            if chunk not in self.chunks:
+                self.chunks[chunk] = np.full(self.chunk_shape, self.fill,
+                                             dtype=self.dtype)
+            np.add.at(self.chunks[chunk], tuple(offsets[rows].T),
+                      values[rows])
+            self._recount(chunk)
+
+    def map_chunks(self, function):
+        """
+        Applies a vectorized function to every allocated chunk, eg: decay
+        or diffusion within chunks. Chunks left holding only the fill value
+        are dropped.
+
+        Positions in chunks which are not allocated are not passed to the
+        function, so it should map the fill value to itself.
+
+        Parameters
+        ----------
+        function : callable
+            A function taking the array of a chunk and returning its new
+            values, or None if it updated the array in place.
+        """
+        for chunk, values in list(self.chunks.items()):
+            result = function(values)
+            if result is not None:
+                values[...] = result
+            self._recount(chunk)
+
+    def compact(self):
+        """
+        Recounts every chunk and drops those holding only the fill value.
+        This is only needed after writing to the chunk arrays directly.
+
+        Returns
+        -------
+        int
+            The number of chunks dropped.
+        """
+        before = len(self.chunks)
+
+        for chunk in list(self.chunks):
+            self._recount(chunk)
+
+        return before - len(self.chunks)
+
+    def to_array(self, dtype=None):
+        """
+        Returns the contents of the store as a dense array with the shape of
+        the grid. This allocates the whole grid, so it is only practical
+        for grids which fit in memory.
+
+        Parameters
+        ----------
+        dtype : numpy.dtype, optional
+            The type of the array. Defaults to the type of the store.
+
+        Returns
+        -------
+        numpy.ndarray
+            A dense copy of the store.
+        """
+        values = np.full(self.shape, self.fill, dtype=dtype or self.dtype)
+
+        for chunk, block in self.chunks.items():
+            target = []
+            source = []
+            for c, n, size in zip(chunk, self.chunk_shape, self.shape):
+                start, stop = max(c * n, 0), min((c + 1) * n, size)
+                target.append(slice(start, stop))
+                source.append(slice(start - c * n, stop - c * n))
+            if all(s.stop > s.start for s in target):
+                values[tuple(target)] = block[tuple(source)]
+
+        return values
+
+    def statistics(self):
+        """
+        Returns statistics on the chunks of the store.
+
+        Returns
+        -------
+        dict
+            The number of allocated chunks ("chunks"), the number of
+            positions per chunk ("chunk_cells"), the number of positions
+            allocated ("allocated_cells") and holding a value other than
+            the fill value ("active_cells"), the memory used by the chunks
+            in bytes ("bytes"), the fraction of allocated positions which
+            are active ("fill_ratio") and the fraction of the grid which is
+            allocated ("coverage").
+        """
+        chunk_cells = int(np.prod(self.chunk_shape))
+        allocated = len(self.chunks) * chunk_cells
+        active = len(self)
+
+        return {
+            "chunks": len(self.chunks),
+            "chunk_cells": chunk_cells,
+            "allocated_cells": allocated,
+            "active_cells": active,
+            "bytes": allocated * self.dtype.itemsize,
+            "fill_ratio": float(active) / allocated if allocated else 0.,
+            "coverage": float(allocated) / int(np.prod(self.shape))
+        }
+
+
+class MappedCellStore(MutableMapping):
+    """
+    Holds one number per position of a grid in a memory-mapped file (in
+    NumPy's .npy format), so that grids larger than the available memory
+    can be used: the operating system pages the parts of the file being
+    read or written in and out of memory as needed.
+
+    Large grids are best updated a tile at a time (see map_tiles), so that
+    only one tile needs to be in memory at once. A file can be opened
+    read-only by several processes (eg: replicates of a model sharing the
+    same input field) which then share the same pages of memory rather than
+    each holding a copy.
+
+    When a model is checkpointed (see Model.save_checkpoint), a store
+    opened for writing is flushed and its file is copied next to the
+    checkpoint, so that the checkpoint keeps the values of that epoch
+    however the file changes afterwards. Loading the checkpoint copies the
+    values back into the store's file, which is then mapped again. Other
+    pickles of such a store only hold the path of the file, so unpickling
+    them maps the file with the contents it has at that time. Read-only
+    stores are never copied, as their file is not expected to change, and
+    copy-on-write stores are pickled with their values, as their changes
+    are only held in memory.
+
+    As a mapping, the store lists the positions holding a value other than
+    the fill value, which requires scanning the whole file.
+
+    Requires NumPy.
+
+    Attributes
+    ----------
+    path : string
+        The path of the file.
+    shape : tuple, optional
+        The number of positions along each axis of the grid. Only needed
+        when creating a file.
+    dtype : numpy.dtype, optional
+        The type of the values, when creating a file. Defaults to float.
+    fill : number, optional
+        The value positions are initialized to when creating a file.
+        Defaults to zero, which does not need to be written to the file.
+    mode : string, optional
+        "w+" creates (or overwrites) the file, "r+" opens an existing file
+        for reading and writing, "r" opens it read-only and "c" opens it
+        copy-on-write, where changes are kept in memory and never written
+        to the file. Defaults to "w+".
+    """
+
+    def __init__(self, path, shape=None, dtype=float, fill=0, mode="w+"):
+        Numerics.require_numpy("MappedCellStore")
+        self.path = os.path.abspath(path)
+        self.mode = mode
+
+        if mode == "w+":
+            self.array = np.lib.format.open_memmap(
+                self.path, mode="w+", dtype=dtype, shape=tuple(shape))
+            if fill != 0:
+                self.array[...] = fill
+        else:
+            self.array = np.lib.format.open_memmap(self.path, mode=mode)
+
+        self.fill = self.array.dtype.type(fill).item()
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self.array[key].item()
+
+        return self.array.flat[key].item()
+
+    def __setitem__(self, key, value):
+        if isinstance(key, tuple):
+            self.array[key] = value
+        else:
+            self.array.flat[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+
+        self[key] = self.fill
+
+    def __contains__(self, key):
+        return self[key] != self.fill
+
+    def __iter__(self):
+        for position in np.argwhere(self.array != self.fill):
+            yield tuple(position.tolist())
+
+    def __len__(self):
+        return int(np.count_nonzero(self.array != self.fill))
+
+    def __reduce__(self):
+        if self.mode == "c":
+            return self.__class__._private, (self.path, self.fill,
+                                             np.array(self.array))
+
+        if self.mode == "r":
+            return self.__class__, (self.path, None, None, self.fill, "r")
+
+        self.flush()
+
+        if checkpoint_files is None:
+            return self.__class__, (self.path, None, None, self.fill, "r+")
+
+        return self.__class__._restored, (self.path,
+                                          checkpoint_files.copy(self.path),
+                                          self.fill)
+
+    @classmethod
+    def _restored(cls, path, saved, fill):
+        shutil.copyfile(saved, path)
+        return cls(path, fill=fill, mode="r+")
+
+    @classmethod
+    def _private(cls, path, fill, values):
+        store = cls(path, fill=fill, mode="c")
+        store.array[...] = values
+        return store
+
+    def get(self, key, default=None):
+        value = self[key]
+        return default if value == self.fill else value
+
+    def flush(self):
+        """
+        Writes any changes still in memory to the file.
+        """
+        if self.mode in ("w+", "r+"):
+            self.array.flush()
+
+    def tiles(self, tile_size=64):
+        """
+        Iterates over the grid in tiles.
+
+        Parameters
+        ----------
+        tile_size : int or tuple, optional
+            The number of positions along each axis of a tile. Defaults to
+            64.
+
+        Returns
+        -------
+        generator
+            For each tile, a tuple of slices selecting the tile in the grid.
+        """
+        if isinstance(tile_size, int):
+            tile_size = (tile_size,) * len(self.shape)
+
+        starts = [range(0, n, t) for n, t in zip(self.shape, tile_size)]
+
+        for origin in product(*starts):
+            yield tuple([slice(o, min(o + t, n)) for o, t, n in
+                         zip(origin, tile_size, self.shape)])
+
+    def map_tiles(self, function, tile_size=64):
+        """
+        Applies a vectorized function to the grid one tile at a time, so
+        that grids larger than memory can be updated. Tiles are updated
+        independently of each other.
+
+        Parameters
+        ----------
+        function : callable
+            A function taking the array of a tile and returning its new
+            values, or None if it updated the array in place.
+        tile_size : int or tuple, optional
+            The number of positions along each axis of a tile. Defaults to
+            64.
+        """
+        for tile in self.tiles(tile_size):
+            result = function(self.array[tile])
+            if result is not None:
+                self.array[tile] = result
+
+    def to_array(self, dtype=None):
+        """
+        Returns the contents of the store as an array held in memory.
+
+        Parameters
+        ----------
+        dtype : numpy.dtype, optional
+            The type of the array. Defaults to the type of the store.
+
+        Returns
+        -------
+        numpy.ndarray
+            A copy of the store.
+        """
+        return np.array(self.array, dtype=dtype or self.array.dtype)
+
+
+class CheckpointFiles(object):
+    """
+    Collects the copies of the files of memory-mapped stores written with
+    a checkpoint. Copies are named after the checkpoint and its epoch (eg:
+    "model.checkpoint.12.0.npy" for the first store of a checkpoint saved
+    at epoch 12), so that the copies of an earlier checkpoint are left
+    untouched until the new checkpoint has replaced it.
+
+    While a checkpoint is written, Model.save_checkpoint sets the module's
+    checkpoint_files to an instance of this class.
+
+    Attributes
+    ----------
+    path : string
+        The path of the checkpoint.
+    epoch : int
+        The epoch at which the checkpoint is saved.
+    """
+
+    def __init__(self, path, epoch):
+        self.path = os.path.abspath(path)
+        self.epoch = epoch
+        self.paths = []
+
+    def copy(self, path):
+        """
+        Copies a file next to the checkpoint.
+
+        Parameters
+        ----------
+        path : string
+            The file to copy.
+
+        Returns
+        -------
+        string
+            The path of the copy.
+        """
+        target = "%s.%s.%s.npy" % (self.path, self.epoch, len(self.paths))
+        temporary = "%s.tmp" % target
+
+        shutil.copyfile(path, temporary)
+        getattr(os, "replace", os.rename)(temporary, target)
+        self.paths.append(target)
+
+        return target
+
+    def prune(self):
+        """
+        Removes the copies written with earlier checkpoints to the same
+        path. This should be called once the checkpoint has been written.
+        """
+        directory, name = os.path.split(self.path)
+        pattern = re.compile(re.escape(name) + r"\.\d+\.\d+\.npy$")
+
+        for other in os.listdir(directory):
+            other = os.path.join(directory, other)
+            if pattern.match(os.path.basename(other)) and \
+                    other not in self.paths:
+                os.remove(other)
+
+
+# Set while a checkpoint is written, see CheckpointFiles
+checkpoint_files = None
+
+
+def _attach_memory(name):
+    """
+    Attaches to an existing block of shared memory without registering it
+    with this process' resource tracker. Before Python 3.13, attaching
+    registers the block as if this process had created it, and the tracker
+    of a process not started by multiprocessing then destroys the block
+    when the process exits, while other processes are still using it.
+    """
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+
+    try:
+        return shared_memory.SharedMemory(name)
+    finally:
+        resource_tracker.register = register
+
+
+def _shared_array(memory, shape, dtype):
+    """
+    Returns a read-only array viewing a block of shared memory. The block
+    stays mapped as long as the array, or any view of it, is referenced:
+    NumPy does not prevent a block from being unmapped while arrays still
+    point to it, which would crash the process when they are read.
+    """
+    array = np.ndarray(shape, dtype, memory.buf)
+    array.flags.writeable = False
+    weakref.finalize(array, memory.close)
+    return array
+
+
+class SharedCellStore(MutableMapping):
+    """
+    Holds one number per position of a grid in a block of shared memory,
+    so that several processes on the same host (eg: replicates of a model)
+    can read the same static data (eg: a vasculature map) without each
+    holding a copy of it.
+
+    The process creating the store copies the values into the block and
+    passes the store's handle to the other processes, which attach to the
+    block with attach. The shared values are read-only: the first write to
+    a store, in any process, promotes it to a private copy of the values,
+    so that a replicate changing its environment never changes the
+    environment of the others.
+
+    The block lives until the process which created it calls release,
+    which should only be done once every process attached to it is done.
+    Pickling a store (eg: in a checkpoint) stores its values rather than
+    its handle, so that it can be unpickled once the block is gone.
+
+    As a mapping, the store lists the positions holding a value other than
+    the fill value, which requires scanning every value.
+
+    Requires NumPy and Python 3.8 or later.
+
+    Attributes
+    ----------
+    values : array-like
+        The values of the grid, with one axis per axis of the grid.
+    fill : number, optional
+        The value of positions which are considered empty. Defaults to
+        zero.
+    """
+
+    def __init__(self, values, fill=0):
+        Numerics.require_numpy("SharedCellStore")
+
+        if shared_memory is None:
+            raise ImportError("SharedCellStore requires Python 3.8 or later")
+
+        values = np.asarray(values)
+        self._memory = shared_memory.SharedMemory(
+            create=True, size=max(values.nbytes, 1))
+        self.owner = True
+        np.ndarray(values.shape, values.dtype, self._memory.buf)[...] = values
+        self.array = _shared_array(self._memory, values.shape, values.dtype)
+        self.fill = self.array.dtype.type(fill).item()
+
+    @classmethod
+    def attach(cls, handle):
+        """
+        Attaches to a store created by another process.
+
+        Parameters
+        ----------
+        handle : tuple
+            The handle of the store, see SharedCellStore.handle.
+
+        Returns
+        -------
+        SharedCellStore
+            A store reading the shared values.
+        """
+        Numerics.require_numpy("SharedCellStore")
+        name, shape, dtype, fill = handle
+
+        store = cls.__new__(cls)
+        store._memory = _attach_memory(name)
+        store.owner = False
+        store.array = _shared_array(store._memory, shape, np.dtype(dtype))
+        store.fill = fill
+        return store
+
+    @classmethod
+    def _private(cls, array, fill):
+        store = cls.__new__(cls)
+        store._memory = None
+        store.owner = False
+        store.array = array
+        store.fill = fill
+        return store
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    @property
+    def shared(self):
+        """
+        Whether the store still reads the shared values, rather than a
+        private copy.
+        """
+        return not self.array.flags.writeable
+
+    @property
+    def handle(self):
+        """
+        A small picklable tuple identifying the block of shared memory,
+        which can be passed to other processes to attach to it.
+        """
+        if self._memory is None:
+            raise ValueError("The store is not backed by shared memory")
+
+        return (self._memory.name, self.array.shape, self.array.dtype.str,
+                self.fill)
+
+    def _promote(self):
+        """
+        Replaces the shared values with a private copy, which can be
+        written to.
+        """
+        self.array = np.array(self.array)
+
+    def release(self):
+        """
+        Detaches the store from the block of shared memory, keeping a
+        private copy of the values if they are still in use. In the
+        process which created the store, the block is also destroyed, so
+        processes which have not attached to it yet no longer can. The
+        block is unmapped from a process once no array views it anymore.
+        """
+        if self.shared:
+            self._promote()
+
+        if self.owner and self._memory is not None:
+            self._memory.unlink()
+
+        self._memory = None
+        self.owner = False
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self.array[key].item()
+
+        return self.array.flat[key].item()
+
+    def __setitem__(self, key, value):
+        if self.shared:
+            self._promote()
+
+        if isinstance(key, tuple):
+            self.array[key] = value
+        else:
+            self.array.flat[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+
+        self[key] = self.fill
+
+    def __contains__(self, key):
+        return self[key] != self.fill
+
+    def __iter__(self):
+        for position in np.argwhere(self.array != self.fill):
+            yield tuple(position.tolist())
+
+    def __len__(self):
+        return int(np.count_nonzero(self.array != self.fill))
+
+    def __reduce__(self):
+        return self.__class__._private, (np.array(self.array), self.fill)
+
+    def get(self, key, default=None):
+        value = self[key]
+        return default if value == self.fill else value
+
+    def writable(self):
+        """
+        Returns the values as an array which can be updated in place,
+        promoting the store to a private copy if needed.
+
+        Returns
+        -------
+        numpy.ndarray
+            The values of the store.
+        """
+        if self.shared:
+            self._promote()
+
+        return self.array
+
+    def to_array(self, dtype=None):
+        """
+        Returns a private copy of the contents of the store.
+
+        Parameters
+        ----------
+        dtype : numpy.dtype, optional
+            The type of the array. Defaults to the type of the store.
+
+        Returns
+        -------
+        numpy.ndarray
+            A copy of the store.
+        """
+        return np.array(self.array, dtype=dtype or self.array.dtype)
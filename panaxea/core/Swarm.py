@@ -0,0 +1,258 @@
+"""
+Populations of particles held as arrays, for particle swarm optimization,
+flocking and similar models where every individual follows the same
+update rule.
+
+Rather than stepping one agent object per particle, a swarm stores the
+positions and velocities of all of its particles in (n, dimensions) arrays
+and updates them with a few batch operations per epoch. Random numbers are
+drawn in blocks, one array per epoch rather than one call per particle.
+Swarms are helpers, so they are added to the schedule's helpers and
+stepped once per epoch.
+
+Requires NumPy.
+"""
+from panaxea.core import Numerics
+from panaxea.core.Numerics import CLIP, REFLECT, WRAP, np
+from panaxea.core.Steppables import Helper
+
+
+class Swarm(Helper):
+    """
+    A population of particles moving through a continuous space.
+
+    At each epoch's main phase, the swarm applies its update rules, which
+    adjust the velocities (or any other per-particle state), then moves
+    every particle by its velocity and applies the bounds of the space.
+
+    Attributes
+    ----------
+    positions : array-like
+        The initial positions, one row per particle.
+    velocities : array-like, optional
+        The initial velocities. Defaults to zero.
+    lower : array-like, optional
+        The lower bound of the space along each axis. Defaults to None,
+        meaning the space is unbounded.
+    upper : array-like, optional
+        The upper bound of the space along each axis. Defaults to None.
+    boundary : string, optional
+        What happens to particles leaving the bounds: "clip" stops them at
+        the edge, "wrap" moves them to the opposite edge and "reflect"
+        bounces them back, reversing their velocity. Defaults to "clip".
+    seed : int, optional
+        The seed of the swarm's random number generator.
+    """
+
+    def __init__(self, positions, velocities=None, lower=None, upper=None,
+                 boundary=CLIP, seed=None):
+        super(Swarm, self).__init__()
+        Numerics.require_numpy(self.__class__.__name__)
+
+        if boundary not in (CLIP, WRAP, REFLECT):
+            raise ValueError("Unknown boundary %s" % str(boundary))
+
+        self.positions = np.array(positions, dtype=float, ndmin=2)
+
+        if velocities is None:
+            self.velocities = np.zeros_like(self.positions)
+        else:
+            self.velocities = np.array(velocities, dtype=float, ndmin=2)
+
+        if (lower is None) != (upper is None):
+            raise ValueError("Both or none of lower and upper should be set")
+
+        self.lower = None if lower is None else np.asarray(lower, float)
+        self.upper = None if upper is None else np.asarray(upper, float)
+        self.boundary = boundary
+        self.rng = np.random.default_rng(seed)
+        self.rules = []
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def dimensions(self):
+        return self.positions.shape[1]
+
+    def add_rule(self, rule):
+        """
+        Adds an update rule, applied at every main phase before particles
+        move. Rules are applied in the order in which they were added.
+
+        Parameters
+        ----------
+        rule : callable
+            A function taking the swarm and the model, which updates the
+            swarm's arrays (typically the velocities) in place.
+        """
+        self.rules.append(rule)
+
+    def uniform(self, *shape):
+        """
+        Draws a block of uniform random numbers in [0, 1) from the swarm's
+        generator. Drawing all the numbers needed by an epoch in one call
+        is much faster than drawing them one particle at a time.
+
+        Parameters
+        ----------
+        shape : int
+            The shape of the block.
+
+        Returns
+        -------
+        numpy.ndarray
+            The random numbers.
+        """
+        return self.rng.random(shape)
+
+    def apply_bounds(self):
+        """
+        Brings particles which left the space back within its bounds,
+        according to the swarm's boundary mode.
+        """
+        if self.lower is None:
+            return
+
+        lower, upper = self.lower, self.upper
+
+        if self.boundary == CLIP:
+            np.clip(self.positions, lower, upper, out=self.positions)
+        elif self.boundary == WRAP:
+            self.positions[...] = lower + (self.positions - lower) % \
+                (upper - lower)
+        else:
+            span = upper - lower
+            offset = self.positions - lower
+            flipped = np.floor_divide(offset, span) % 2 == 1
+            offset %= 2 * span
+            self.positions[...] = lower + np.where(
+                offset > span, 2 * span - offset, offset)
+            self.velocities[flipped] *= -1
+
+    def step_main(self, model):
+        """
+        Applies the update rules, moves every particle by its velocity and
+        applies the bounds of the space.
+
+        Parameters
+        ----------
+        model : Model
+            The instance of the model to which the swarm belongs.
+        """
+        for rule in self.rules:
+            rule(self, model)
+
+        self.positions += self.velocities
+        self.apply_bounds()
+
+
+class ParticleSwarm(Swarm):
+    """
+    A swarm performing particle swarm optimization: each particle is drawn
+    towards the best position it has found itself and the best position
+    found by the whole swarm.
+
+    The fitness of every particle is evaluated at the prologue of each
+    epoch, and the velocities are updated at the main phase with the usual
+    inertia, cognitive and social terms.
+
+    Attributes
+    ----------
+    positions : array-like
+        The initial positions, one row per particle.
+    fitness : callable
+        A function taking an (n, dimensions) array of positions and
+        returning an array of n fitness values. Higher is better.
+    inertia : float, optional
+        The fraction of its velocity a particle keeps. Defaults to 0.7.
+    cognitive : float, optional
+        The pull towards the particle's own best position. Defaults to 1.5.
+    social : float, optional
+        The pull towards the swarm's best position. Defaults to 1.5.
+    max_speed : float, optional
+        The maximum speed of a particle. Defaults to None, meaning no
+        limit.
+    kwargs
+        The velocities, bounds, boundary mode and seed, see Swarm.
+    """
+
+    def __init__(self, positions, fitness, inertia=0.7, cognitive=1.5,
+                 social=1.5, max_speed=None, **kwargs):
+        super(ParticleSwarm, self).__init__(positions, **kwargs)
+
+        self.fitness = fitness
+        self.inertia = inertia
+        self.cognitive = cognitive
+        self.social = social
+        self.max_speed = max_speed
+
+        self.best_positions = self.positions.copy()
+        self.best_fitness = np.full(len(self), -np.inf)
+        self.global_best_position = self.positions[0].copy()
+        self.global_best_fitness = -np.inf
+
+    def evaluate(self):
+        """
+        Evaluates the fitness of every particle and updates the personal
+        and global bests.
+
+        Returns
+        -------
+        numpy.ndarray
+            The fitness of every particle.
+        """
+        fitness = np.asarray(self.fitness(self.positions), dtype=float)
+        improved = fitness > self.best_fitness
+
+        self.best_fitness[improved] = fitness[improved]
+        self.best_positions[improved] = self.positions[improved]
+
+        best = int(np.argmax(self.best_fitness))
+
+        if self.best_fitness[best] > self.global_best_fitness:
+            self.global_best_fitness = self.best_fitness[best]
+            self.global_best_position = self.best_positions[best].copy()
+
+        return fitness
+
+    def update_velocities(self):
+        """
+        The velocity update of particle swarm optimization.
+        """
+        r = self.uniform(2, len(self), self.dimensions)
+
+        self.velocities *= self.inertia
+        self.velocities += self.cognitive * r[0] * \
+            (self.best_positions - self.positions)
+        self.velocities += self.social * r[1] * \
+            (self.global_best_position - self.positions)
+
+        if self.max_speed is not None:
+            speed = np.sqrt((self.velocities ** 2).sum(axis=1))
+            scale = np.minimum(1., self.max_speed / np.maximum(speed, 1e-12))
+            self.velocities *= scale[:, None]
+
+    def step_prologue(self, model):
+        """
+        Evaluates the fitness of every particle.
+
+        Parameters
+        ----------
+        model : Model
+            The instance of the model to which the swarm belongs.
+        """
+        self.evaluate()
+
+    def step_main(self, model):
+        """
+        Updates the velocities, then applies any further update rules and
+        moves the particles (see Swarm.step_main).
+
+        Parameters
+        ----------
+        model : Model
+            The instance of the model to which the swarm belongs.
+        """
+        self.update_velocities()
+        super(ParticleSwarm, self).step_main(model)
@@ -0,0 +1,982 @@
+"""
+Snapshots of models, written directly from the live state of a simulation.
+
+Snapshots are pickled with a custom pickler rather than from a copy of the
+model, so writing one does not require any more memory than the model
+itself. Dense arrays (NumPy arrays, such as the states of lattice grids,
+and the occupancy counts of object grids) are passed to the file as
+out-of-band buffers (pickle protocol 5), which are written as they are
+instead of being copied into the pickle stream.
+
+Fields which cannot or should not be saved, such as functions stored on
+agents, are registered per class with exclude_fields, and whole objects
+(eg: helpers which only make sense in a running simulation) with
+exclude_class.
+
+A snapshot file is made of a short header, the pickle stream, the raw
+buffers (each aligned to 64 bytes), a JSON index giving the position of
+the pickle stream and of every buffer, and finally the position of the
+index as an 8-byte little-endian integer.
+
+For analysis, a snapshot of a model can also include tables: the
+contents of every grid as a raw array, and the agents as columns (their
+class, their position in each environment and their numeric, boolean and
+string attributes). These are named sections of the file which
+SnapshotReader memory-maps, so that reading one grid, one region of a
+grid or one column of the agent table only reads that part of the file,
+without unpickling the model.
+
+A catalog, written next to the snapshots of a run, records one line per
+saved epoch with the file's size, the position of its sections and a few
+summary statistics, so analysis code can find the relevant epochs (eg:
+the epoch where the population peaked) without opening every file, and
+then load them one at a time.
+
+Requires Python 3.8 or later. Tables require NumPy.
+"""
+import io
+import json
+import mmap
+import os
+import struct
+from array import array
+from collections import Counter
+
+import pickle
+
+from panaxea.core import Numerics
+from panaxea.core.Environment import CoarseNumericalGrid, \
+    ContinuousSpace, LatticeGrid, NumericalGrid, ObjectGrid
+from panaxea.core.Numerics import np
+from panaxea.core.Steppables import CompactAgent
+from panaxea.core.Storage import ChunkedCellStore, MappedCellStore
+
+MAGIC = b"PXSNAP01"
+ALIGNMENT = 64
+CATALOG = "catalog.jsonl"
+
+_excluded_fields = dict()
+_excluded_classes = set()
+_fields_cache = dict()
+
+
+def exclude_fields(cls, *fields):
+    """
+    Registers fields which are left out of snapshots for all instances of
+    a class and of its subclasses. Excluded fields are restored as None.
+
+    Parameters
+    ----------
+    cls : type
+        The class.
+    fields : string
+        The names of the fields to exclude.
+    """
+    _excluded_fields.setdefault(cls, set()).update(fields)
+    _fields_cache.clear()
+
+
+def exclude_class(cls):
+    """
+    Registers a class whose instances are left out of snapshots. Excluded
+    objects are restored as None, and are left out of the helpers saved by
+    ModelPicklerLite.
+
+    Parameters
+    ----------
+    cls : type
+        The class.
+    """
+    _excluded_classes.add(cls)
+
+
+def excluded_fields(cls):
+    """
+    Returns the fields excluded from snapshots for instances of a class,
+    including those registered for its base classes.
+
+    Parameters
+    ----------
+    cls : type
+        The class.
+
+    Returns
+    -------
+    frozenset
+        The names of the excluded fields.
+    """
+    fields = _fields_cache.get(cls)
+
+    if fields is None:
+        fields = frozenset(f for base in getattr(cls, "__mro__", ())
+                           for f in _excluded_fields.get(base, ()))
+        _fields_cache[cls] = fields
+
+    return fields
+
+
+def is_excluded(obj):
+    """
+    Checks whether an object is excluded from snapshots by exclude_class.
+
+    Parameters
+    ----------
+    obj : object
+        The object.
+
+    Returns
+    -------
+    bool
+        True if the object is excluded.
+    """
+    return bool(_excluded_classes) and \
+        isinstance(obj, tuple(_excluded_classes))
+
+
+def _object_state(obj):
+    if isinstance(obj, CompactAgent):
+        return obj.__getstate__()
+
+    return dict(obj.__dict__)
+
+
+def _restore_object(cls, state):
+    obj = cls.__new__(cls)
+
+    if issubclass(cls, CompactAgent):
+        obj.__setstate__(state)
+    else:
+        obj.__dict__.update(state)
+
+    return obj
+
+
+def _restore_array(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    return values
+
+
+def _restore_none():
+    return None
+
+
+class SnapshotPickler(pickle.Pickler):
+    """
+    A pickler applying the exclusions registered with exclude_fields and
+    exclude_class, and passing the contents of arrays as buffers, which
+    are written out-of-band when a buffer_callback is given.
+    """
+
+    def reducer_override(self, obj):
+        if isinstance(obj, array):
+            return _restore_array, (obj.typecode, pickle.PickleBuffer(obj))
+
+        if is_excluded(obj):
+            return _restore_none, ()
+
+        fields = excluded_fields(type(obj))
+
+        if fields and (hasattr(obj, "__dict__") or
+                       isinstance(obj, CompactAgent)):
+            state = _object_state(obj)
+            for field in fields:
+                if field in state:
+                    state[field] = None
+            return _restore_object, (type(obj), state)
+
+        return NotImplemented
+
+
+def dump(obj, output_file):
+    """
+    Pickles an object to a file with the snapshot exclusions applied. All
+    data is written in-band, so the file can be read with pickle.load.
+
+    Parameters
+    ----------
+    obj : object
+        The object to pickle, typically a model.
+    output_file : file
+        A file opened for writing in binary mode.
+    """
+    SnapshotPickler(output_file, 5).dump(obj)
+
+
+def _write_buffers(output_file, buffers):
+    positions = []
+
+    for buffer in buffers:
+        raw = buffer.raw()
+        output_file.write(b"\0" * (-output_file.tell() % ALIGNMENT))
+        positions.append([output_file.tell(), raw.nbytes])
+        output_file.write(raw)
+
+    return positions
+
+
+def _grid_table(environment):
+    # Chunked and memory-mapped grids may be too large to hold in memory
+    if isinstance(getattr(environment, "grid", None),
+                  (ChunkedCellStore, MappedCellStore)) or \
+            isinstance(getattr(environment, "occupancy", None),
+                       ChunkedCellStore):
+        return None
+
+    if isinstance(environment, LatticeGrid):
+        return environment.current
+
+    # Coarse grids are saved at the resolution of their field
+    if isinstance(environment, CoarseNumericalGrid):
+        return environment.field
+
+    if isinstance(environment, NumericalGrid):
+        return environment.to_array()
+
+    if isinstance(environment, ObjectGrid):
+        if environment.occupancy is not None:
+            return np.frombuffer(environment.occupancy, dtype=np.intc) \
+                .reshape(environment._size)
+        counts = np.zeros(environment._size, dtype=np.intc)
+        for position, cell in environment.grid.items():
+            counts[position] = len(cell)
+        return counts
+
+    return None
+
+
+def _categorical(values):
+    categories = sorted(set(values))
+    codes = dict((c, i) for i, c in enumerate(categories))
+    return np.array([codes[v] for v in values], dtype=np.int32), categories
+
+
+def _position_column(agents, environment):
+    positions = [a.environment_positions.get(environment.name)
+                 for a in agents]
+    dimensions = max([len(p) for p in positions if p is not None] or [0])
+
+    if isinstance(environment, ContinuousSpace):
+        column = np.full((len(agents), dimensions), np.nan)
+    else:
+        column = np.full((len(agents), dimensions), -1, dtype=np.int64)
+
+    for i, position in enumerate(positions):
+        if position is not None:
+            column[i] = position
+
+    return column
+
+
+def _attribute_column(values):
+    """
+    Converts the values of an attribute to a column: a NumPy array for
+    numbers and booleans (NaN where missing), categories for strings, or
+    None for other types.
+    """
+    present = [v for v in values if v is not None]
+
+    if not present:
+        return None
+
+    if all([isinstance(v, str) for v in present]):
+        return _categorical(["" if v is None else v for v in values])
+
+    if not all([isinstance(v, (bool, int, float, np.number, np.bool_))
+                for v in present]):
+        return None
+
+    if len(present) == len(values):
+        return np.array(values)
+
+    return np.array([np.nan if v is None else v for v in values],
+                    dtype=float)
+
+
+def _agent_tables(agents, environments):
+    agents = list(agents)
+    columns = {"class": _categorical([a.__class__.__name__
+                                      for a in agents])}
+
+    for environment in environments.values():
+        columns["%s/position" % environment.name] = \
+            _position_column(agents, environment)
+
+    states = [_object_state(a) for a in agents]
+
+    for state, agent in zip(states, agents):
+        state.pop("environment_positions", None)
+        for field in excluded_fields(type(agent)):
+            state.pop(field, None)
+
+    names = set(name for state in states for name in state)
+
+    for name in sorted(names):
+        column = _attribute_column([state.get(name) for state in states])
+        if column is not None:
+            columns[name] = column
+
+    return columns
+
+
+def build_tables(model):
+    """
+    Builds the tables stored in snapshots of a model: one dense array per
+    grid (the values of numerical grids, the field of coarse numerical
+    grids, the states of lattice grids and the number of agents per
+    position of object grids) and one column per agent attribute.
+
+    Agents are those on the schedule or waiting to be added to it, in the
+    same order in every column.
+
+    Requires NumPy.
+
+    Parameters
+    ----------
+    model : Model
+        The model.
+
+    Returns
+    -------
+    dict
+        The tables, mapping section names ("grids/<environment name>" or
+        "agents/<column name>") to arrays, or to (codes, categories) pairs
+        for string columns.
+    """
+    Numerics.require_numpy("Snapshot tables")
+    tables = dict()
+
+    for name, environment in model.environments.items():
+        grid = _grid_table(environment)
+        if grid is not None:
+            tables["grids/%s" % name] = grid
+
+    agents = model.schedule.agents.union(model.schedule.agents_to_schedule)
+
+    for name, column in _agent_tables(agents, model.environments).items():
+        tables["agents/%s" % name] = column
+
+    return tables
+
+
+def _write_sections(output_file, tables):
+    sections = dict()
+
+    for name, table in tables.items():
+        categories = None
+
+        if isinstance(table, tuple):
+            table, categories = table
+
+        table = np.ascontiguousarray(table)
+        output_file.write(b"\0" * (-output_file.tell() % ALIGNMENT))
+        sections[name] = {
+            "offset": output_file.tell(),
+            "dtype": table.dtype.str,
+            "shape": list(table.shape)
+        }
+
+        if categories is not None:
+            sections[name]["categories"] = categories
+
+        output_file.write(table.data)
+
+    return sections
+
+
+def save_snapshot(obj, path, tables=False):
+    """
+    Writes a snapshot file. The file is first written to a temporary path
+    and then moved to *path*.
+
+    Parameters
+    ----------
+    obj : object
+        The object to save, typically a model.
+    path : string
+        The file to write.
+    tables : bool, optional
+        If set to true, the model's grids and agents are also stored as
+        tables (see build_tables), which can be read by SnapshotReader
+        without loading the model. Defaults to false.
+    """
+    buffers = []
+    payload = io.BytesIO()
+    SnapshotPickler(payload, 5, buffer_callback=buffers.append).dump(obj)
+    payload = payload.getbuffer()
+    temporary = "%s.tmp" % path
+
+    with open(temporary, "wb") as output_file:
+        output_file.write(MAGIC)
+        output_file.write(payload)
+        index = {
+            "version": 1,
+            "pickle": [len(MAGIC), payload.nbytes],
+            "buffers": _write_buffers(output_file, buffers),
+            "sections": _write_sections(
+                output_file, build_tables(obj) if tables else {})
+        }
+        index_position = output_file.tell()
+        output_file.write(json.dumps(index).encode("ascii"))
+        output_file.write(struct.pack("<Q", index_position))
+
+    os.replace(temporary, path)
+
+
+def is_snapshot(path):
+    """
+    Checks whether a file is a snapshot written by save_snapshot.
+
+    Parameters
+    ----------
+    path : string
+        The file to check.
+
+    Returns
+    -------
+    bool
+        True if the file is a snapshot.
+    """
+    with open(path, "rb") as input_file:
+        return input_file.read(len(MAGIC)) == MAGIC
+
+
+def read_index(data):
+    """
+    Reads the index of a snapshot.
+
+    Parameters
+    ----------
+    data : bytes-like
+        The contents of the snapshot file.
+
+    Returns
+    -------
+    dict
+        The index, with the position of the pickle stream and of each
+        buffer as [offset, length] pairs.
+    """
+    data = memoryview(data)
+
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a snapshot file")
+
+    index_position = struct.unpack("<Q", data[-8:])[0]
+    return json.loads(bytes(data[index_position:-8]).decode("ascii"))
+
+
+def read_file_index(path):
+    """
+    Reads the index of a snapshot file, without reading the rest of it.
+
+    Parameters
+    ----------
+    path : string
+        The snapshot file.
+
+    Returns
+    -------
+    dict
+        The index, see read_index.
+    """
+    with open(path, "rb") as input_file:
+        if input_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a snapshot file")
+
+        input_file.seek(-8, os.SEEK_END)
+        end = input_file.tell()
+        index_position = struct.unpack("<Q", input_file.read(8))[0]
+        input_file.seek(index_position)
+        return json.loads(input_file.read(end - index_position)
+                          .decode("ascii"))
+
+
+def load_snapshot(path):
+    """
+    Loads a snapshot file. Dense arrays are restored as views on the
+    contents of the file, without being copied.
+
+    Parameters
+    ----------
+    path : string
+        The file to load.
+
+    Returns
+    -------
+    object
+        The saved object.
+    """
+    with open(path, "rb") as input_file:
+        data = memoryview(bytearray(input_file.read()))
+
+    index = read_index(data)
+    start, length = index["pickle"]
+    buffers = [data[o:o + n] for o, n in index["buffers"]]
+    return pickle.loads(data[start:start + length], buffers=buffers)
+
+
+class SnapshotReader(object):
+    """
+    Reads the tables of a snapshot lazily. The file is memory-mapped and
+    arrays are returned as read-only views on it, so only the parts of the
+    file which are actually accessed are read from disk.
+
+    Readers can be used as context managers. Arrays returned by a reader
+    keep the file mapped until they are garbage collected.
+
+    Requires NumPy.
+
+    Attributes
+    ----------
+    path : string
+        The snapshot file.
+    """
+
+    def __init__(self, path):
+        Numerics.require_numpy("SnapshotReader")
+        self.path = path
+
+        with open(path, "rb") as input_file:
+            self._map = mmap.mmap(input_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+
+        self.index = read_index(self._map)
+        self.sections = self.index.get("sections", {})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Closes the file. If arrays read from the file are still in use, it
+        stays mapped until they are garbage collected.
+        """
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+
+    def _section_names(self, prefix):
+        return sorted(n[len(prefix):] for n in self.sections
+                      if n.startswith(prefix))
+
+    @property
+    def grids(self):
+        """
+        The names of the environments whose grid was stored.
+        """
+        return self._section_names("grids/")
+
+    @property
+    def columns(self):
+        """
+        The names of the columns of the agent table.
+        """
+        return self._section_names("agents/")
+
+    def array(self, name):
+        """
+        Returns a section of the file as an array, without reading it.
+
+        Parameters
+        ----------
+        name : string
+            The name of the section.
+
+        Returns
+        -------
+        numpy.ndarray
+            A read-only view on the section.
+        """
+        section = self.sections[name]
+        dtype = np.dtype(section["dtype"])
+        shape = tuple(section["shape"])
+        count = int(np.prod(shape))
+
+        return np.frombuffer(self._map, dtype=dtype, count=count,
+                             offset=section["offset"]).reshape(shape)
+
+    def grid(self, name):
+        """
+        Returns the contents of a grid. Slicing the array (eg:
+        reader.grid("oxygen")[10:20, 10:20]) only reads that region.
+
+        Parameters
+        ----------
+        name : string
+            The name of the environment.
+
+        Returns
+        -------
+        numpy.ndarray
+            The values of a numerical grid, the states of a lattice grid or
+            the number of agents at each position of an object grid.
+        """
+        return self.array("grids/%s" % name)
+
+    def column(self, name):
+        """
+        Returns a column of the agent table. String columns (such as
+        "class") are decoded to arrays of strings.
+
+        Parameters
+        ----------
+        name : string
+            The name of the column, eg: "class", "<environment>/position"
+            or the name of an agent attribute.
+
+        Returns
+        -------
+        numpy.ndarray
+            The column, with one row per agent.
+        """
+        section = self.sections["agents/%s" % name]
+        values = self.array("agents/%s" % name)
+
+        if "categories" in section:
+            return np.array(section["categories"], dtype=object)[values]
+
+        return values
+
+    def agents(self, columns=None, class_name=None):
+        """
+        Returns several columns of the agent table.
+
+        Parameters
+        ----------
+        columns : iterable, optional
+            The columns to read. Defaults to all columns.
+        class_name : string, optional
+            If given, only agents of this class are included.
+
+        Returns
+        -------
+        dict
+            A dictionary mapping column names to arrays.
+        """
+        columns = self.columns if columns is None else list(columns)
+        rows = None
+
+        if class_name is not None:
+            rows = self.column("class") == class_name
+
+        return dict((c, self.column(c) if rows is None else
+                     self.column(c)[rows]) for c in columns)
+
+    def load(self):
+        """
+        Loads the whole object saved in the snapshot. Dense arrays are
+        restored as read-only views on the file.
+
+        Returns
+        -------
+        object
+            The saved object.
+        """
+        data = memoryview(self._map)
+        start, length = self.index["pickle"]
+        buffers = [data[o:o + n] for o, n in self.index["buffers"]]
+        return pickle.loads(data[start:start + length], buffers=buffers)
+
+
+def load(path):
+    """
+    Loads a file written by save_snapshot or by dump (or pickle.dump).
+
+    Parameters
+    ----------
+    path : string
+        The file to load.
+
+    Returns
+    -------
+    object
+        The saved object.
+    """
+    if is_snapshot(path):
+        return load_snapshot(path)
+
+    with open(path, "rb") as input_file:
+        return pickle.load(input_file)
+
+
+def _grid_statistics(model):
+    statistics = dict()
+
+    if np is None:
+        return statistics
+
+    for name, environment in model.environments.items():
+        grid = _grid_table(environment)
+        if grid is not None and grid.size > 0:
+            statistics[name] = {
+                "min": float(grid.min()),
+                "max": float(grid.max()),
+                "mean": float(grid.mean()),
+                "sum": float(grid.sum())
+            }
+
+    return statistics
+
+
+def summarize(model, statistics=None):
+    """
+    Computes the summary statistics recorded in catalogs: the number of
+    agents (on the schedule or waiting to be added to it), the number of
+    agents per class, the minimum, maximum, mean and sum of every grid (if
+    NumPy is installed) and any custom statistics.
+
+    Parameters
+    ----------
+    model : Model
+        The model.
+    statistics : dict, optional
+        Custom statistics, mapping names to functions of the model which
+        return JSON serializable values.
+
+    Returns
+    -------
+    dict
+        The statistics.
+    """
+    agents = model.schedule.agents.union(model.schedule.agents_to_schedule)
+    summary = {
+        "agents": len(agents),
+        "classes": dict(Counter([a.__class__.__name__ for a in agents])),
+        "grids": _grid_statistics(model)
+    }
+
+    for name, statistic in (statistics or {}).items():
+        summary[name] = statistic(model)
+
+    return summary
+
+
+class Catalog(object):
+    """
+    An index of the snapshots of a run, stored as a JSON lines file with
+    one entry per saved epoch. Each entry holds the epoch, the name of the
+    file (relative to the catalog's directory), its size in bytes, for
+    snapshot files the [offset, length] of the pickle stream and of each
+    table, and the statistics computed by summarize.
+
+    Entries are appended as files are saved, so a catalog is usable while
+    the run is still going and survives the run being killed.
+
+    Attributes
+    ----------
+    directory : string
+        The directory holding the snapshots and the catalog.
+    name : string, optional
+        The name of the catalog file. Defaults to "catalog.jsonl".
+    """
+
+    def __init__(self, directory, name=CATALOG):
+        self.directory = directory
+        self.name = name
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, self.name)
+
+    def record(self, model, target, statistics=None):
+        """
+        Adds the entry of a file which was just saved.
+
+        Parameters
+        ----------
+        model : Model
+            The model which was saved.
+        target : string
+            The path of the saved file.
+        statistics : dict, optional
+            Custom statistics, see summarize.
+
+        Returns
+        -------
+        dict
+            The entry.
+        """
+        entry = {
+            "epoch": model.current_epoch,
+            "file": os.path.relpath(target, self.directory),
+            "size": os.path.getsize(target)
+        }
+
+        if is_snapshot(target):
+            index = read_file_index(target)
+            entry["pickle"] = index["pickle"]
+            entry["sections"] = dict(
+                (name, [section["offset"],
+                        int(np.dtype(section["dtype"]).itemsize *
+                            np.prod(section["shape"]))])
+                for name, section in index.get("sections", {}).items())
+
+        entry["statistics"] = summarize(model, statistics)
+
+        with open(self.path, "a") as catalog_file:
+            catalog_file.write(json.dumps(entry) + "\n")
+
+        return entry
+
+    def entries(self):
+        """
+        Reads the entries of the catalog. Should the last line have been
+        cut short (eg: the run was killed while writing it), it is
+        skipped.
+
+        Returns
+        -------
+        list
+            The entries, in the order in which they were recorded.
+        """
+        entries = []
+
+        if not os.path.exists(self.path):
+            return entries
+
+        with open(self.path) as catalog_file:
+            for line in catalog_file:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+
+        return entries
+
+    @staticmethod
+    def value(entry, statistic):
+        """
+        Reads a statistic from an entry.
+
+        Parameters
+        ----------
+        entry : dict
+            The entry.
+        statistic : string
+            The path of the statistic, with levels separated by "/", eg:
+            "agents", "classes/CancerCell" or "grids/oxygen/mean".
+
+        Returns
+        -------
+        object
+            The value of the statistic, or None if it was not recorded.
+        """
+        value = entry["statistics"]
+
+        for key in statistic.split("/"):
+            if not isinstance(value, dict) or key not in value:
+                return None
+            value = value[key]
+
+        return value
+
+    def series(self, statistic):
+        """
+        Returns the value of a statistic across the run.
+
+        Parameters
+        ----------
+        statistic : string
+            The path of the statistic, see value.
+
+        Returns
+        -------
+        list
+            (epoch, value) pairs.
+        """
+        return [(e["epoch"], self.value(e, statistic))
+                for e in self.entries()]
+
+    def peak(self, statistic):
+        """
+        Returns the entry of the epoch where a statistic was highest.
+
+        Parameters
+        ----------
+        statistic : string
+            The path of the statistic, see value.
+
+        Returns
+        -------
+        dict
+            The entry, or None if the statistic was never recorded.
+        """
+        entries = [e for e in self.entries()
+                   if self.value(e, statistic) is not None]
+
+        if not entries:
+            return None
+
+        return max(entries, key=lambda e: self.value(e, statistic))
+
+    def select(self, epochs=None, where=None):
+        """
+        Selects entries by epoch and/or by a predicate.
+
+        Parameters
+        ----------
+        epochs : iterable, optional
+            The epochs to select. Defaults to all epochs.
+        where : callable, optional
+            A function taking an entry and returning true for the entries
+            to select.
+
+        Returns
+        -------
+        list
+            The selected entries.
+        """
+        epochs = None if epochs is None else set(epochs)
+        return [e for e in self.entries()
+                if (epochs is None or e["epoch"] in epochs) and
+                (where is None or where(e))]
+
+    def file(self, entry):
+        """
+        Returns the path of the file of an entry.
+        """
+        return os.path.join(self.directory, entry["file"])
+
+    def load(self, entry):
+        """
+        Loads the model saved in the file of an entry.
+
+        Parameters
+        ----------
+        entry : dict or int
+            The entry, or the epoch.
+
+        Returns
+        -------
+        Model
+            The saved model.
+        """
+        if not isinstance(entry, dict):
+            entry = self.select(epochs=[entry])[-1]
+
+        return load(self.file(entry))
+
+    def iter_models(self, epochs=None, where=None):
+        """
+        Loads the selected snapshots one at a time, so a whole run can be
+        analysed while only keeping one model in memory.
+
+        Parameters
+        ----------
+        epochs : iterable, optional
+            The epochs to load. Defaults to all epochs.
+        where : callable, optional
+            A function taking an entry and returning true for the entries
+            to load.
+
+        Yields
+        ------
+        tuple
+            The entry and the loaded model.
+        """
+        for entry in self.select(epochs, where):
+            yield entry, self.load(entry)
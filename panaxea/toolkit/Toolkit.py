@@ -1,15 +1,49 @@
-import copy
 import time
-from collections import Counter, defaultdict
+from collections import Counter
 
+from panaxea.core.Environment import NumericalGrid, ObjectGrid
 from panaxea.core.Model import Model
 from panaxea.core.Steppables import Helper
+from panaxea.core.Storage import ChunkedCellStore, MappedCellStore, \
+    SharedCellStore, SparseCellStore
 
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 
+# Snapshots rely on pickle protocol 5, only available from Python 3.8. On
+# older versions models are pickled as they are, without exclusions.
+if hasattr(pickle, "PickleBuffer"):
+    from panaxea.toolkit import Snapshot
+else:
+    Snapshot = None
+
+
+def _require_snapshot(feature):
+    """
+    Raises an informative ImportError if snapshots are not available.
+
+    Parameters
+    ----------
+    feature : string
+        The name of the feature requiring snapshots, used in the error
+        message.
+    """
+    if Snapshot is None:
+        raise ImportError("%s requires Python 3.8 or later" % feature)
+
+
+def _dump(model, output_file):
+    """
+    Pickles a model with the snapshot exclusions applied where snapshots
+    are available, and as it is otherwise.
+    """
+    if Snapshot is None:
+        pickle.dump(model, output_file)
+    else:
+        Snapshot.dump(model, output_file)
+
 
 class AgentSummary(Helper, object):
     """
@@ -62,10 +96,23 @@ class ModelPickler(Helper, object):
         The directory where pickle files should be outputted. This should be
         specified as relative to the script
         from which the simulation is launched
+    catalog : bool, optional
+        If set to true, an entry is added to the catalog of outDir (see
+        Snapshot.Catalog) for every file, which requires Python 3.8 or
+        later. Defaults to false.
+    statistics : dict, optional
+        Custom statistics recorded in the catalog, mapping names to
+        functions of the model. Defaults to none.
     """
 
-    def __init__(self, out_dir):
+    def __init__(self, out_dir, catalog=False, statistics=None):
         self.outDir = out_dir
+        self.catalog = None
+        self.statistics = statistics
+
+        if catalog:
+            _require_snapshot("The catalog option")
+            self.catalog = Snapshot.Catalog(out_dir)
 
     def step_epilogue(self, model):
         """
@@ -74,9 +121,13 @@ class ModelPickler(Helper, object):
         model : Model
             An instance of the model on which the current simulation is based.
         """
-        with open("%s/epoch_%s.pickle" % (self.outDir, model.current_epoch),
-                  "wb") as output_file:
-            pickle.dump(model, output_file)
+        target = "%s/epoch_%s.pickle" % (self.outDir, model.current_epoch)
+
+        with open(target, "wb") as output_file:
+            _dump(model, output_file)
+
+        if self.catalog is not None:
+            self.catalog.record(model, target, self.statistics)
 
 
 class ModelPicklerLite(Helper, object):
@@ -84,6 +135,12 @@ class ModelPicklerLite(Helper, object):
     Creates a lighter version of the pickle allowing to include or exclude
     specific elements.
 
+    The pickle is written directly from the live state of the model,
+    without copying it first. Fields which can not be pickled (eg:
+    functions stored on agents) should be registered with
+    Snapshot.exclude_fields, and helpers which should not be saved with
+    Snapshot.exclude_class.
+
     Attributes
     ----------
     outDir : string
@@ -106,18 +163,53 @@ class ModelPicklerLite(Helper, object):
         If set to true, all environment objects will be included. This also
         includes all agents in every environment.
         Defaults to false.
+    exclude_properties : iterable, optional
+        Paths of model properties to leave out of the pickle, each given as
+        a tuple of keys into the (nested) properties dictionary. Excluded
+        properties are saved as None. Defaults to none.
+    snapshot : bool, optional
+        If set to true, files are written in the snapshot format (see
+        Snapshot.save_snapshot), with dense arrays stored out-of-band.
+        These can still be read with depickle_from_lite. Requires Python
+        3.8 or later. Defaults to false.
+    tables : bool, optional
+        If set to true (together with snapshot), snapshot files also store
+        the model's grids and agents as tables, which can be read with
+        Snapshot.SnapshotReader without loading the model. Defaults to
+        false.
+    catalog : bool, optional
+        If set to true, an entry is added to the catalog of out_dir (see
+        Snapshot.Catalog) for every file, which requires Python 3.8 or
+        later. Defaults to false.
+    statistics : dict, optional
+        Custom statistics recorded in the catalog, mapping names to
+        functions of the model. Defaults to none.
     """
 
     # If virtualPickle is set to true the modelLite will be returned rather
     # than pickled
     # pickleEvery means model with pickled every x epochs, defaults to 1
     def __init__(self, out_dir, prefix=None, pickle_every=1,
-                 pickle_schedule=False, pickle_envs=False):
+                 pickle_schedule=False, pickle_envs=False,
+                 exclude_properties=(), snapshot=False, tables=False,
+                 catalog=False, statistics=None):
         self.out_dir = out_dir
         self.pickle_every = pickle_every
         self.prefix = prefix
         self.pickle_schedule = pickle_schedule
         self.pickle_envs = pickle_envs
+        self.exclude_properties = [tuple(p) for p in exclude_properties]
+        self.snapshot = snapshot
+        self.tables = tables
+        self.catalog = None
+        self.statistics = statistics
+
+        if snapshot:
+            _require_snapshot("The snapshot option")
+
+        if catalog:
+            _require_snapshot("The catalog option")
+            self.catalog = Snapshot.Catalog(out_dir)
 
     # It is important this is in the epilogue as we check for an exit flag
     # which is set by helpers in the prologue!
@@ -137,60 +229,99 @@ class ModelPicklerLite(Helper, object):
                 model.current_epoch == model.epochs - 1 or model.exit):
             self.pickle_model(model)
 
-    def pickle_model(self, model):
+    def _properties(self, properties):
         """
-        Creates and serializes the pickleLight object based on previously
-        defined properties.
+        Returns the properties to pickle. Dictionaries along the path of
+        each excluded property are copied, so the model's own properties
+        are left untouched.
+        """
+        properties = dict(properties)
+
+        for path in self.exclude_properties:
+            level = properties
+            for key in path[:-1]:
+                if not isinstance(level.get(key), dict):
+                    break
+                level[key] = dict(level[key])
+                level = level[key]
+            else:
+                if path[-1] in level:
+                    level[path[-1]] = None
+
+        return properties
+
+    def lite_model(self, model):
+        """
+        Builds the lightweight model which is pickled. It shares its
+        agents, environments and outputs with the original model, nothing
+        is copied.
 
         Parameters
         ----------
         model : Model
             An instance of the model on which the current simulation is based.
+
+        Returns
+        -------
+        Model
+            The lightweight model.
         """
-        start = time.time()
         model_lite = Model(5)
 
         if self.pickle_schedule:
             model_lite.schedule.agents = model.schedule.agents.union(
                 model.schedule.agents_to_schedule)
 
-            for a in model_lite.schedule.agents:
-                if a.__class__.__name__ == "CancerCell":
-                    # Can't pickle functions
-                    a.reactToDrug_ = None
-
         model_lite.schedule.helpers = [h for h in model.schedule.helpers if
-                                       h.__class__.__name__ not in
-                                       "ExitConditionWatcher"]
+                                       Snapshot is None or
+                                       not Snapshot.is_excluded(h)]
 
         if self.pickle_envs:
-            model_lite.environments = copy.deepcopy(model.environments)
-            env_start = time.time()
-            for k, v in model_lite.environments.iteritems():
-                v.grid = dict(v.grid)
-            env_end = time.time()
-            print("Cloning environments took %s seconds" % str(
-                env_end - env_start))
+            model_lite.environments = model.environments
 
         model_lite.output = model.output
-
-        model_lite.properties = model.properties
-        # Can't pickle functions
-        model_lite.properties["agents"]["cancerCells"][
-            "drugReactFunction"] = None
+        model_lite.properties = self._properties(model.properties)
         model_lite.current_epoch = model.current_epoch
 
+        return model_lite
+
+    def pickle_model(self, model):
+        """
+        Creates and serializes the pickleLight object based on previously
+        defined properties.
+
+        Parameters
+        ----------
+        model : Model
+            An instance of the model on which the current simulation is based.
+        """
+        start = time.time()
+        model_lite = self.lite_model(model)
+
         if self.prefix is None:
             target = "%s/epoch_%s.pickle" % (self.out_dir, model.current_epoch)
         else:
             target = "%s/%s_epoch_%s.pickle" % (
                 self.out_dir, self.prefix, model.current_epoch)
-        with open(target, "wb") as output_file:
-            pickle.dump(model_lite, output_file)
+
+        if self.snapshot:
+            Snapshot.save_snapshot(model_lite, target, self.tables)
+        else:
+            with open(target, "wb") as output_file:
+                _dump(model_lite, output_file)
+
+        if self.catalog is not None:
+            self.catalog.record(model, target, self.statistics)
         end = time.time()
         print("Pickler lite took %s seconds" % str(end - start))
 
 
+# Custom statistics are often lambdas, which can not be pickled
+if Snapshot is not None:
+    Snapshot.exclude_fields(ModelPickler, "statistics")
+    Snapshot.exclude_fields(ModelPicklerLite, "statistics")
+
+
 def depickle_from_lite(pickle_path):
     """
     Given a path to a pickle light file, recreates the corresponding object
@@ -204,6 +335,8 @@ def depickle_from_lite(pickle_path):
     whether all properties (schedule, environments...)
     were retained.
 
+    Both plain pickles and files in the snapshot format are supported.
+
     Parameters
     ----------
     pickle_path : string
@@ -216,6 +349,9 @@ def depickle_from_lite(pickle_path):
         A (potentially incomplete) instance of a model derived from the
         pickle file.
     """
+    if Snapshot is not None and Snapshot.is_snapshot(pickle_path):
+        return Snapshot.load_snapshot(pickle_path)
+
     try:
         with open(pickle_path, 'rb') as f:
             model = pickle.load(f, encoding='latin1')
@@ -225,15 +361,14 @@ def depickle_from_lite(pickle_path):
 
     # Handling both Python 2 and 3
 
-    environment_keys = model.environments.keys()
-
-    for environment_key in environment_keys:
-        environment = model.environments[environment_key]
-
-        if "ObjectGrid" in environment.__class__.__name__:
-            model.environments[environment_key].grid = \
-                defaultdict(set, environment.grid)
-        else:
-            model.environments[environment_key].grid = \
-                defaultdict(int, environment.grid)
+    # Older pickles stored grids as plain dictionaries
+    for environment in model.environments.values():
+        if isinstance(getattr(environment, "grid", None),
+                      (ChunkedCellStore, MappedCellStore,
+                       SharedCellStore)):
+            continue
+        if isinstance(environment, ObjectGrid):
+            environment.grid = SparseCellStore(frozenset, environment.grid)
+        elif isinstance(environment, NumericalGrid):
+            environment.grid = SparseCellStore(int, environment.grid)
     return model
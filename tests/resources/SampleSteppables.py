@@ -1,4 +1,6 @@
-from panaxea.core.Steppables import Agent, Helper
+import random
+
+from panaxea.core.Steppables import Agent, CompactAgent, Helper
 
 
 class SimpleAgent(Agent, object):
@@ -77,3 +79,31 @@ class AgentY(Agent):
 
 class AgentZ(Agent):
     pass
+
+
+class RandomAgent(Agent, object):
+    def __init__(self):
+        super(RandomAgent, self).__init__()
+        self.draws = []
+
+    def step_main(self, model):
+        self.draws.append(random.random())
+
+
+class CheckpointHelper(Helper, object):
+    def __init__(self, path, epoch):
+        super(CheckpointHelper, self).__init__()
+        self.path = path
+        self.epoch = epoch
+
+    def step_epilogue(self, model):
+        if model.current_epoch == self.epoch:
+            model.save_checkpoint(self.path)
+
+
+class CompactAgentX(CompactAgent):
+    __slots__ = ("flag",)
+
+    def __init__(self):
+        super(CompactAgentX, self).__init__()
+        self.flag = None
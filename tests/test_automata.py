@@ -0,0 +1,130 @@
+import unittest
+
+from panaxea.core.Automata import KernelRule, LifeRule, TotalisticRule
+from panaxea.core.Environment import LatticeGrid2D, LatticeGrid3D
+from panaxea.core.Model import Model
+from panaxea.core.Numerics import np, neighbourhood_map, neighbourhood_sum
+from panaxea.core.Stencils import Stencil
+
+
+@unittest.skipIf(np is None, "requires NumPy")
+class TestAutomata(unittest.TestCase):
+
+    def test_parse_life_rule(self):
+        self.assertEqual(LifeRule.parse("B3/S23"),
+                         (frozenset([3]), frozenset([2, 3])))
+        self.assertEqual(LifeRule.parse("s23/b36"),
+                         (frozenset([3, 6]), frozenset([2, 3])))
+        self.assertEqual(LifeRule.parse("B2/S"), (frozenset([2]), frozenset()))
+        self.assertRaises(ValueError, LifeRule.parse, "23/3")
+
+    def test_neighbourhood_sum(self):
+        values = np.arange(20).reshape(4, 5)
+
+        for stencil in (Stencil.moore(2), Stencil.moore(2, 2),
+                        Stencil.von_neumann(2)):
+            offsets = stencil.as_array()
+            expected = np.zeros(values.shape)
+            for offset in offsets:
+                expected += neighbourhood_sum(values, [offset], "clip")
+            np.testing.assert_array_equal(
+                neighbourhood_sum(values, offsets, "clip"), expected)
+
+            # Neighbours repeated at the edges of reflecting grids, or on
+            # wrapping grids narrower than the stencil, count once
+            for boundary in ("clip", "wrap", "reflect"):
+                np.testing.assert_array_equal(
+                    neighbourhood_sum(values, offsets, boundary),
+                    neighbourhood_map(values, offsets, boundary, "sum"))
+                np.testing.assert_array_equal(
+                    neighbourhood_sum(values, offsets, boundary,
+                                      np.ones(len(offsets))),
+                    neighbourhood_map(values, offsets, boundary, "sum"))
+
+        counts = neighbourhood_sum(np.ones((3, 3), dtype=bool),
+                                   Stencil.moore(2).as_array(), "clip")
+        self.assertEqual(counts[1, 1], 8)
+        self.assertEqual(counts[0, 0], 3)
+
+        # As many offsets as the moore neighbourhood, but not its shape
+        stencil = Stencil([o for o in Stencil.moore(2).offsets
+                           if o != (1, 1)] + [(0, 0)])
+        single = np.zeros((3, 3), dtype=int)
+        single[2, 2] = 1
+        self.assertEqual(neighbourhood_sum(single, stencil.as_array(),
+                                           "clip")[1, 1], 0)
+
+    def test_life_at_reflected_and_wrapped_edges(self):
+        model = Model(5)
+
+        for size in (5, 2):
+            for boundary in ("reflect", "wrap"):
+                env = LatticeGrid2D("env", size, size, model,
+                                    boundary=boundary)
+                env.current[0, 0] = 1
+                rule = LifeRule("B3/S23")
+
+                np.testing.assert_array_equal(
+                    rule.neighbour_sum(env, model), env.get_neigh_map("sum"))
+
+                # A lone cell dies
+                env.add_rule(rule)
+                env.advance(model)
+                self.assertEqual(env.current.sum(), 0)
+
+    def test_game_of_life(self):
+        model = Model(5)
+        env = LatticeGrid2D("env", 6, 6, model, boundary="wrap")
+
+        # A glider moves one position diagonally every four generations
+        for position in [(0, 1), (1, 2), (2, 0), (2, 1), (2, 2)]:
+            env.current[position] = 1
+
+        glider = env.current.copy()
+        env.add_rule(LifeRule("B3/S23"))
+
+        for _ in range(4):
+            model.schedule.step_schedule(model)
+
+        np.testing.assert_array_equal(env.current,
+                                      np.roll(glider, (1, 1), (0, 1)))
+
+    def test_life_rule_with_source(self):
+        model = Model(5)
+        env = LatticeGrid2D("env", 3, 3, model)
+        food = LatticeGrid2D("food", 3, 3, model)
+        food.current[0, :] = 1
+
+        env.add_rule(LifeRule((set([3]), set()), source="food"))
+        model.schedule.step_schedule(model)
+
+        self.assertEqual(env.current[1, 1], 1)
+        self.assertEqual(env.current[1].tolist(), [0, 1, 0])
+
+    def test_totalistic_rule(self):
+        model = Model(5)
+        env = LatticeGrid3D("env", 3, 3, 3, model)
+        env.current[1, 1, 1] = 1
+
+        # Cells take the state 1 if exactly one neighbour is on
+        table = np.zeros((2, 27), dtype=int)
+        table[:, 1] = 1
+        env.add_rule(TotalisticRule(table))
+        model.schedule.step_schedule(model)
+
+        self.assertEqual(env.current.sum(), 26)
+        self.assertEqual(env.current[1, 1, 1], 0)
+
+    def test_kernel_rule(self):
+        model = Model(5)
+        env = LatticeGrid2D("env", 1, 5, model, dtype=float)
+        env.current[0, 2] = 1.
+
+        # Diffusion along the y-axis
+        kernel = [[0.25, 0.5, 0.25]]
+        env.add_rule(KernelRule(kernel, lambda states, sums: sums))
+        model.schedule.step_schedule(model)
+
+        self.assertEqual(env.current[0].tolist(), [0., 0.25, 0.5, 0.25, 0.])
+
+        self.assertRaises(ValueError, KernelRule, [[1, 1]], None)
@@ -1,8 +1,19 @@
+import os
+import shutil
+import tempfile
 import unittest
 
+import math
+from random import Random
+
 from panaxea.core.Environment import ObjectGrid2D, NumericalGrid2D, \
-    ObjectGrid3D, NumericalGrid3D
+    ObjectGrid3D, NumericalGrid3D, ContinuousSpace2D, ContinuousSpace3D, \
+    LatticeGrid2D, LatticeGrid3D, CoarseNumericalGrid2D, CoarseNumericalGrid3D
 from panaxea.core.Model import Model
+from panaxea.core.Numerics import np, restrict
+from panaxea.core.Stencils import Stencil
+from panaxea.core.Steppables import add_agents_to_grid
+from panaxea.core.Storage import shared_memory
 from tests.resources.SampleSteppables import SimpleAgent, AgentX
 
 
@@ -222,6 +233,38 @@ class TestEnvironment(unittest.TestCase):
         env = ObjectGrid2D(grid_name, 50, 50, model)
         self.assertEqual(env.get_least_populated_moore_neigh((100, 100)), None)
 
+    def test_object_grid_reads_do_not_store_positions(self):
+        model = Model(5)
+
+        grid_name = "sampleGridK"
+
+        env = ObjectGrid2D(grid_name, 50, 50, model)
+
+        a = AgentX()
+        a.add_agent_to_grid(grid_name, (20, 20), model)
+
+        env.get_most_populated_moore_neigh((20, 21))
+        env.get_least_populated_moore_neigh((20, 21))
+        self.assertEqual(len(env.grid[(0, 0)]), 0)
+
+        self.assertEqual(list(env.grid.keys()), [(20, 20)])
+
+        a.move_agent(grid_name, (21, 21), model)
+        self.assertEqual(list(env.grid.keys()), [(21, 21)])
+
+        a.remove_agent_from_grid(grid_name, model)
+        self.assertEqual(len(env.grid), 0)
+
+    def test_numerical_grid_reads_do_not_store_positions(self):
+        model = Model(5)
+
+        grid = NumericalGrid2D("env", 10, 10, model)
+        grid.grid[(2, 1)] = 5
+
+        self.assertEqual(grid.get_max_in_neigh((2, 2)), (2, 1))
+        self.assertEqual(grid.grid[(0, 0)], 0)
+        self.assertEqual(list(grid.grid.keys()), [(2, 1)])
+
     # Tests for NumericalGrid3D
     def test_numerical_grid_3d(self):
         model = Model(5)
@@ -538,6 +581,810 @@ class TestEnvironment(unittest.TestCase):
 
         self.assertEqual(grid.get_max_in_neigh(target_pos), max_pos)
 
+    def test_occupancy_tracking(self):
+        model = Model(5)
+        env = ObjectGrid2D("env", 10, 10, model)
+
+        a = AgentX()
+        b = AgentX()
+        a.add_agent_to_grid("env", (2, 3), model)
+        b.add_agent_to_grid("env", (2, 3), model)
+
+        self.assertEqual(env.get_population((2, 3)), 2)
+        self.assertEqual(env.occupancy[env.to_index((2, 3))], 2)
+
+        a.move_agent("env", (2, 4), model)
+        self.assertEqual(env.get_population((2, 3)), 1)
+        self.assertEqual(env.get_population((2, 4)), 1)
+
+        b.remove_agent_from_grid("env", model)
+        self.assertEqual(sum(env.occupancy), 1)
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_occupancy_map(self):
+        model = Model(5)
+        env = ObjectGrid3D("env", 4, 5, 6, model)
+
+        a = AgentX()
+        a.add_agent_to_grid("env", (3, 1, 4), model)
+
+        occupancy = env.get_occupancy_map()
+        self.assertEqual(occupancy.shape, (4, 5, 6))
+        self.assertEqual(occupancy[3, 1, 4], 1)
+        self.assertEqual(occupancy.sum(), 1)
+
+        a.move_agent("env", (0, 0, 0), model)
+        self.assertEqual(occupancy[0, 0, 0], 1)
+        self.assertEqual(occupancy[3, 1, 4], 0)
+
+        untracked = ObjectGrid2D("untracked", 4, 4, model,
+                                 track_occupancy=False)
+        self.assertIsNone(untracked.occupancy)
+        self.assertRaises(ValueError, untracked.get_occupancy_map)
+
+    def test_empty_neighbours(self):
+        model = Model(5)
+
+        for track in (True, False):
+            env = ObjectGrid2D("env", 10, 10, model, track_occupancy=track)
+            free = (4, 6)
+
+            for n in env.get_moore_neighbourhood((5, 5)):
+                if n != free:
+                    AgentX().add_agent_to_grid("env", n, model)
+
+            self.assertEqual(env.get_empty_neighbour((5, 5)), free)
+            self.assertEqual(env.get_empty_neighbours((5, 5)), [free])
+            self.assertEqual(env.get_least_populated_moore_neigh((5, 5)),
+                             free)
+
+            AgentX().add_agent_to_grid("env", free, model)
+            self.assertIsNone(env.get_empty_neighbour((5, 5)))
+
+    def test_capacity(self):
+        model = Model(5)
+        env = ObjectGrid2D("env", 10, 10, model, capacity=2)
+
+        a, b, c = AgentX(), AgentX(), AgentX()
+
+        self.assertTrue(a.add_agent_to_grid("env", (3, 3), model))
+        self.assertTrue(b.add_agent_to_grid("env", (3, 3), model))
+        self.assertFalse(c.add_agent_to_grid("env", (3, 3), model))
+        self.assertTrue("env" not in c.environment_positions)
+        self.assertEqual(env.get_population((3, 3)), 2)
+
+        self.assertTrue(c.add_agent_to_grid("env", (3, 4), model))
+        self.assertFalse(c.move_agent("env", (3, 3), model))
+        self.assertEqual(c.environment_positions["env"], (3, 4))
+        self.assertTrue(a.move_agent("env", (3, 4), model))
+        self.assertTrue(c.move_agent("env", (3, 3), model))
+
+        self.assertRaises(ValueError, ObjectGrid2D, "bad", 5, 5, model,
+                          capacity=0)
+
+    def test_free_neighbour_placement(self):
+        model = Model(5)
+        env = ObjectGrid2D("env", 10, 10, model, capacity=1)
+        free = (7, 5)
+
+        for n in env.get_neighbourhood((5, 5), Stencil.moore(2, 2)):
+            if n != free:
+                AgentX().add_agent_to_grid("env", n, model)
+
+        self.assertIsNone(env.get_free_neighbour((5, 5)))
+        self.assertEqual(env.get_free_neighbour((5, 5), radius=2), free)
+
+        a = AgentX()
+        self.assertEqual(a.add_agent_to_free_neighbour("env", (5, 5), model,
+                                                       radius=2), free)
+        self.assertEqual(a.environment_positions["env"], free)
+        self.assertEqual(env.get_population(free), 1)
+
+        b = AgentX()
+        self.assertIsNone(b.add_agent_to_free_neighbour("env", (5, 5),
+                                                        model, radius=2))
+        self.assertTrue("env" not in b.environment_positions)
+
+    def test_synchronous_moves(self):
+        model = Model(5)
+        env = ObjectGrid2D("env", 10, 10, model, synchronous_moves=True)
+
+        a, b = AgentX(), AgentX()
+        a.add_agent_to_grid("env", (1, 1), model)
+        b.add_agent_to_grid("env", (2, 2), model)
+
+        self.assertTrue(a.move_agent("env", (2, 2), model))
+        self.assertTrue(b.move_agent("env", (1, 1), model))
+        self.assertFalse(a.move_agent("env", (20, 20), model))
+
+        # Nothing moves until the intents are resolved
+        self.assertEqual(a.environment_positions["env"], (1, 1))
+        self.assertTrue(a in env.grid[(1, 1)])
+
+        self.assertEqual(set(env.resolve_moves()), set([a, b]))
+        self.assertEqual(a.environment_positions["env"], (2, 2))
+        self.assertEqual(b.environment_positions["env"], (1, 1))
+        self.assertEqual(env.grid[(2, 2)], set([a]))
+        self.assertEqual(env.get_population((1, 1)), 1)
+        self.assertEqual(env.resolve_moves(), [])
+
+    def test_synchronous_moves_capacity(self):
+        model = Model(5)
+        env = ObjectGrid2D("env", 10, 10, model, capacity=1,
+                           synchronous_moves=True, move_policy="priority")
+
+        a, b, c = AgentX(), AgentX(), AgentX()
+        a.add_agent_to_grid("env", (1, 1), model)
+        b.add_agent_to_grid("env", (3, 3), model)
+        c.add_agent_to_grid("env", (5, 5), model)
+
+        # b and c compete for (1, 1), which a vacates
+        a.move_agent("env", (2, 2), model)
+        b.move_agent("env", (1, 1), model, priority=1)
+        c.move_agent("env", (1, 1), model, priority=2)
+
+        self.assertEqual(set(env.resolve_moves()), set([a, c]))
+        self.assertEqual(c.environment_positions["env"], (1, 1))
+        self.assertEqual(b.environment_positions["env"], (3, 3))
+        self.assertEqual(env.get_population((1, 1)), 1)
+        self.assertEqual(env.get_population((5, 5)), 0)
+        self.assertEqual(sum(env.occupancy), 3)
+
+        self.assertRaises(ValueError, ObjectGrid2D, "bad", 5, 5, model,
+                          move_policy="oldest")
+
+    def test_synchronous_moves_schedule(self):
+        model = Model(5)
+        ObjectGrid2D("env", 10, 10, model, synchronous_moves=True)
+
+        a = AgentX()
+        a.add_agent_to_grid("env", (1, 1), model)
+        a.step_main = lambda m: a.move_agent("env", (1, 2), m)
+        model.schedule.agents.add(a)
+
+        model.schedule.step_schedule(model)
+
+        self.assertEqual(a.environment_positions["env"], (1, 2))
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_abort_discards_pending_updates(self):
+        model = Model(5)
+        ObjectGrid2D("env", 10, 10, model, synchronous_moves=True)
+        lattice = LatticeGrid2D("lattice", 5, 5, model)
+
+        a = AgentX()
+        a.add_agent_to_grid("env", (1, 1), model)
+
+        def step_main(m):
+            a.move_agent("env", (1, 2), m)
+            lattice.set_value((2, 2), 1)
+            m.abort("done")
+
+        a.step_main = step_main
+        model.schedule.agents.add(a)
+
+        model.schedule.step_schedule(model)
+
+        self.assertTrue(model.exit)
+        self.assertEqual(a.environment_positions["env"], (1, 1))
+        self.assertEqual(model.environments["env"].move_intents, [])
+        self.assertEqual(lattice.next.sum(), 0)
+
+    # Tests for lattice grids
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_lattice_double_buffering(self):
+        model = Model(5)
+        env = LatticeGrid2D("env", 5, 5, model, fill=1)
+
+        env.set_value((1, 1), 7)
+
+        self.assertEqual(env.get_value((1, 1)), 1)
+        self.assertEqual(env.next[1, 1], 7)
+
+        env.swap()
+
+        self.assertEqual(env.get_value((1, 1)), 7)
+        self.assertEqual(env.next[1, 1], 7)
+        self.assertEqual(env.current.sum(), 31)
+
+        # Positions outside a clipped lattice do not wrap around
+        self.assertFalse(env.set_value((-1, 0), 3))
+        self.assertEqual(env.next[4, 0], 1)
+        self.assertRaises(ValueError, env.get_value, (0, -1))
+
+        wrapped = LatticeGrid2D("wrapped", 5, 5, model, boundary="wrap")
+        self.assertTrue(wrapped.set_value((-1, 0), 3))
+        self.assertEqual(wrapped.next[4, 0], 3)
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_lattice_blinker(self):
+        model = Model(5)
+        env = LatticeGrid3D("env", 5, 5, 1, model)
+
+        for y in (1, 2, 3):
+            env.current[2, y, 0] = 1
+
+        def rule(lattice, model):
+            count = lattice.get_neigh_map("sum")
+            alive = lattice.current == 1
+            return (alive & ((count == 2) | (count == 3))) | \
+                (~alive & (count == 3))
+
+        env.add_rule(rule)
+        model.schedule.step_schedule(model)
+
+        self.assertEqual(sorted(zip(*np.nonzero(env.current[:, :, 0]))),
+                         [(1, 2), (2, 2), (3, 2)])
+
+        model.schedule.step_schedule(model)
+
+        self.assertEqual(sorted(zip(*np.nonzero(env.current[:, :, 0]))),
+                         [(2, 1), (2, 2), (2, 3)])
+
+    # Tests for coarse numerical grids
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_restrict(self):
+        values = np.arange(20.).reshape(4, 5)
+
+        np.testing.assert_array_equal(restrict(values, (2, 2)),
+                                      [[3., 5., 6.5], [13., 15., 16.5]])
+        np.testing.assert_array_equal(restrict(values, (2, 5), "max"),
+                                      [[9.], [19.]])
+        self.assertRaises(ValueError, restrict, values, (2, 2), "median")
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_coarse_numerical_grid_2d(self):
+        model = Model(5)
+        env = CoarseNumericalGrid2D("oxygen", 8, 6, model, 2)
+
+        self.assertEqual(env.field.shape, (4, 3))
+        self.assertRaises(ValueError, CoarseNumericalGrid2D, "oxygen", 8, 6,
+                          model, (2, 0))
+
+        env.set_from_array(np.arange(48.).reshape(8, 6))
+        self.assertEqual(env.field[0, 0], 3.5)
+
+        # Block centres are half a position away from the positions around
+        # them, values beyond the outermost centres are held constant
+        self.assertEqual(env.get_value((0, 0)), 3.5)
+        self.assertEqual(env.get_value((1, 0)), 0.75 * 3.5 + 0.25 * 15.5)
+        self.assertEqual(env.get_value((1, 1)), 7.)
+
+        positions = np.argwhere(np.ones((8, 6)))
+        values = env.get_values(positions)
+        np.testing.assert_allclose(values.reshape(8, 6), env.to_array())
+        np.testing.assert_allclose(
+            values, [env.get_value(tuple(p)) for p in positions])
+
+        # Deposits outside a clipped grid are dropped
+        env.add_values([(7, 5), (8, 5), (-1, 0)], 4.)
+        env.add_value((0, 6), 4.)
+        self.assertEqual(env.deposits.sum(), 4.)
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_coarse_numerical_grid_deposits(self):
+        model = Model(5)
+        env = CoarseNumericalGrid3D("food", 6, 4, 4, model, 2,
+                                    boundary="wrap")
+        readings = []
+
+        def decay(grid, model):
+            readings.append(grid.field.sum())
+            return grid.field * 0.5
+
+        env.add_rule(decay)
+        env.add_value((0, 0, 0), 8)
+        env.add_value((-1, 0, 0), 2)
+        env.add_values([(1, 1, 1), (3, 3, 3)], [8, 16])
+
+        # Deposits are only applied at the end of the main phase
+        self.assertEqual(env.field.sum(), 0)
+        model.schedule.step_schedule(model)
+
+        self.assertEqual(readings, [8 / 8. + 16 / 8. + 8 / 8. + 2 / 8.])
+        self.assertEqual(env.field[0, 0, 0], 1)
+        self.assertEqual(env.field[2, 0, 0], 0.125)
+        self.assertEqual((env.field * env.block_sizes).sum(), 17)
+
+        # Blocks must tile grids which wrap or reflect their boundaries
+        for boundary in ("wrap", "reflect"):
+            self.assertRaises(ValueError, CoarseNumericalGrid3D, "food", 5,
+                              4, 4, model, 2, boundary=boundary)
+
+    # Tests for boundary modes
+    def test_unknown_boundary(self):
+        model = Model(5)
+        self.assertRaises(ValueError, ObjectGrid2D, "env", 10, 10, model,
+                          "bounce")
+
+    def test_wrap_2d_neighbourhood(self):
+        model = Model(5)
+        env = NumericalGrid2D("env", 10, 12, model, boundary="wrap")
+
+        neigh = env.get_moore_neighbourhood((0, 0))
+
+        self.assertEqual(sorted(neigh), sorted([
+            (1, 11), (1, 0), (1, 1), (0, 11), (0, 1), (9, 11), (9, 0),
+            (9, 1)]))
+
+    def test_wrap_3d_neighbourhood_small_grid(self):
+        model = Model(5)
+        env = NumericalGrid3D("env", 2, 3, 3, model, boundary="wrap")
+
+        neigh = env.get_moore_neighbourhood((0, 0, 0))
+
+        # Along the x-axis both neighbours are the same position
+        self.assertEqual(len(neigh), 17)
+        self.assertEqual(len(set(neigh)), 17)
+        self.assertTrue((0, 0, 0) not in neigh)
+
+    def test_reflect_2d_neighbourhood(self):
+        model = Model(5)
+        env = NumericalGrid2D("env", 10, 10, model, boundary="reflect")
+
+        self.assertEqual(sorted(env.get_moore_neighbourhood((0, 0))),
+                         [(0, 1), (1, 0), (1, 1)])
+
+    def test_wrap_movement(self):
+        model = Model(5)
+        env = ObjectGrid2D("env", 10, 10, model, boundary="wrap")
+
+        a = AgentX()
+        a.add_agent_to_grid("env", (10, -1), model)
+        self.assertEqual(a.environment_positions["env"], (0, 9))
+
+        a.move_agent("env", (-2, 23), model)
+        self.assertEqual(a.environment_positions["env"], (8, 3))
+        self.assertEqual(list(env.grid.keys()), [(8, 3)])
+
+    def test_reflect_movement(self):
+        model = Model(5)
+        env = ObjectGrid3D("env", 10, 10, 10, model, boundary="reflect")
+
+        a = AgentX()
+        a.add_agent_to_grid("env", (-1, 10, 12), model)
+        self.assertEqual(a.environment_positions["env"], (0, 9, 7))
+        self.assertEqual(list(env.grid.keys()), [(0, 9, 7)])
+
+    def test_clip_movement(self):
+        model = Model(5)
+        env = ObjectGrid2D("env", 10, 10, model)
+
+        a = AgentX()
+        a.add_agent_to_grid("env", (5, 5), model)
+        a.move_agent("env", (10, 5), model)
+        self.assertEqual(a.environment_positions["env"], (5, 5))
+        self.assertEqual(list(env.grid.keys()), [(5, 5)])
+
+    # Tests for stencil neighbourhoods
+    def test_stencil_shapes(self):
+        self.assertEqual(len(Stencil.moore(2)), 8)
+        self.assertEqual(len(Stencil.moore(3)), 26)
+        self.assertEqual(len(Stencil.moore(2, radius=2)), 24)
+        self.assertEqual(len(Stencil.von_neumann(2)), 4)
+        self.assertEqual(len(Stencil.von_neumann(2, radius=2)), 12)
+        self.assertEqual(len(Stencil.von_neumann(3)), 6)
+        self.assertEqual(Stencil.moore(3, radius=2).reach, 2)
+        self.assertTrue(Stencil.von_neumann(2) is Stencil.von_neumann(2))
+        self.assertEqual(len(Stencil([(0, 1), (0, 1), (1, 0)])), 2)
+        self.assertRaises(ValueError, Stencil, [(0, 1), (0, 1, 1)])
+
+    def test_von_neumann_neighbourhood(self):
+        model = Model(5)
+        env = NumericalGrid2D("env", 10, 10, model)
+        stencil = Stencil.von_neumann(2)
+
+        self.assertEqual(sorted(env.get_neighbourhood((5, 5), stencil)),
+                         [(4, 5), (5, 4), (5, 6), (6, 5)])
+        self.assertEqual(sorted(env.get_neighbourhood((0, 0), stencil)),
+                         [(0, 1), (1, 0)])
+
+    def test_radius_neighbourhood_edges(self):
+        model = Model(5)
+        env = NumericalGrid3D("env", 10, 10, 10, model)
+        stencil = Stencil.moore(3, radius=2)
+
+        self.assertEqual(len(env.get_neighbourhood((5, 5, 5), stencil)),
+                         124)
+        self.assertEqual(len(env.get_neighbourhood((0, 0, 0), stencil)),
+                         26)
+
+        wrapped = NumericalGrid3D("wrapped", 10, 10, 10, model,
+                                  boundary="wrap")
+        self.assertEqual(len(wrapped.get_neighbourhood((0, 0, 0), stencil)),
+                         124)
+
+    def test_custom_stencil_and_flat_indices(self):
+        model = Model(5)
+        env = NumericalGrid2D("env", 10, 20, model)
+        stencil = Stencil([(0, 0), (2, 0), (0, -3)])
+
+        neigh = env.get_neighbourhood((1, 2), stencil, shuffle_neigh=False,
+                                      flat=True)
+        self.assertEqual(neigh, [22, 62])
+        self.assertEqual([env.from_index(i) for i in neigh],
+                         [(1, 2), (3, 2)])
+
+    def test_index_round_trip_3d(self):
+        model = Model(5)
+        env = NumericalGrid3D("env", 4, 5, 6, model)
+
+        indices = [env.to_index((x, y, z)) for x in range(4)
+                   for y in range(5) for z in range(6)]
+        self.assertEqual(indices, list(range(4 * 5 * 6)))
+        self.assertEqual(env.from_index(env.to_index((3, 1, 4))), (3, 1, 4))
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_position_arrays(self):
+        model = Model(5)
+        env = NumericalGrid3D("env", 4, 5, 6, model)
+        positions = [(0, 0, 0), (3, 4, 5), (4, 0, 0), (1, -1, 2)]
+
+        self.assertEqual(env.valid_positions(positions).tolist(),
+                         [env.valid_position(p) for p in positions])
+        self.assertEqual(env.valid_positions([]).tolist(), [])
+
+        valid = positions[:2]
+        indices = env.to_indices(valid)
+        self.assertEqual(indices.tolist(), [env.to_index(p) for p in valid])
+        self.assertEqual(env.from_indices(indices).tolist(),
+                         [list(p) for p in valid])
+        self.assertRaises(ValueError, env.to_indices, positions)
+
+        wrapped = ObjectGrid2D("wrapped", 4, 5, model, boundary="wrap")
+        reflected = ObjectGrid2D("reflected", 4, 5, model,
+                                 boundary="reflect")
+        positions = [(-1, 2), (4, 6), (2, 3)]
+
+        for grid in (wrapped, reflected):
+            self.assertEqual(
+                [tuple(p) for p in grid.normalize_positions(positions)],
+                [grid.normalize_position(p) for p in positions])
+
+        clipped = ObjectGrid2D("clipped", 4, 5, model)
+        self.assertEqual(clipped.normalize_positions(positions).tolist(),
+                         [list(p) for p in positions])
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_chunked_numerical_grid_3d(self):
+        model = Model(5)
+        env = NumericalGrid3D("chunked", 2000, 2000, 2000, model,
+                              chunk_size=8)
+
+        env.grid[(1000, 1000, 1000)] = 3
+        env.grid[(1000, 1001, 1000)] = 5
+
+        self.assertEqual(env.grid[(0, 0, 0)], 0)
+        self.assertEqual(env.get_max_in_neigh((1000, 1000, 1001)),
+                         (1000, 1001, 1000))
+        self.assertEqual(env.grid.statistics()["chunks"], 1)
+
+        small = NumericalGrid3D("chunkedSmall", 5, 6, 7, model, chunk_size=4)
+        small.grid[(4, 5, 6)] = 2
+        self.assertEqual(small.to_array()[4, 5, 6], 2)
+        self.assertEqual(small.to_array().sum(), 2)
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_mapped_numerical_grid(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "oxygen.npy")
+        checkpoint = os.path.join(directory, "model.checkpoint")
+
+        try:
+            model = Model(5, checkpoint_path=checkpoint)
+            env = NumericalGrid3D("mapped", 20, 20, 20, model,
+                                  storage_path=path)
+            env.grid[(1, 2, 3)] = 4
+            env.grid[(1, 2, 4)] = 6
+
+            self.assertEqual(env.get_max_in_neigh((1, 2, 3)), (1, 2, 4))
+            self.assertEqual(env.to_array().sum(), 10)
+
+            model.save_checkpoint()
+            self.assertTrue(os.path.exists(checkpoint + ".0.0.npy"))
+
+            # The checkpoint keeps the values it was saved with
+            env.grid[(1, 2, 4)] = 99
+            restored = Model.load_checkpoint(checkpoint)
+            grid = restored.environments["mapped"].grid
+
+            self.assertEqual(grid.path, env.grid.path)
+            self.assertEqual(grid[(1, 2, 4)], 6)
+            self.assertEqual(env.grid[(1, 2, 4)], 6)
+
+            # Copies of earlier checkpoints are removed
+            model.current_epoch = 2
+            model.save_checkpoint()
+            self.assertFalse(os.path.exists(checkpoint + ".0.0.npy"))
+            self.assertTrue(os.path.exists(checkpoint + ".2.0.npy"))
+
+            replicate = NumericalGrid3D("mapped", 20, 20, 20, Model(5),
+                                        storage_path=path, storage_mode="r")
+            self.assertEqual(replicate.grid[(1, 2, 3)], 4)
+        finally:
+            shutil.rmtree(directory)
+
+    @unittest.skipIf(np is None or shared_memory is None,
+                     "requires NumPy and Python 3.8+")
+    def test_shared_numerical_grid(self):
+        env = NumericalGrid2D("vessels", 10, 10, Model(5))
+        env.grid[(4, 4)] = 3
+        env.grid[(4, 5)] = 8
+        handle = env.share()
+
+        try:
+            replicate = NumericalGrid2D("vessels", 10, 10, Model(5),
+                                        shared_handle=handle)
+            self.assertTrue(replicate.grid.shared)
+            self.assertEqual(replicate.get_max_in_neigh((4, 4)), (4, 5))
+            self.assertEqual(
+                replicate.reduce_neigh_batch([(4, 4)], "sum").tolist(), [8])
+
+            replicate.grid[(4, 5)] = 0
+            self.assertFalse(replicate.grid.shared)
+            self.assertEqual(env.grid[(4, 5)], 8)
+
+            self.assertRaises(ValueError, NumericalGrid3D, "vessels", 10, 10,
+                              10, Model(5), shared_handle=handle)
+        finally:
+            env.grid.release()
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_chunked_object_grid_3d(self):
+        model = Model(5)
+        env = ObjectGrid3D("chunked", 2000, 2000, 2000, model, capacity=1,
+                           chunk_size=8)
+
+        agents = [AgentX() for _ in range(3)]
+        added = add_agents_to_grid(agents, "chunked",
+                                   [(5, 5, 5), (5, 5, 5), (1999, 0, 0)],
+                                   model)
+
+        self.assertEqual(added, 2)
+        self.assertEqual(env.get_population((5, 5, 5)), 1)
+        self.assertEqual(env.occupancy.statistics()["chunks"], 2)
+
+        agents[0].move_agent("chunked", (5, 5, 6), model)
+        self.assertEqual(env.get_population((5, 5, 5)), 0)
+        self.assertEqual(env.get_empty_neighbour((5, 5, 5),
+                                                 Stencil([(0, 0, 1)])), None)
+
+        agents[2].remove_agent_from_grid("chunked", model)
+        self.assertEqual(env.occupancy.statistics()["chunks"], 1)
+
+        small = ObjectGrid3D("chunkedSmall", 3, 3, 3, model, chunk_size=2)
+        AgentX().add_agent_to_grid("chunkedSmall", (2, 2, 2), model)
+        self.assertEqual(small.get_occupancy_map()[2, 2, 2], 1)
+
+    def test_large_object_grid_occupancy(self):
+        model = Model(5)
+        env = ObjectGrid2D("large", 3000, 3000, model)
+
+        if np is None:
+            self.assertIsNone(env.occupancy)
+        else:
+            self.assertEqual(env.occupancy.statistics()["chunks"], 0)
+
+        AgentX().add_agent_to_grid("large", (2999, 0), model)
+        self.assertEqual(env.get_population((2999, 0)), 1)
+        self.assertEqual(env.get_population((0, 0)), 0)
+
+        dense = ObjectGrid2D("dense", 3000, 3000, model,
+                             track_occupancy="dense")
+        self.assertEqual(len(dense.occupancy), 3000 * 3000)
+
+        small = ObjectGrid2D("small", 10, 10, model)
+        self.assertEqual(len(small.occupancy), 100)
+
+    def test_reductions_with_stencil(self):
+        model = Model(5)
+        grid = NumericalGrid2D("env", 10, 10, model)
+        grid.grid[(7, 5)] = 5
+        grid.grid[(4, 4)] = 3
+
+        stencil = Stencil.von_neumann(2, radius=2)
+        self.assertEqual(grid.get_max_in_neigh((5, 5), stencil), (7, 5))
+        self.assertEqual(grid.get_max_in_neigh((5, 5)), (4, 4))
+
+        objects = ObjectGrid2D("objects", 10, 10, model)
+        a = AgentX()
+        a.add_agent_to_grid("objects", (5, 8), model)
+        self.assertEqual(objects.get_most_populated_moore_neigh(
+            (5, 5), Stencil.moore(2, radius=3)), (5, 8))
+
+    # Tests for batched neighbourhood reductions
+    def _random_numerical_grid(self, model, boundary="clip"):
+        rng = Random(7)
+        grid = NumericalGrid2D("env_" + boundary, 12, 9, model,
+                               boundary=boundary)
+
+        for x in range(12):
+            for y in range(9):
+                grid.grid[(x, y)] = rng.random()
+
+        return grid
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_to_array(self):
+        model = Model(5)
+        grid = NumericalGrid3D("env", 3, 4, 5, model)
+        grid.grid[(1, 2, 3)] = 7
+
+        values = grid.to_array()
+        self.assertEqual(values.shape, (3, 4, 5))
+        self.assertEqual(values[1, 2, 3], 7)
+        self.assertEqual(values.sum(), 7)
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_batch_arg_matches_scalar(self):
+        model = Model(5)
+
+        for boundary in ("clip", "wrap"):
+            grid = self._random_numerical_grid(model, boundary)
+            positions = [(x, y) for x in range(12) for y in range(9)]
+
+            maxima = grid.get_max_in_neigh_batch(positions)
+            minima = grid.get_least_in_neigh_batch(positions)
+
+            for p, mx, mn in zip(positions, maxima, minima):
+                self.assertEqual(tuple(mx), grid.get_max_in_neigh(p))
+                self.assertEqual(tuple(mn), grid.get_least_in_neigh(p))
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_batch_reductions(self):
+        model = Model(5)
+        grid = self._random_numerical_grid(model)
+        stencil = Stencil.von_neumann(2, radius=2)
+        positions = np.array([(0, 0), (5, 5), (11, 8), (40, 40)])
+
+        sums = grid.reduce_neigh_batch(positions, "sum", stencil)
+        means = grid.reduce_neigh_batch(positions, "mean", stencil)
+        maxima = grid.reduce_neigh_batch(positions, "max", stencil)
+
+        for i, p in enumerate(positions[:3]):
+            neigh = grid.get_neighbourhood(tuple(p), stencil)
+            values = [grid.grid[n] for n in neigh]
+            self.assertAlmostEqual(sums[i], sum(values))
+            self.assertAlmostEqual(means[i], sum(values) / len(values))
+            self.assertAlmostEqual(maxima[i], max(values))
+
+        self.assertEqual(sums[3], 0)
+        self.assertTrue(np.isnan(maxima[3]))
+        self.assertEqual(list(grid.get_max_in_neigh_batch([(40, 40)])[0]),
+                         [-1, -1])
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_neigh_maps(self):
+        model = Model(5)
+
+        for boundary in ("clip", "wrap"):
+            grid = self._random_numerical_grid(model, boundary)
+            values = grid.to_array()
+            max_map = grid.get_neigh_max_map(values=values)
+            min_map = grid.get_neigh_min_map(values=values)
+            mean_map = grid.get_neigh_map("mean", values=values)
+
+            for x in range(12):
+                for y in range(9):
+                    neigh = [grid.grid[n]
+                             for n in grid.get_moore_neighbourhood((x, y))]
+                    self.assertAlmostEqual(max_map[x, y], max(neigh))
+                    self.assertAlmostEqual(min_map[x, y], min(neigh))
+                    self.assertAlmostEqual(mean_map[x, y],
+                                           sum(neigh) / len(neigh))
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_batch_matches_scalar_at_reflected_and_wrapped_edges(self):
+        model = Model(5)
+        rng = Random(3)
+        grids = [NumericalGrid2D("reflect", 6, 5, model, boundary="reflect"),
+                 NumericalGrid2D("wrap", 3, 2, model, boundary="wrap")]
+
+        for grid in grids:
+            size = grid._size
+            for x in range(size[0]):
+                for y in range(size[1]):
+                    grid.grid[(x, y)] = rng.random()
+
+            positions = [(x, y) for x in range(size[0])
+                         for y in range(size[1])]
+
+            for stencil in (Stencil.moore(2), Stencil.moore(2, radius=2)):
+                sums = grid.reduce_neigh_batch(positions, "sum", stencil)
+                sum_map = grid.get_neigh_map("sum", stencil)
+                maxima = grid.get_max_in_neigh_batch(positions, stencil)
+
+                for i, p in enumerate(positions):
+                    neigh = grid.get_neighbourhood(p, stencil)
+                    total = sum(grid.grid[n] for n in neigh)
+                    self.assertAlmostEqual(sums[i], total)
+                    self.assertAlmostEqual(sum_map[p], total)
+                    self.assertEqual(tuple(maxima[i]),
+                                     grid.get_max_in_neigh(p, stencil))
+
+        # The position itself is not its own neighbour
+        grid = NumericalGrid2D("centre", 5, 5, model, boundary="reflect")
+        grid.grid[(0, 0)] = 10
+        grid.grid[(1, 1)] = 1
+
+        self.assertEqual(grid.get_max_in_neigh_batch([(0, 0)]).tolist(),
+                         [[1, 1]])
+        self.assertEqual(grid.reduce_neigh_batch([(0, 0)], "sum")[0], 1)
+        self.assertEqual(grid.get_neigh_map("sum")[0, 0], 1)
+
+    # Tests for continuous spaces
+    def test_continuous_space_2d_agents(self):
+        model = Model(5)
+        env = ContinuousSpace2D("space", 10., 10., model, cell_size=2.)
+
+        a = AgentX()
+        a.add_agent_to_grid("space", (1.5, 2.25), model)
+
+        self.assertEqual(env.positions[a], (1.5, 2.25))
+        self.assertEqual(a.environment_positions["space"], (1.5, 2.25))
+
+        a.move_agent("space", (9.75, 0.5), model)
+        self.assertEqual(env.positions[a], (9.75, 0.5))
+        self.assertEqual(list(env.cells.keys()), [(4, 0)])
+
+        a.move_agent("space", (10.5, 0.5), model)
+        self.assertEqual(a.environment_positions["space"], (9.75, 0.5))
+
+        a.remove_agent_from_grid("space", model)
+        self.assertEqual(len(env.positions), 0)
+        self.assertEqual(len(env.cells), 0)
+
+    def test_continuous_space_radius_query(self):
+        model = Model(5)
+        env = ContinuousSpace3D("space", 20., 20., 20., model, cell_size=1.5)
+        rng = Random(3)
+
+        agents = []
+        for _ in range(300):
+            a = AgentX()
+            a.add_agent_to_grid("space", (rng.uniform(0, 20),
+                                          rng.uniform(0, 20),
+                                          rng.uniform(0, 20)), model)
+            agents.append(a)
+
+        queries = [(rng.uniform(0, 20), rng.uniform(0, 20),
+                    rng.uniform(0, 20)) for _ in range(20)]
+        results = env.get_agents_in_radius_bulk(queries, 4.)
+
+        for query, found in zip(queries, results):
+            expected = set([a for a in agents if math.sqrt(sum(
+                (p - q) ** 2 for p, q in zip(env.positions[a], query)))
+                <= 4.])
+            self.assertEqual(set(found), expected)
+
+    def test_continuous_space_nearest_query(self):
+        model = Model(5)
+        env = ContinuousSpace2D("space", 50., 50., model)
+        rng = Random(5)
+
+        agents = []
+        for _ in range(100):
+            a = AgentX()
+            a.add_agent_to_grid("space", (rng.uniform(0, 50),
+                                          rng.uniform(0, 50)), model)
+            agents.append(a)
+
+        me = agents[0]
+        nearest = env.get_nearest_agents(me.environment_positions["space"],
+                                         k=3, exclude=me)
+        distances = sorted(math.sqrt(sum(
+            (p - q) ** 2 for p, q in zip(env.positions[a],
+                                         env.positions[me])))
+            for a in agents[1:])
+
+        self.assertEqual(len(nearest), 3)
+        self.assertTrue(me not in [n[1] for n in nearest])
+        for (d, _), expected in zip(nearest, distances[:3]):
+            self.assertAlmostEqual(d, expected)
+
+        self.assertEqual(len(env.get_nearest_agents((0., 0.), k=500)), 100)
+
 
 if __name__ == '__main__':
     unittest.main()
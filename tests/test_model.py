@@ -1,7 +1,13 @@
+import gc
+import os
+import random
+import shutil
+import tempfile
 import unittest
 
 from panaxea.core.Model import Model
-from tests.resources.SampleSteppables import SimpleAgent, SimpleHelper
+from tests.resources.SampleSteppables import CheckpointHelper, \
+    RandomAgent, SimpleAgent, SimpleHelper
 
 
 class TestModel(unittest.TestCase):
@@ -43,6 +49,153 @@ class TestModel(unittest.TestCase):
         model.properties['a'] = 'b'
         self.assertEqual(model.properties['a'], 'b')
 
+    def test_stop_condition(self):
+        model = Model(10)
+        agent = SimpleAgent()
+        model.schedule.agents.add(agent)
+
+        model.add_stop_condition(lambda m: agent.a >= 3, "a reached 3")
+        model.run()
+
+        self.assertEqual(agent.a, 3)
+        self.assertEqual(model.current_epoch, 2)
+        self.assertTrue(model.exit)
+        self.assertEqual(model.stop_reason, "a reached 3")
+
+    def test_stop_condition_skips_phases(self):
+        model = Model(10)
+        helper = SimpleHelper()
+        agent = SimpleAgent()
+        model.schedule.agents.add(agent)
+        model.schedule.helpers.append(helper)
+
+        # Checked after the mains, so the helper's epilogue never runs
+        model.add_stop_condition(lambda m: agent.a == 1)
+        model.run()
+
+        self.assertEqual(agent.a, 1)
+        self.assertEqual(model.current_epoch, 0)
+
+    def test_exit_flag_completes_epoch(self):
+        model = Model(10)
+        helper = SimpleHelper()
+        agent = SimpleAgent()
+        model.schedule.agents.add(agent)
+        model.schedule.helpers.append(helper)
+
+        def step_main(m):
+            m.exit = True
+
+        # Older models set the exit flag directly; the epilogues still run
+        helper.step_main = step_main
+        model.run()
+
+        self.assertEqual(agent.a, 2)
+        self.assertEqual(model.current_epoch, 0)
+        self.assertTrue(model.exit)
+
+    def test_abort(self):
+        model = Model(10)
+        agents = [SimpleAgent() for _ in range(5)]
+        helper = SimpleHelper()
+        model.schedule.add_agents(agents, immediate=True)
+        model.schedule.helpers.append(helper)
+
+        def step_main(m):
+            m.abort("done")
+
+        helper.step_main = step_main
+        model.run()
+
+        # Helpers are stepped before agents, so no agent is stepped
+        self.assertEqual([a.a for a in agents], [0] * 5)
+        self.assertEqual(model.current_epoch, 0)
+        self.assertEqual(model.stop_reason, "done")
+
+    def test_pause_gc(self):
+        model = Model(3, pause_gc=True)
+        collected = []
+
+        helper = SimpleHelper()
+        helper.step_main = lambda m: collected.append(gc.isenabled())
+        model.schedule.helpers.append(helper)
+
+        enabled = gc.isenabled()
+        model.run()
+
+        self.assertEqual(collected, [False] * 3)
+        self.assertEqual(gc.isenabled(), enabled)
+
+    def test_checkpoint_requires_path(self):
+        directory = tempfile.mkdtemp()
+        cwd = os.getcwd()
+
+        try:
+            os.chdir(directory)
+            self.assertRaises(ValueError, Model(5).save_checkpoint)
+            self.assertEqual(os.listdir(directory), [])
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(directory)
+
+    def test_checkpoint_resume(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "model.checkpoint")
+
+        try:
+            random.seed(1)
+            model = Model(6)
+            model.schedule.agents.add(RandomAgent())
+            model.run()
+            expected = model.schedule.agents.pop().draws
+
+            # The run is interrupted after 4 epochs, checkpointing every 2
+            random.seed(1)
+            model = Model(4, checkpoint_path=path, checkpoint_every=2)
+            model.schedule.agents.add(RandomAgent())
+            model.schedule.agents_to_schedule.add(SimpleAgent())
+            model.run()
+
+            random.seed(2)
+            model = Model.load_checkpoint(path)
+
+            self.assertEqual(model.current_epoch, 3)
+            self.assertEqual(len(model.schedule.agents), 2)
+            self.assertFalse(os.path.exists(path + ".tmp"))
+
+            model.epochs = 6
+            model.run()
+
+            agent = [a for a in model.schedule.agents
+                     if isinstance(a, RandomAgent)][0]
+            self.assertEqual(agent.draws, expected)
+            self.assertEqual(model.current_epoch, 5)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_manual_checkpoint_resume(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "model.checkpoint")
+
+        try:
+            model = Model(5)
+            agent = SimpleAgent()
+            model.schedule.agents.add(agent)
+            model.schedule.helpers.append(CheckpointHelper(path, 2))
+            model.run()
+            self.assertEqual(agent.a, 5)
+
+            # Saved from an epilogue, so the run resumes at the next epoch
+            model = Model.load_checkpoint(path)
+            self.assertEqual(model.current_epoch, 2)
+            self.assertEqual(model.start_epoch, 3)
+
+            model.run()
+            self.assertEqual(model.schedule.agents.pop().a, 5)
+            self.assertEqual(model.current_epoch, 4)
+        finally:
+            shutil.rmtree(directory)
+
 
 if __name__ == '__main__':
     unittest.main()
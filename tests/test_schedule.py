@@ -1,7 +1,10 @@
 import unittest
 
+from panaxea.core.Environment import ObjectGrid2D
 from panaxea.core.Model import Model
-from tests.resources.SampleSteppables import SampleAgent, SampleHelper
+from panaxea.core.Schedule import AgentPool, Schedule
+from tests.resources.SampleSteppables import CompactAgentX, SampleAgent, \
+    SampleHelper, SimpleAgent
 
 
 class TestSchedule(unittest.TestCase):
@@ -82,6 +85,64 @@ class TestSchedule(unittest.TestCase):
         agent.environment_positions["a"] = "b"
         self.assertEqual("b", agent.environment_positions["a"])
 
+    def test_add_agents(self):
+        model = Model(5)
+
+        agents = [SampleAgent() for _ in range(3)]
+        model.schedule.add_agents(agents)
+
+        self.assertEqual(0, len(model.schedule.agents))
+        self.assertEqual(3, len(model.schedule.agents_to_schedule))
+
+        model.schedule.add_agents([SampleAgent()], immediate=True)
+        self.assertEqual(1, len(model.schedule.agents))
+
+        model.schedule.step_schedule(model)
+        self.assertEqual(4, len(model.schedule.agents))
+
+    def test_agent_pool(self):
+        pool = AgentPool(max_size=1)
+        agents = [SimpleAgent() for _ in range(2)]
+        agents[0].a = 5
+
+        pool.release(agents)
+        self.assertEqual(len(pool), 1)
+
+        agent = pool.acquire(SimpleAgent)
+        self.assertIs(agent, agents[0])
+        self.assertEqual(agent.a, 0)
+        self.assertEqual(len(pool), 0)
+
+        self.assertIsNot(pool.acquire(SimpleAgent), agents[0])
+        self.assertEqual((pool.created, pool.recycled), (1, 1))
+
+    def test_spawn_recycles_removed_agents(self):
+        model = Model(5)
+        model.schedule = Schedule(pool=AgentPool())
+        env = ObjectGrid2D("poolGrid", 5, 5, model)
+
+        agents = [model.schedule.spawn(CompactAgentX) for _ in range(3)]
+        agents[0].flag = "dead"
+        agents[0].add_agent_to_grid("poolGrid", (1, 1), model)
+        model.schedule.step_schedule(model)
+
+        agents[0].remove_agent(model)
+
+        # An agent removed before joining the schedule is not pooled
+        unscheduled = model.schedule.spawn(CompactAgentX)
+        model.schedule.agents_to_remove.add(unscheduled)
+        model.schedule.step_schedule(model)
+
+        self.assertEqual(len(model.schedule.pool), 1)
+        self.assertEqual(len(env.grid[(1, 1)]), 0)
+
+        agent = model.schedule.spawn(CompactAgentX)
+
+        self.assertIs(agent, agents[0])
+        self.assertIsNone(agent.flag)
+        self.assertEqual(len(agent.environment_positions), 0)
+        self.assertIn(agent, model.schedule.agents_to_schedule)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,8 +1,12 @@
+import pickle
 import unittest
 
 from panaxea.core.Environment import ObjectGrid2D, ObjectGrid3D
 from panaxea.core.Model import Model
-from tests.resources.SampleSteppables import AgentX, SimpleAgent
+from panaxea.core.Steppables import EnvironmentHandle, add_agents_to_grid, \
+    environment_slot
+from tests.resources.SampleSteppables import AgentX, CompactAgentX, \
+    SimpleAgent
 
 
 class TestSteppables(unittest.TestCase):
@@ -60,6 +64,10 @@ class TestSteppables(unittest.TestCase):
         self.assertEqual(0, env.grid[pos].__len__())
         self.assertIsNone(a.environment_positions[grid_name])
 
+        # Removing an agent which is no longer in the grid is void
+        a.remove_agent_from_grid(grid_name, model)
+        self.assertIsNone(a.environment_positions[grid_name])
+
     def test_remove_agent_grid_2d(self):
         model = Model(5)
 
@@ -257,3 +265,215 @@ class TestSteppables(unittest.TestCase):
         self.assertEqual(agent.environment_positions[grid_name], position)
         self.assertEqual(model.environments[grid_name].grid[position].pop(),
                          agent)
+
+    def test_add_agents_to_grid(self):
+        model = Model(5)
+        grid_name = "bulkGrid"
+
+        env = ObjectGrid2D(grid_name, 10, 10, model, boundary="wrap")
+
+        agents = [AgentX() for _ in range(4)]
+        positions = [(1, 1), (1, 1), (-1, 3), (4, 5)]
+
+        added = add_agents_to_grid(agents, grid_name, positions, model)
+
+        self.assertEqual(added, 4)
+        self.assertEqual(agents[2].environment_positions[grid_name], (9, 3))
+        self.assertEqual(env.get_population((1, 1)), 2)
+        self.assertEqual(env.grid[(9, 3)], set([agents[2]]))
+        self.assertEqual(sum(env.occupancy), 4)
+
+    def test_add_agents_to_grid_invalid_and_full(self):
+        model = Model(5)
+        grid_name = "bulkGridB"
+
+        env = ObjectGrid3D(grid_name, 5, 5, 5, model, capacity=1)
+
+        agents = [AgentX() for _ in range(3)]
+        positions = [(1, 1, 1), (1, 1, 1), (1, 1, 7)]
+
+        added = add_agents_to_grid(agents, grid_name, positions, model)
+
+        self.assertEqual(added, 1)
+        self.assertEqual(agents[0].environment_positions[grid_name],
+                         (1, 1, 1))
+        self.assertEqual(len(agents[1].environment_positions), 0)
+        self.assertEqual(len(agents[2].environment_positions), 0)
+        self.assertEqual(sum(env.occupancy), 1)
+
+        self.assertRaises(ValueError, env.add_agents, agents, [(0, 0, 0)])
+
+    # Tests for CompactAgent
+
+    def test_compact_agent_has_no_dict(self):
+        agent = CompactAgentX()
+
+        self.assertFalse(hasattr(agent, "__dict__"))
+        self.assertRaises(AttributeError, setattr, agent, "other", 1)
+
+    def test_compact_agent_add_move_remove(self):
+        model = Model(5)
+        grid_name = "compactGridA"
+        grid_name_b = "compactGridB"
+
+        env = ObjectGrid2D(grid_name, 20, 20, model)
+        env_b = ObjectGrid3D(grid_name_b, 5, 5, 5, model)
+
+        agent = CompactAgentX()
+        agent.add_agent_to_grid(grid_name, (5, 6), model)
+        agent.add_agent_to_grid(grid_name_b, (1, 2, 3), model)
+        model.schedule.agents.add(agent)
+
+        self.assertEqual(agent.get_position(grid_name), (5, 6))
+        self.assertEqual(dict(agent.environment_positions),
+                         {grid_name: (5, 6), grid_name_b: (1, 2, 3)})
+
+        agent.move_agent(grid_name, (6, 7), model)
+        agent.move_agent(grid_name, (50, 55), model)
+
+        self.assertEqual(agent.environment_positions[grid_name], (6, 7))
+        self.assertEqual(env.grid[(6, 7)], set([agent]))
+        self.assertEqual(len(env.grid[(5, 6)]), 0)
+
+        agent.remove_agent_from_grid(grid_name, model)
+
+        self.assertIsNone(agent.environment_positions[grid_name])
+        self.assertEqual(len(env.grid[(6, 7)]), 0)
+
+        agent.remove_agent(model)
+
+        self.assertIsNone(agent.get_position(grid_name_b))
+        self.assertEqual(len(env_b.grid[(1, 2, 3)]), 0)
+        self.assertEqual(agent, model.schedule.agents_to_remove.pop())
+
+    def test_compact_agent_positions_view(self):
+        agent = CompactAgentX()
+        positions = agent.environment_positions
+
+        self.assertEqual(len(positions), 0)
+        self.assertRaises(KeyError, lambda: positions["compactGridC"])
+
+        positions["compactGridC"] = (1, 1)
+        self.assertEqual(agent.get_position("compactGridC"), (1, 1))
+        self.assertIn("compactGridC", positions)
+
+        del positions["compactGridC"]
+        self.assertEqual(len(positions), 0)
+        self.assertIsNone(agent.get_position("compactGridC"))
+
+    def test_environment_slots(self):
+        model = Model(5)
+        env = ObjectGrid2D("slotGrid", 5, 5, model)
+        self.assertEqual(env.slot, environment_slot("slotGrid"))
+
+        agent = CompactAgentX()
+        agent.add_agent_to_grid("slotGrid", (1, 2), model)
+        self.assertEqual(agent._positions[env.slot], (1, 2))
+
+        # Slots are resolved again when an environment is unpickled
+        state = pickle.loads(pickle.dumps(env)).__dict__
+        env.slot = -1
+        env.__setstate__(state)
+        self.assertEqual(env.slot, environment_slot("slotGrid"))
+
+    def test_compact_agents_added_in_bulk(self):
+        model = Model(5)
+        grid_name = "compactBulkGrid"
+
+        env = ObjectGrid2D(grid_name, 10, 10, model, capacity=1)
+
+        agents = [CompactAgentX() for _ in range(3)]
+        positions = [(1, 1), (1, 1), (2, 2)]
+
+        self.assertEqual(
+            add_agents_to_grid(agents, grid_name, positions, model), 2)
+        self.assertEqual(agents[2].environment_positions[grid_name], (2, 2))
+        self.assertEqual(len(agents[1].environment_positions), 0)
+        self.assertEqual(sum(env.occupancy), 2)
+
+    def test_compact_agent_synchronous_moves(self):
+        model = Model(5)
+        grid_name = "compactSyncGrid"
+
+        env = ObjectGrid2D(grid_name, 10, 10, model, synchronous_moves=True)
+
+        agent = CompactAgentX()
+        agent.add_agent_to_grid(grid_name, (1, 1), model)
+
+        self.assertTrue(agent.move_agent(grid_name, (2, 2), model))
+        self.assertEqual(agent.get_position(grid_name), (1, 1))
+
+        env.resolve_moves()
+
+        self.assertEqual(agent.get_position(grid_name), (2, 2))
+        self.assertEqual(env.grid[(2, 2)], set([agent]))
+
+    def test_compact_agent_pickle(self):
+        agent = CompactAgentX()
+        agent.flag = "on"
+        agent.environment_positions["compactGridD"] = (3, 4)
+
+        copy = pickle.loads(pickle.dumps(agent))
+
+        self.assertEqual(copy.flag, "on")
+        self.assertEqual(copy.get_position("compactGridD"), (3, 4))
+
+    # Tests for EnvironmentHandle
+
+    def test_environment_handle(self):
+        model = Model(5)
+        grid_name = "handleGrid"
+
+        env = ObjectGrid2D(grid_name, 10, 10, model, boundary="wrap",
+                           capacity=1)
+        grid = EnvironmentHandle(model, grid_name)
+
+        for agent in (AgentX(), CompactAgentX()):
+            self.assertTrue(grid.add(agent, (-1, 2)))
+            self.assertEqual(grid.position(agent), (9, 2))
+            self.assertFalse(grid.add(agent.__class__(), (9, 2)))
+
+            self.assertTrue(grid.move(agent, (10, 3)))
+            self.assertEqual(agent.environment_positions[grid_name], (0, 3))
+
+            grid.move_unchecked(agent, (4, 4))
+            self.assertEqual(grid.position(agent), (4, 4))
+            self.assertEqual(env.grid[(4, 4)], set([agent]))
+            self.assertEqual(env.get_population((0, 3)), 0)
+
+            grid.remove(agent)
+            self.assertIsNone(grid.position(agent))
+            self.assertEqual(sum(env.occupancy), 0)
+
+            # Removing an agent which is not in the environment is void
+            grid.remove(agent)
+            grid.remove(agent.__class__())
+            self.assertIsNone(grid.position(agent))
+
+    def test_environment_handle_unchecked_add(self):
+        model = Model(5)
+        grid_name = "handleGridB"
+
+        env = ObjectGrid3D(grid_name, 5, 5, 5, model)
+        grid = EnvironmentHandle(model, grid_name)
+        agent = SimpleAgent()
+
+        grid.add_unchecked(agent, (1, 2, 3))
+
+        self.assertEqual(agent.get_position(grid_name), (1, 2, 3))
+        self.assertEqual(env.get_population((1, 2, 3)), 1)
+
+    def test_environment_handle_synchronous(self):
+        model = Model(5)
+        grid_name = "handleGridC"
+
+        env = ObjectGrid2D(grid_name, 5, 5, model, synchronous_moves=True)
+        grid = EnvironmentHandle(model, grid_name)
+        agent = AgentX()
+        grid.add(agent, (1, 1))
+
+        grid.move_unchecked(agent, (2, 2))
+        self.assertEqual(grid.position(agent), (1, 1))
+
+        env.resolve_moves()
+        self.assertEqual(grid.position(agent), (2, 2))
@@ -0,0 +1,238 @@
+import gc
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from panaxea.core.Numerics import np
+from panaxea.core.Storage import ChunkedCellStore, MappedCellStore, \
+    SharedCellStore, shared_memory
+
+# Attaches to a shared store from an unrelated process, changes its copy
+# and prints the shared sum
+ATTACH_SCRIPT = """
+import sys
+from panaxea.core.Storage import SharedCellStore
+store = SharedCellStore.attach(eval(sys.argv[1]))
+total = store.array.sum()
+store[(0, 0)] = -100
+print(total)
+"""
+
+
+@unittest.skipIf(np is None, "requires NumPy")
+class TestChunkedCellStore(unittest.TestCase):
+
+    def test_chunks_allocated_on_demand(self):
+        store = ChunkedCellStore((100, 100, 100), chunk_size=10)
+
+        self.assertEqual(store[(5, 5, 5)], 0)
+        self.assertEqual(len(store.chunks), 0)
+
+        store[(5, 5, 5)] = 0
+        self.assertEqual(len(store.chunks), 0)
+
+        store[(5, 5, 5)] = 2.5
+        store[(15, 5, 5)] = 1
+        self.assertEqual(store[(5, 5, 5)], 2.5)
+        self.assertEqual(store[5 * 10000 + 5 * 100 + 5], 2.5)
+        self.assertEqual(len(store.chunks), 2)
+        self.assertEqual(sorted(store), [(5, 5, 5), (15, 5, 5)])
+        self.assertEqual(len(store), 2)
+        self.assertIn((15, 5, 5), store)
+        self.assertIsNone(store.get((1, 1, 1)))
+
+        # Chunks are dropped once they only hold the fill value again
+        store[(15, 5, 5)] = 0
+        del store[(5, 5, 5)]
+        self.assertEqual(len(store.chunks), 0)
+        self.assertRaises(KeyError, store.__delitem__, (5, 5, 5))
+
+    def test_increment_and_add_at(self):
+        store = ChunkedCellStore((20, 20), chunk_size=4, dtype="i")
+
+        store.increment((1, 1))
+        store.increment(21, 2)
+        self.assertEqual(store[(1, 1)], 3)
+
+        store.add_at(np.array([[1, 1], [1, 1], [19, 19]]), -1)
+        self.assertEqual(store[(1, 1)], 1)
+        self.assertEqual(store[(19, 19)], -1)
+
+        store.add_at([[1, 1], [19, 19]], [-1, 1])
+        self.assertEqual(len(store.chunks), 0)
+
+    def test_map_chunks_and_statistics(self):
+        store = ChunkedCellStore((30, 30), chunk_size=10)
+        store[(0, 0)] = 1.
+        store[(0, 1)] = 4.
+        store[(25, 25)] = 0.5
+
+        store.map_chunks(lambda values: np.floor(values / 2))
+
+        self.assertEqual(store[(0, 1)], 2.)
+        self.assertEqual(sorted(store), [(0, 1)])
+
+        statistics = store.statistics()
+        self.assertEqual(statistics["chunks"], 1)
+        self.assertEqual(statistics["chunk_cells"], 100)
+        self.assertEqual(statistics["active_cells"], 1)
+        self.assertEqual(statistics["bytes"], 800)
+        self.assertAlmostEqual(statistics["coverage"], 1. / 9)
+
+        store.chunks[(0, 0)][...] = 0
+        self.assertEqual(store.compact(), 1)
+
+    def test_to_array_and_pickle(self):
+        store = ChunkedCellStore((5, 7), chunk_size=4, fill=-1)
+        store[(4, 6)] = 3
+        store[(0, 0)] = 1
+
+        expected = np.full((5, 7), -1.)
+        expected[4, 6] = 3
+        expected[0, 0] = 1
+        np.testing.assert_array_equal(store.to_array(), expected)
+
+        copy = pickle.loads(pickle.dumps(store))
+        np.testing.assert_array_equal(copy.to_array(), expected)
+
+
+@unittest.skipIf(np is None, "requires NumPy")
+class TestMappedCellStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "field.npy")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_mapping(self):
+        store = MappedCellStore(self.path, (4, 5, 6))
+
+        store[(1, 2, 3)] = 1.5
+        store[3 * 6 + 3] = 2
+
+        self.assertEqual(store[(1, 2, 3)], 1.5)
+        self.assertEqual(store[(0, 3, 3)], 2)
+        self.assertEqual(sorted(store), [(0, 3, 3), (1, 2, 3)])
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.get((0, 0, 0)))
+
+        del store[(0, 3, 3)]
+        self.assertEqual(len(store), 1)
+        self.assertRaises(KeyError, store.__delitem__, (0, 3, 3))
+
+    def test_pickle_reopens_file(self):
+        store = MappedCellStore(self.path, (10, 10), fill=1)
+        store[(3, 4)] = 7
+
+        data = pickle.dumps(store)
+        self.assertLess(len(data), 1000)
+
+        copy = pickle.loads(data)
+        self.assertEqual(copy.mode, "r+")
+        self.assertEqual(copy[(3, 4)], 7)
+        self.assertEqual(copy[(0, 0)], 1)
+        self.assertEqual(len(copy), 1)
+
+    def test_read_only_and_copy_on_write(self):
+        store = MappedCellStore(self.path, (10, 10))
+        store[(1, 1)] = 3
+        store.flush()
+
+        shared = MappedCellStore(self.path, mode="r")
+        self.assertEqual(shared[(1, 1)], 3)
+        self.assertRaises(ValueError, shared.__setitem__, (1, 1), 4)
+
+        private = MappedCellStore(self.path, mode="c")
+        private[(1, 1)] = 4
+        self.assertEqual(store[(1, 1)], 3)
+
+        # Changes to a copy-on-write store are only held in memory, so
+        # they are pickled with it
+        copy = pickle.loads(pickle.dumps(private))
+        self.assertEqual(copy.mode, "c")
+        self.assertEqual(copy[(1, 1)], 4)
+        self.assertEqual(MappedCellStore(self.path, mode="r")[(1, 1)], 3)
+
+    def test_map_tiles(self):
+        store = MappedCellStore(self.path, (10, 7), dtype="i")
+
+        self.assertEqual(len(list(store.tiles(4))), 6)
+
+        store.map_tiles(lambda values: values + 1, tile_size=4)
+        np.testing.assert_array_equal(store.to_array(),
+                                      np.ones((10, 7), dtype="i"))
+
+
+@unittest.skipIf(np is None or shared_memory is None,
+                 "requires NumPy and Python 3.8+")
+class TestSharedCellStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = SharedCellStore(np.arange(12.).reshape(3, 4))
+
+    def tearDown(self):
+        self.store.release()
+
+    def test_mapping(self):
+        self.assertTrue(self.store.shared)
+        self.assertEqual(self.store[(1, 2)], 6)
+        self.assertEqual(self.store[5], 5)
+        self.assertEqual(len(self.store), 11)
+        self.assertNotIn((0, 0), self.store)
+        self.assertEqual(self.store.get((0, 0), -1), -1)
+
+    def test_copy_on_write(self):
+        attached = SharedCellStore.attach(self.store.handle)
+        self.assertEqual(attached[(2, 3)], 11)
+
+        attached[(2, 3)] = 50
+        self.assertFalse(attached.shared)
+        self.assertEqual(attached[(2, 3)], 50)
+        self.assertEqual(self.store[(2, 3)], 11)
+
+        self.store.writable()[...] = 1
+        self.assertEqual(self.store.to_array().sum(), 12)
+        self.assertEqual(SharedCellStore.attach(self.store.handle)[(2, 3)],
+                         11)
+
+    def test_arrays_outlive_store(self):
+        values = SharedCellStore.attach(self.store.handle).array[1:]
+        gc.collect()
+
+        self.assertEqual(values.sum(), 60)
+
+    def test_pickle_stores_values(self):
+        copy = pickle.loads(pickle.dumps(self.store))
+
+        self.assertFalse(copy.shared)
+        self.assertRaises(ValueError, getattr, copy, "handle")
+        np.testing.assert_array_equal(copy.array, self.store.array)
+
+    def test_attach_from_another_process(self):
+        handle = self.store.handle
+
+        for _ in range(2):
+            output = subprocess.check_output(
+                [sys.executable, "-c", ATTACH_SCRIPT, repr(handle)],
+                cwd=os.path.dirname(os.path.dirname(__file__)) or ".")
+            self.assertEqual(float(output), 66)
+
+        self.assertEqual(self.store[(0, 0)], 0)
+
+    def test_release(self):
+        handle = self.store.handle
+        self.store.release()
+
+        self.assertFalse(self.store.shared)
+        self.assertEqual(self.store[(1, 1)], 5)
+        self.assertRaises(FileNotFoundError, SharedCellStore.attach, handle)
+
+
+if __name__ == '__main__':
+    unittest.main()
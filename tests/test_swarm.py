@@ -0,0 +1,63 @@
+import unittest
+
+from panaxea.core.Model import Model
+from panaxea.core.Numerics import np
+from panaxea.core.Swarm import ParticleSwarm, Swarm
+
+
+@unittest.skipIf(np is None, "requires NumPy")
+class TestSwarm(unittest.TestCase):
+
+    def test_swarm_moves_particles(self):
+        model = Model(5)
+        swarm = Swarm([[0., 0.], [1., 1.]], velocities=[[1., 0.], [0., 2.]])
+        model.schedule.helpers.append(swarm)
+
+        def drag(swarm, model):
+            swarm.velocities *= 0.5
+
+        swarm.add_rule(drag)
+        model.schedule.step_schedule(model)
+
+        self.assertEqual(swarm.positions.tolist(), [[0.5, 0.], [1., 2.]])
+        self.assertEqual(len(swarm), 2)
+        self.assertEqual(swarm.dimensions, 2)
+
+    def test_swarm_bounds(self):
+        positions = [[9.5, 0.5], [-0.5, 5.]]
+        velocities = [[1., 0.], [-1., 0.]]
+
+        swarm = Swarm(positions, velocities, [0., 0.], [10., 10.])
+        swarm.step_main(None)
+        self.assertEqual(swarm.positions.tolist(), [[10., 0.5], [0., 5.]])
+
+        swarm = Swarm(positions, velocities, [0., 0.], [10., 10.], "wrap")
+        swarm.step_main(None)
+        self.assertEqual(swarm.positions.tolist(), [[0.5, 0.5], [8.5, 5.]])
+
+        swarm = Swarm(positions, velocities, [0., 0.], [10., 10.],
+                      "reflect")
+        swarm.step_main(None)
+        self.assertEqual(swarm.positions.tolist(), [[9.5, 0.5], [1.5, 5.]])
+        self.assertEqual(swarm.velocities.tolist(), [[-1., 0.], [1., 0.]])
+
+        self.assertRaises(ValueError, Swarm, positions, lower=[0., 0.])
+        self.assertRaises(ValueError, Swarm, positions, boundary="bounce")
+
+    def test_particle_swarm_converges(self):
+        model = Model(50)
+        target = np.array([12., 12.])
+
+        def fitness(positions):
+            return -np.sqrt(((positions - target) ** 2).sum(axis=1))
+
+        rng = np.random.default_rng(0)
+        swarm = ParticleSwarm(rng.uniform(0, 500, (200, 2)), fitness,
+                              lower=[0., 0.], upper=[499., 499.], seed=0)
+        model.schedule.helpers.append(swarm)
+        model.run()
+
+        self.assertTrue(np.all(np.abs(swarm.global_best_position - target)
+                               < 1.))
+        self.assertTrue(np.all(
+            swarm.best_fitness <= swarm.global_best_fitness))
@@ -1,8 +1,18 @@
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
 
+from panaxea.core.Environment import CoarseNumericalGrid2D, \
+    LatticeGrid2D, NumericalGrid2D, ObjectGrid2D
 from panaxea.core.Model import Model
-from tests.resources.SampleSteppables import AgentX, AgentY, AgentZ
-from panaxea.toolkit.Toolkit import AgentSummary
+from panaxea.core.Numerics import np
+from tests.resources.SampleSteppables import AgentX, AgentY, AgentZ, \
+    SampleHelper
+from panaxea.toolkit import Snapshot, Toolkit
+from panaxea.toolkit.Toolkit import AgentSummary, ModelPickler, \
+    ModelPicklerLite, depickle_from_lite
 
 
 class TestToolkit(unittest.TestCase):
@@ -25,6 +35,290 @@ class TestToolkit(unittest.TestCase):
         self.assertEqual(summary['AgentY'], 2)
         self.assertEqual(summary['AgentZ'], 1)
 
+    def test_picklers_without_snapshots(self):
+        # Python versions before 3.8 can not write snapshots
+        directory = tempfile.mkdtemp()
+        snapshot = Toolkit.Snapshot
+
+        try:
+            Toolkit.Snapshot = None
+            model = Model(3)
+            model.schedule.helpers.append(ModelPickler(directory))
+            model.schedule.helpers.append(
+                ModelPicklerLite(directory, prefix="lite"))
+            model.run()
+
+            model = depickle_from_lite(
+                os.path.join(directory, "lite_epoch_2.pickle"))
+            self.assertEqual(model.current_epoch, 2)
+            self.assertTrue(os.path.exists(
+                os.path.join(directory, "epoch_2.pickle")))
+
+            self.assertRaises(ImportError, ModelPicklerLite, directory,
+                              snapshot=True)
+            self.assertRaises(ImportError, ModelPickler, directory,
+                              catalog=True)
+        finally:
+            Toolkit.Snapshot = snapshot
+            shutil.rmtree(directory)
+
+    def test_depickle_old_pickles(self):
+        # Pickles written before boundary modes did not record them, nor
+        # the size of grids as a tuple
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "old.pickle")
+
+        try:
+            model = Model(5)
+            env = NumericalGrid2D("oxygen", 10, 10, model)
+            env.grid = {(0, 1): 4}
+            _forget(env, "boundary", "_size", "_flat_offset_cache")
+
+            agents = ObjectGrid2D("agents", 10, 10, model)
+            agent = AgentX()
+            agent.add_agent_to_grid("agents", (0, 0), model)
+            model.schedule.agents.add(agent)
+            agents.grid = {(0, 0): set([agent])}
+            _forget(agents, "boundary", "_size", "_flat_offset_cache",
+                    "_chunked", "occupancy", "capacity", "synchronous_moves",
+                    "move_policy", "move_intents")
+            _forget(model, "stop_conditions", "stop_reason",
+                    "checkpoint_path", "checkpoint_every", "start_epoch",
+                    "pause_gc", "full_gc_every")
+            _forget(model.schedule, "pool")
+
+            with open(path, "wb") as output_file:
+                pickle.dump(model, output_file)
+
+            model = depickle_from_lite(path)
+            env = model.environments["oxygen"]
+
+            self.assertEqual(env.boundary, "clip")
+            self.assertEqual(env.get_max_in_neigh((0, 0)), (0, 1))
+            self.assertEqual(sorted(env.get_moore_neighbourhood((9, 9))),
+                             [(8, 8), (8, 9), (9, 8)])
+
+            agents = model.environments["agents"]
+            agent = model.schedule.agents.pop()
+
+            self.assertEqual(agents.get_population((0, 0)), 1)
+            self.assertTrue(agent.move_agent("agents", (1, 1), model))
+            self.assertNotEqual(
+                agents.get_least_populated_moore_neigh((0, 0)), (1, 1))
+            self.assertEqual(agents.get_population((1, 1)), 1)
+            self.assertEqual(len(agents.get_moore_neighbourhood((0, 0))), 3)
+
+            model.schedule.agents.add(agent)
+            model.add_stop_condition(lambda m: m.current_epoch == 2)
+            model.run()
+            self.assertEqual(model.current_epoch, 2)
+            self.assertEqual(Model(5).stop_conditions, [])
+        finally:
+            shutil.rmtree(directory)
+
+
+def _forget(obj, *names):
+    """
+    Removes attributes from an object, as pickles written by earlier
+    versions lack them.
+    """
+    for name in names:
+        del obj.__dict__[name]
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.excluded_fields = dict(Snapshot._excluded_fields)
+        self.excluded_classes = set(Snapshot._excluded_classes)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        Snapshot._excluded_fields.clear()
+        Snapshot._excluded_fields.update(self.excluded_fields)
+        Snapshot._excluded_classes.clear()
+        Snapshot._excluded_classes.update(self.excluded_classes)
+        Snapshot._fields_cache.clear()
+
+    def build_model(self):
+        model = Model(5)
+        model.properties = {"agents": {"x": {"react": len, "rate": 2}}}
+
+        ObjectGrid2D("agents", 10, 10, model)
+        numbers = NumericalGrid2D("numbers", 10, 10, model)
+        numbers.grid[(1, 2)] = 3
+
+        for i in range(3):
+            agent = AgentX()
+            agent.flag = lambda: i
+            agent.add_agent_to_grid("agents", (i, i), model)
+            model.schedule.agents.add(agent)
+
+        model.schedule.helpers.append(SampleHelper())
+        return model
+
+    def test_exclusions(self):
+        model = self.build_model()
+        Snapshot.exclude_fields(AgentX, "flag")
+        Snapshot.exclude_class(SampleHelper)
+
+        pickler = ModelPicklerLite(self.directory, pickle_schedule=True,
+                                   pickle_envs=True,
+                                   exclude_properties=[("agents", "x",
+                                                        "react")])
+        pickler.pickle_model(model)
+        model_lite = depickle_from_lite(
+            os.path.join(self.directory, "epoch_0.pickle"))
+
+        self.assertEqual(len(model_lite.schedule.agents), 3)
+        self.assertEqual(model_lite.schedule.helpers, [])
+        self.assertTrue(all([a.flag is None
+                             for a in model_lite.schedule.agents]))
+        self.assertEqual(model_lite.properties["agents"]["x"],
+                         {"react": None, "rate": 2})
+        self.assertEqual(model_lite.environments["numbers"].grid[(1, 2)], 3)
+        self.assertEqual(model_lite.environments["agents"].get_population(
+            (1, 1)), 1)
+
+        # The live model is left untouched
+        self.assertEqual(model.properties["agents"]["x"]["react"], len)
+        self.assertTrue(all([a.flag is not None
+                             for a in model.schedule.agents]))
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_snapshot_file(self):
+        model = self.build_model()
+        Snapshot.exclude_fields(AgentX, "flag")
+        lattice = LatticeGrid2D("lattice", 20, 30, model)
+        lattice.current[...] = np.arange(600).reshape(20, 30)
+
+        path = os.path.join(self.directory, "model.snapshot")
+        model.properties = {}
+        Snapshot.save_snapshot(model, path)
+
+        self.assertTrue(Snapshot.is_snapshot(path))
+
+        with open(path, "rb") as f:
+            index = Snapshot.read_index(f.read())
+
+        # Both lattice buffers and the occupancy counts are out-of-band
+        self.assertEqual(len(index["buffers"]), 3)
+        self.assertTrue(all([o % Snapshot.ALIGNMENT == 0
+                             for o, _ in index["buffers"]]))
+
+        restored = depickle_from_lite(path)
+
+        np.testing.assert_array_equal(
+            restored.environments["lattice"].current, lattice.current)
+        self.assertEqual(restored.environments["agents"].get_population(
+            (2, 2)), 1)
+        self.assertEqual(len(restored.schedule.agents), 3)
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_snapshot_reader(self):
+        model = self.build_model()
+        Snapshot.exclude_fields(AgentX, "flag")
+        lattice = LatticeGrid2D("lattice", 20, 30, model)
+        lattice.current[...] = np.arange(600).reshape(20, 30)
+
+        agent = AgentY()
+        agent.size = 2.5
+        agent.add_agent_to_grid("agents", (1, 1), model)
+        model.schedule.agents_to_schedule.add(agent)
+
+        pickler = ModelPicklerLite(self.directory, pickle_schedule=True,
+                                   pickle_envs=True, snapshot=True,
+                                   tables=True)
+        pickler.pickle_model(model)
+        path = os.path.join(self.directory, "epoch_0.pickle")
+
+        with Snapshot.SnapshotReader(path) as reader:
+            self.assertEqual(reader.grids, ["agents", "lattice", "numbers"])
+            self.assertEqual(reader.columns, ["agents/position", "class",
+                                              "lattice/position",
+                                              "numbers/position", "size"])
+
+            np.testing.assert_array_equal(reader.grid("lattice")[2:4, 5:7],
+                                          [[65, 66], [95, 96]])
+            self.assertEqual(reader.grid("numbers")[1, 2], 3.)
+            self.assertEqual(reader.grid("agents")[1, 1], 2)
+
+            agents = reader.agents(class_name="AgentX")
+            self.assertEqual(sorted(agents["agents/position"].tolist()),
+                             [[0, 0], [1, 1], [2, 2]])
+            self.assertTrue(np.isnan(agents["size"]).all())
+            self.assertEqual(reader.agents(["size"], "AgentY")["size"],
+                             [2.5])
+
+            restored = reader.load()
+            self.assertEqual(len(restored.schedule.agents), 4)
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_coarse_grid_table(self):
+        model = self.build_model()
+        oxygen = CoarseNumericalGrid2D("oxygen", 10, 10, model, 4, fill=1.)
+
+        table = Snapshot.build_tables(model)["grids/oxygen"]
+
+        self.assertEqual(table.shape, (3, 3))
+        np.testing.assert_array_equal(table, oxygen.field)
+
+    def test_catalog(self):
+        model = Model(4)
+        model.schedule.helpers.append(ModelPickler(
+            self.directory, catalog=True,
+            statistics={"epoch_squared": lambda m: m.current_epoch ** 2}))
+        ObjectGrid2D("agents", 5, 5, model)
+
+        # The agent joins the schedule at the first epoch
+        model.schedule.agents_to_schedule.add(AgentX())
+        model.run()
+
+        catalog = Snapshot.Catalog(self.directory)
+        entries = catalog.entries()
+
+        self.assertEqual([e["epoch"] for e in entries], [0, 1, 2, 3])
+        self.assertEqual(catalog.series("epoch_squared"),
+                         [(0, 0), (1, 1), (2, 4), (3, 9)])
+        self.assertEqual(catalog.value(entries[0], "classes/AgentX"), 1)
+        self.assertIsNone(catalog.value(entries[0], "classes/AgentY"))
+        self.assertEqual(catalog.peak("epoch_squared")["epoch"], 3)
+        self.assertTrue(all([e["size"] > 0 for e in entries]))
+
+        if np is not None:
+            self.assertEqual(catalog.value(entries[0], "grids/agents/max"),
+                             0)
+
+        loaded = [(e["epoch"], m.current_epoch)
+                  for e, m in catalog.iter_models(where=lambda e: e[
+                      "statistics"]["epoch_squared"] > 3)]
+        self.assertEqual(loaded, [(2, 2), (3, 3)])
+        self.assertEqual(len(catalog.load(1).schedule.agents), 1)
+
+        # A line cut short by a killed run is skipped
+        with open(catalog.path, "a") as catalog_file:
+            catalog_file.write('{"epoch": 4, "fi')
+        self.assertEqual(len(catalog.entries()), 4)
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_catalog_snapshot_sections(self):
+        model = self.build_model()
+        Snapshot.exclude_fields(AgentX, "flag")
+        pickler = ModelPicklerLite(self.directory, pickle_envs=True,
+                                   snapshot=True, tables=True, catalog=True)
+        pickler.pickle_model(model)
+
+        entry = Snapshot.Catalog(self.directory).entries()[0]
+        offset, length = entry["sections"]["grids/numbers"]
+
+        with open(os.path.join(self.directory, entry["file"]), "rb") as f:
+            f.seek(offset)
+            grid = np.frombuffer(f.read(length)).reshape(10, 10)
+
+        self.assertEqual(grid[1, 2], 3.)
+        self.assertEqual(entry["statistics"]["agents"], 3)
+
 
 if __name__ == '__main__':
     unittest.main()